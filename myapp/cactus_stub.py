@@ -0,0 +1,84 @@
+"""Local stand-in for the NCI Cactus stdinchikey service, to run the InChIKey resolver offline.
+
+    python -m myapp.cactus_stub 8001
+
+then point the resolver to it in settings.py:
+
+    CACTUS_URL = "http://127.0.0.1:8001/chemical/structure/{}/stdinchikey"
+
+Like Cactus it answers "InChIKey=..." for the CAS numbers it knows and 404 for
+the others. The CAS numbers in ERRORS answer 500, to test network failures.
+"""
+
+import re
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote
+
+INCHIKEYS = {
+    '71-43-2': 'UHOVQNZJYSORNB-UHFFFAOYSA-N',   # benzene
+    '50-00-0': 'WSFSSNUMVMOOMR-UHFFFAOYSA-N',   # formaldehyde
+    '68-12-2': 'ZMXDDKWLCZADIW-UHFFFAOYSA-N',   # N,N-dimethylformamide
+    '108-94-1': 'JHIVVAPYMSGYDF-UHFFFAOYSA-N',  # cyclohexanone
+    '64-67-5': 'DENRZWYUOJLTMF-UHFFFAOYSA-N',   # diethyl sulfate
+}
+ERRORS = {'0-00-0'}
+
+PATH_RE = re.compile(r'^/chemical/structure/(?P<cas>[^/]+)/stdinchikey$')
+
+
+class CactusStubHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        match = PATH_RE.match(self.path)
+        cas_rn = unquote(match.group('cas')) if match else None
+        if cas_rn in ERRORS:
+            self.answer(500, "Internal Server Error")
+        elif cas_rn in self.server.inchikeys:
+            self.answer(200, f"InChIKey={self.server.inchikeys[cas_rn]}")
+        else:
+            self.answer(404, "Page not found (404)")
+
+    def answer(self, code, text):
+        body = text.encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class CactusStubServer(ThreadingHTTPServer):
+    """Cactus stand-in; keeps the paths it was asked in .requests."""
+    daemon_threads = True
+
+    def __init__(self, port=0, inchikeys=None):
+        super().__init__(('127.0.0.1', port), CactusStubHandler)
+        self.inchikeys = INCHIKEYS if inchikeys is None else inchikeys
+        self.requests = []
+        self.thread = None
+
+    @property
+    def url(self):
+        """Value of settings.CACTUS_URL pointing to this server."""
+        return f"http://127.0.0.1:{self.server_address[1]}/chemical/structure/{{}}/stdinchikey"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+if __name__ == '__main__':
+    server = CactusStubServer(int(sys.argv[1]) if len(sys.argv) > 1 else 8001)
+    print(f"Cactus stand-in on {server.url}")
+    server.serve_forever()
@@ -0,0 +1,89 @@
+"""P/N/E evidence counts and summary calls, computed for all substances of a source at once.
+
+Several sources summarize their test outcomes the same way: the number of positive,
+negative and equivocal outcomes of a substance (or of a substance and test system)
+and a summary call decided from these counts. The outcomes of every row are encoded
+once as small integer codes, a bit each for positive, negative and equivocal, then
+the counts of every group are NumPy sums of these bits:
+
+    codes = evidence.encode(df['Results'], ('POSITIVE', 'NEGATIVE', 'EQUIVOCAL'))
+    table = evidence.summarize(df.groupby('INCHI_key'), codes)
+    table['Summary call'] = evidence.calls(table[evidence.COUNT_COLUMNS].to_numpy())
+
+An outcome can set several bits ('positive / negative' counts as both), as the
+str.contains counts the sources used before did; with exclusive=True only the first
+match counts (the '+', '-', 'E' calls of the ECVAM tables).
+"""
+
+import numpy as np
+import pandas as pd
+
+POSITIVE, NEGATIVE, EQUIVOCAL = 1, 2, 4
+FLAGS = np.array([POSITIVE, NEGATIVE, EQUIVOCAL], dtype=np.int8)
+COUNT_COLUMNS = ['positives', 'negatives', 'equivocals']
+
+
+def encode(outcomes, patterns, case=False, exclusive=False):
+    """Encodes outcome cells as int8 codes.
+
+    outcomes: a Series, or a DataFrame for several outcomes per row (codes of shape rows x columns).
+    patterns: the regular expressions of the positive, negative and equivocal outcomes, searched in str(cell).
+    exclusive: a cell is only the first of positive, negative, equivocal it matches.
+    """
+    if isinstance(outcomes, pd.DataFrame):
+        return np.column_stack([encode(outcomes[col], patterns, case, exclusive) for col in outcomes.columns]
+                               or [np.zeros(len(outcomes), dtype=np.int8)])
+    text = outcomes.astype(str).str
+    codes = np.zeros(len(outcomes), dtype=np.int8)
+    for flag, pattern in zip(FLAGS, patterns):
+        match = np.array(text.contains(pattern, case=case, regex=True), dtype=bool)  # a writable copy, even with copy-on-write
+        if exclusive:
+            match &= codes == 0
+        codes[match] |= flag
+    return codes
+
+
+def count(codes, groups=None, ngroups=None):
+    """P/N/E counts of codes, as int64 arrays of [positives, negatives, equivocals].
+
+    Without groups the counts are taken over the last axis: one row of counts for 1-D
+    codes, one per row for 2-D codes. With groups (the group number of every code,
+    negative for codes of no group) there is one row of counts per group number.
+    """
+    bits = (codes[..., None] & FLAGS) != 0
+    if groups is None:
+        return bits.sum(axis=-2, dtype=np.int64)
+    groups = np.asarray(groups)
+    valid = groups >= 0
+    return np.column_stack([np.bincount(groups[valid], weights=bits[valid, i], minlength=ngroups)
+                            for i in range(len(FLAGS))]).astype(np.int64)
+
+
+def summarize(grouped, codes):
+    """Counts the codes of the rows of every group of a pandas GroupBy.
+
+    Returns a DataFrame of the group keys and the COUNT_COLUMNS, in the group order of grouped.
+    """
+    groups = grouped.ngroup().fillna(-1).to_numpy(dtype=np.int64)  # rows of no group (NaN keys)
+    table = grouped.size().index.to_frame(index=False)
+    table[COUNT_COLUMNS] = count(codes, groups, grouped.ngroups)
+    return table
+
+
+def calls(counts, negative_with_equivocal='Equivocal', equivocal_only='N/D'):
+    """Summary call of every row of counts.
+
+    Positive and negative outcomes are 'Conflicted', positive only 'Positive', negative
+    only 'Negative'. Negative and equivocal outcomes give negative_with_equivocal,
+    equivocal only equivocal_only, and no outcome 'N/D'.
+    """
+    counts = np.atleast_2d(counts)
+    p, n, e = counts[:, 0], counts[:, 1], counts[:, 2]
+    return np.select([(p != 0) & (n != 0), p != 0, (n != 0) & (e == 0), n != 0, e != 0],
+                     np.array(['Conflicted', 'Positive', 'Negative', negative_with_equivocal, equivocal_only], dtype=object),
+                     default='N/D')
+
+
+def format_counts(counts, template="P/N/E= {} / {} / {}"):
+    """Formats every row of counts with template, e.g. 'P/N/E= 1 / 0 / 2'."""
+    return [template.format(*row) for row in np.atleast_2d(counts).tolist()]
@@ -0,0 +1,201 @@
+"""SQLite queue of the bulk screening jobs.
+
+A screening job is a list of CAS numbers (an uploaded CSV) answered in the
+background by worker processes (python manage.py screening_worker), so that
+large screenings do not tie up the web workers. Everything lives in one SQLite
+file (settings.JOBS_DB), no other service is needed:
+
+    jobs   one row per job: status, progress (CAS numbers done, current CAS
+           numbers and source), worker and heartbeat, output files
+    items  one row per CAS number of a job: its result, zlib-compressed JSON,
+           once it is screened
+
+A worker claims a queued job and screens its pending CAS numbers chunk by chunk;
+the results of a chunk are written in one transaction (the checkpoint). A job
+whose worker stopped sending heartbeats (killed, server restarted) is claimed
+again by the next worker and resumes with the CAS numbers not screened yet.
+The output files are written in <JOBS_DIR>/<job id>/ when the job is done.
+"""
+
+import json
+import os
+import sqlite3
+import time
+import uuid
+import zlib
+from contextlib import closing, contextmanager
+
+from django.conf import settings
+
+QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+
+
+class JobLost(Exception):
+    """The job was taken over by another worker (this one was thought dead)."""
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    details TEXT,
+    filename TEXT,
+    invalid TEXT NOT NULL DEFAULT '[]',
+    total INTEGER NOT NULL,
+    done INTEGER NOT NULL DEFAULT 0,
+    hits INTEGER NOT NULL DEFAULT 0,
+    progress TEXT NOT NULL DEFAULT '{}',
+    files TEXT NOT NULL DEFAULT '[]',
+    error TEXT,
+    worker TEXT,
+    heartbeat REAL,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created);
+CREATE TABLE IF NOT EXISTS items (
+    job_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    cas_rn TEXT NOT NULL,
+    done INTEGER NOT NULL DEFAULT 0,
+    hit INTEGER,
+    result BLOB,
+    PRIMARY KEY (job_id, position)
+);
+"""
+
+
+def jobs_db():
+    return str(getattr(settings, 'JOBS_DB', os.path.join(settings.BASE_DIR, 'jobs.sqlite3')))
+
+
+def jobs_dir():
+    return str(getattr(settings, 'JOBS_DIR', os.path.join(settings.BASE_DIR, 'myproject', 'jobs')))
+
+
+def job_dir(job_id):
+    """Folder of the output files of a job."""
+    return os.path.join(jobs_dir(), job_id)
+
+
+def stale_after():
+    """Seconds without heartbeat after which a running job is taken over by another worker."""
+    return getattr(settings, 'JOBS_STALE_AFTER', 300)
+
+
+def connect():
+    """Opens the queue (autocommit: transactions are explicit), creating it if needed."""
+    conn = sqlite3.connect(jobs_db(), timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode=WAL')  # readers (progress) do not wait for the workers
+    conn.executescript(SCHEMA)
+    return conn
+
+
+@contextmanager
+def transaction(conn):
+    """Write transaction, the database lock taken at once so concurrent workers never deadlock."""
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        yield conn
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    conn.execute('COMMIT')
+
+
+def encode_result(content):
+    """Compresses the JSON of a result (bytes)."""
+    return zlib.compress(content, 6)
+
+
+def decode_result(blob):
+    return zlib.decompress(blob) if blob is not None else None
+
+
+def create_job(cas_rns, invalid=(), details=None, filename=None):
+    """Queues the screening of a list of valid CAS numbers; returns the id of the job."""
+    job_id = uuid.uuid4().hex
+    with closing(connect()) as conn, transaction(conn):
+        conn.execute('INSERT INTO jobs (id, status, details, filename, invalid, total, created) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                     (job_id, QUEUED, details, filename, json.dumps(list(invalid)), len(cas_rns), time.time()))
+        conn.executemany('INSERT INTO items (job_id, position, cas_rn) VALUES (?, ?, ?)',
+                         ((job_id, position, cas_rn) for position, cas_rn in enumerate(cas_rns)))
+    return job_id
+
+
+def row_to_job(row):
+    job = dict(row)
+    for key in ('invalid', 'progress', 'files'):
+        job[key] = json.loads(job[key])
+    return job
+
+
+def get_job(job_id):
+    """Returns the job as a dict (None if there is no such job)."""
+    with closing(connect()) as conn:
+        row = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+    return row_to_job(row) if row is not None else None
+
+
+def claim_job(worker):
+    """Gives the oldest queued job, or a running one whose worker is gone, to worker (None if there is none)."""
+    now = time.time()
+    with closing(connect()) as conn, transaction(conn):
+        row = conn.execute('SELECT * FROM jobs WHERE status = ? OR (status = ? AND heartbeat < ?) ORDER BY created LIMIT 1',
+                           (QUEUED, RUNNING, now - stale_after())).fetchone()
+        if row is None:
+            return None
+        conn.execute('UPDATE jobs SET status = ?, worker = ?, heartbeat = ?, started = COALESCE(started, ?) WHERE id = ?',
+                     (RUNNING, worker, now, now, row['id']))
+    job = row_to_job(row)
+    job.update(status=RUNNING, worker=worker)
+    return job
+
+
+def pending_items(job_id, limit):
+    """The next CAS numbers of a job not screened yet: [(position, CAS)]."""
+    with closing(connect()) as conn:
+        rows = conn.execute('SELECT position, cas_rn FROM items WHERE job_id = ? AND done = 0 ORDER BY position LIMIT ?',
+                            (job_id, limit)).fetchall()
+    return [(row['position'], row['cas_rn']) for row in rows]
+
+
+def set_progress(job_id, worker, progress):
+    """Records where the worker is (and its heartbeat); False if the job is not the worker's any more."""
+    with closing(connect()) as conn, transaction(conn):
+        cursor = conn.execute('UPDATE jobs SET progress = ?, heartbeat = ? WHERE id = ? AND worker = ? AND status = ?',
+                              (json.dumps(progress), time.time(), job_id, worker, RUNNING))
+    return cursor.rowcount == 1
+
+
+def save_results(job_id, worker, results):
+    """Checkpoint: stores the results of screened CAS numbers, [(position, hit, JSON bytes or None)].
+
+    Returns False, storing nothing, if the job was taken over by another worker.
+    """
+    with closing(connect()) as conn, transaction(conn):
+        if conn.execute('SELECT 1 FROM jobs WHERE id = ? AND worker = ? AND status = ?', (job_id, worker, RUNNING)).fetchone() is None:
+            return False
+        conn.executemany('UPDATE items SET done = 1, hit = ?, result = ? WHERE job_id = ? AND position = ? AND done = 0',
+                         ((int(hit), encode_result(content) if content is not None else None, job_id, position)
+                          for position, hit, content in results))
+        conn.execute('UPDATE jobs SET done = (SELECT COUNT(*) FROM items WHERE job_id = ? AND done = 1), '
+                     'hits = (SELECT COUNT(*) FROM items WHERE job_id = ? AND hit = 1), heartbeat = ? WHERE id = ?',
+                     (job_id, job_id, time.time(), job_id))
+    return True
+
+
+def iter_items(job_id):
+    """The CAS numbers of a job in input order: (CAS, done, hit, result JSON bytes or None)."""
+    with closing(connect()) as conn:
+        for row in conn.execute('SELECT cas_rn, done, hit, result FROM items WHERE job_id = ? ORDER BY position', (job_id,)):
+            yield row['cas_rn'], bool(row['done']), bool(row['hit']), decode_result(row['result'])
+
+
+def finish_job(job_id, worker, status, files=(), error=None):
+    """Marks a job done or failed, with its output files (names in job_dir) or the error."""
+    with closing(connect()) as conn, transaction(conn):
+        conn.execute('UPDATE jobs SET status = ?, files = ?, error = ?, finished = ?, progress = ? WHERE id = ? AND worker = ?',
+                     (status, json.dumps(list(files)), error, time.time(), '{}', job_id, worker))
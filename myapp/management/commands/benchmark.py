@@ -0,0 +1,121 @@
+import gzip
+import json
+import time
+
+import pandas as pd
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+
+from myapp import views
+
+
+def best_time(fn, repeat):
+    """Best wall time of repeat calls of fn, in seconds, and its last result."""
+    best, result = None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def megabytes(df):
+    return df.memory_usage(deep=True).sum() / 1e6
+
+
+class Command(BaseCommand):
+    help = "Times the ingest/query paths of the app against the code they replaced."
+
+    benchmarks = ['oecd', 'payload']
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*', help="Benchmarks to run (default: all). Choices: " + ', '.join(self.benchmarks))
+        parser.add_argument('--repeat', type=int, default=5, help="Runs of each path, the best one is reported.")
+
+    def handle(self, *args, **options):
+        names = options['names'] or self.benchmarks
+        unknown = [name for name in names if name not in self.benchmarks]
+        if unknown:
+            raise CommandError(f"Unknown benchmarks: {', '.join(unknown)}")
+        for name in names:
+            getattr(self, f'benchmark_{name}')(options['repeat'])
+
+    def benchmark_oecd(self, repeat):
+        """OECD 'Values' blob: clean_oecd_* + modify_oecd against parse_oecd_values."""
+        cases = [
+            ('OECD_VIVO', views.OECD_VIVO_FILE, views.clean_oecd_vivo, views.OECD_VIVO_FIELDS,
+             lambda v: v.str.replace('\n\n\n', '\n', regex=False).str.replace('\n\n', '\n', regex=False)),
+            ('OECD_CHROMOSOME', views.OECD_CHROMOSOME_FILE, views.clean_oecd_chromosome, views.OECD_CHROMOSOME_FIELDS,
+             lambda v: v.str.replace(r'\n{2,}', '\n', regex=True)),
+        ]
+        for name, filepath, clean, fields, separators in cases:
+            df = views.load_dataframe(filepath)
+            if df.empty:
+                self.stdout.write(self.style.WARNING(f"{name}: skipped, {filepath} not available"))
+                continue
+
+            legacy_time, legacy = best_time(lambda: views.modify_oecd(clean(df.copy())), repeat)
+            parse_time, long = best_time(lambda: views.parse_oecd_values(df, separators(df['Values']), fields), repeat)
+            wide_time, wide = best_time(lambda: views.oecd_wide_table(df, long, fields), repeat)
+            try:
+                pd.testing.assert_frame_equal(legacy, wide)
+                same = "identical"
+            except AssertionError:
+                same = self.style.ERROR("DIFFERENT")
+
+            self.stdout.write(f"{name}: {len(df)} rows, {len(long)} parsed lines")
+            self.stdout.write(f"  clean_oecd + modify_oecd:   {legacy_time * 1000:8.1f} ms")
+            self.stdout.write(f"  parse_oecd_values:          {parse_time * 1000:8.1f} ms")
+            self.stdout.write(f"  + oecd_wide_table:          {(parse_time + wide_time) * 1000:8.1f} ms  ({same} to the legacy table)")
+            self.stdout.write(f"  memory: wide table {megabytes(legacy):.2f} MB, long table {megabytes(long):.2f} MB")
+
+            # what a request pays now that the parsing happens at ingest
+            numbers = df['Number'].dropna().unique()[:200]
+            lookup_time, _ = best_time(lambda: [views.registry.lookup(name, number) for number in numbers], repeat)
+            scan_time, _ = best_time(lambda: [legacy[legacy['Number'] == number] for number in numbers], repeat)
+            self.stdout.write(f"  per query: index lookup {lookup_time / len(numbers) * 1e6:.0f} us, "
+                              f"table scan {scan_time / len(numbers) * 1e6:.0f} us, "
+                              f"parse per query (before the registry) {legacy_time * 1000:.1f} ms")
+
+    def benchmark_payload(self, repeat, sample=200):
+        """JSON of the answer tables: process_results (orient='split') against prepare_tables + encode_tables (columnar)."""
+        identity = views.registry.table('IDENTITY')
+        if identity.empty:
+            self.stdout.write(self.style.WARNING("payload: skipped, the identity table is not available"))
+            return
+        known = identity.loc[identity['InChIKey'].notna(), 'CAS'].drop_duplicates()  # no Cactus request for these
+        cas_rns = known.iloc[::max(len(known) // sample, 1)].head(sample).tolist()
+        answers = [views.collect_results(cas_rn, 'on', outputs) for cas_rn, (outputs, _, _) in views.run_batch_queries(cas_rns, 'on').items()]
+        answers = [results for results in answers if not views.all_results_empty(results)]  # the answers with data (HTTP 200)
+        renderer = JSONRenderer()
+
+        split_time, split = best_time(lambda: [views.process_results(results) for results in answers], repeat)
+        columnar_time, columnar = best_time(lambda: [views.encode_tables(views.prepare_tables(results)) for results in answers], repeat)
+        split_render_time, split_json = best_time(lambda: [renderer.render({"data": data}) for data in split], repeat)
+        columnar_render_time, columnar_json = best_time(lambda: [renderer.render({"data": data, "strings": strings})
+                                                                 for data, strings in columnar], repeat)
+
+        same = "identical"
+        try:
+            for old, new in zip(split_json, columnar_json):
+                old, new = json.loads(old), json.loads(new)
+                old, new = views.decode_tables(old['data']), views.decode_tables(new['data'], new['strings'])
+                if list(old) != list(new):
+                    raise AssertionError("different tables")
+                for name in old:
+                    for a, b in zip(*(value if isinstance(value, list) else [value] for value in (old[name], new[name]))):
+                        if isinstance(a, dict):
+                            a, b = a["data"], b["data"]
+                        pd.testing.assert_frame_equal(a, b)
+        except AssertionError:
+            same = self.style.ERROR("DIFFERENT")
+
+        def size(contents):
+            return sum(map(len, contents)) / len(contents) / 1000, sum(len(gzip.compress(c, 6)) for c in contents) / len(contents) / 1000
+
+        self.stdout.write(f"payload: {len(answers)} answers of {len(cas_rns)} CAS numbers (details on), per answer:")
+        self.stdout.write(f"  orient='split': encode {split_time / len(answers) * 1000:6.2f} ms, render {split_render_time / len(answers) * 1000:6.2f} ms, "
+                          "{:6.1f} kB ({:.1f} kB gzipped)".format(*size(split_json)))
+        self.stdout.write(f"  columnar:       encode {columnar_time / len(answers) * 1000:6.2f} ms, render {columnar_render_time / len(answers) * 1000:6.2f} ms, "
+                          "{:6.1f} kB ({:.1f} kB gzipped)  ({})".format(*size(columnar_json), same))
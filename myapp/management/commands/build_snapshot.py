@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from myapp import snapshot
+from myapp.views import registry
+
+
+class Command(BaseCommand):
+    help = "Runs the clean/modify pipeline of every source and writes the cleaned tables as a Parquet snapshot."
+
+    def add_arguments(self, parser):
+        parser.add_argument('sources', nargs='*', help="Sources to build (default: all). Choices: " + ', '.join(registry.sources))
+        parser.add_argument('--force', action='store_true', help="Rebuild even if the raw files did not change.")
+
+    def handle(self, *args, **options):
+        names = options['sources'] or list(registry.sources)
+        unknown = [name for name in names if name not in registry.sources]
+        if unknown:
+            raise CommandError(f"Unknown sources: {', '.join(unknown)}")
+
+        self.stdout.write(f"Snapshot folder: {snapshot.snapshot_dir()}")
+        for name in names:
+            checksums = registry.checksums(name)
+            missing = [f for f, checksum in checksums.items() if checksum is None]
+            if missing:
+                self.stdout.write(self.style.WARNING(f"{name}: skipped, missing {', '.join(missing)}"))
+                continue
+            manifest = snapshot.read_manifest(name)
+            if not options['force'] and snapshot.is_current(manifest, checksums, registry.sources[name].get('version', 1)):
+                self.stdout.write(f"{name}: up to date")
+                continue
+            start = time.time()
+            registry.build(name, checksums)
+            self.stdout.write(self.style.SUCCESS(f"{name}: built in {time.time() - start:.1f}s"))
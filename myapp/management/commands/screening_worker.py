@@ -0,0 +1,37 @@
+import multiprocessing
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+def work(once, poll):
+    """Entry point of a worker process."""
+    import django
+    django.setup()  # a no-op when forked, needed when the process is spawned
+    from myapp.views import run_screening_worker
+    run_screening_worker(once=once, poll=poll)
+
+
+class Command(BaseCommand):
+    help = "Screens the CAS numbers of the jobs queued through myapp/api/jobs/ (see myapp/jobs.py)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=getattr(settings, 'JOBS_WORKERS', 2),
+                            help="Worker processes, each screening one job at a time.")
+        parser.add_argument('--once', action='store_true', help="Exit when the queue is empty instead of waiting for new jobs.")
+        parser.add_argument('--poll', type=float, default=2.0, help="Seconds between two looks at an empty queue.")
+
+    def handle(self, *args, **options):
+        from myapp.views import registry
+        registry.load_all()  # before starting the workers: forked processes share the loaded tables
+
+        if options['processes'] <= 1:
+            work(options['once'], options['poll'])
+            return
+        processes = [multiprocessing.Process(target=work, args=(options['once'], options['poll']), name=f'screening_worker_{i}')
+                     for i in range(options['processes'])]
+        for process in processes:
+            process.start()
+        self.stdout.write(f"{len(processes)} screening workers started")
+        for process in processes:
+            process.join()
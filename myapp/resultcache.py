@@ -0,0 +1,170 @@
+"""Two-tier cache of the answers of the process API.
+
+    local   an LRU dict in the memory of the process, bounded by the size of the
+            answers it holds (settings.RESULT_CACHE_LOCAL_BYTES)
+    shared  the Django cache settings.RESULT_CACHE (a DatabaseCache table of its own,
+            see CACHES), seen by every worker process; entries are zlib-compressed
+            JSON and expire after settings.RESULT_CACHE_TTL seconds, in both tiers
+
+An answer found in the shared tier only is copied into the local one. The keys
+(see result_cache_key in views.py) include the fingerprint of the source files
+the answer was computed from: once a changed file is reloaded, the answers of the
+former file are never served again.
+
+The tables of the answers are kept the same way under their result_id (see
+set_tables), zlib-compressed pickles, for the download API: in the Django cache
+settings.RESULT_HANDLE_CACHE (a table of its own, bounded by its MAX_ENTRIES) for
+RESULT_HANDLE_TTL seconds, longer than the answers giving their result_id.
+"""
+
+import json
+import pickle
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DatabaseError
+from rest_framework.renderers import JSONRenderer
+
+
+class LRU:
+    """Thread-safe LRU dict whose entries have a size; the least recently used go when the total is over a bound."""
+
+    def __init__(self):
+        self._entries = OrderedDict()  # key -> (value, size, expiry time or None)
+        self._lock = threading.Lock()
+        self.size = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[2] is not None and entry[2] < time.monotonic():
+                del self._entries[key]
+                self.size -= entry[1]
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, value, size, max_size, timeout=None):
+        """Stores value for timeout seconds (None: until it is evicted)."""
+        if size > max_size:
+            return  # would evict everything else
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+            self._entries[key] = (value, size, None if timeout is None else time.monotonic() + timeout)
+            self.size += size
+            while self.size > max_size:
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self.size -= evicted_size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+local = LRU()
+
+
+def shared_cache():
+    return caches[getattr(settings, 'RESULT_CACHE', 'default')]
+
+
+def tables_cache():
+    return caches[getattr(settings, 'RESULT_HANDLE_CACHE', 'default')]
+
+
+def local_max_bytes():
+    return getattr(settings, 'RESULT_CACHE_LOCAL_BYTES', 64 * 1024 * 1024)
+
+
+def result_timeout():
+    return getattr(settings, 'RESULT_CACHE_TTL', 24 * 3600)
+
+
+def tables_timeout():
+    return getattr(settings, 'RESULT_HANDLE_TTL', 2 * 24 * 3600)
+
+
+def get(key):
+    """Returns the cached (payload, HTTP status) of key, None on a miss."""
+    cached = local.get(key)
+    if cached is not None:
+        return cached
+    try:
+        blob = shared_cache().get(key)
+    except DatabaseError as e:
+        print(f"Result cache not available: {e}")
+        return None
+    if blob is None:
+        return None
+    code, content = blob
+    content = zlib.decompress(content)
+    cached = json.loads(content), code
+    local.put(key, cached, len(content), local_max_bytes(), result_timeout())
+    return cached
+
+
+def set(key, payload, code):
+    """Stores the (payload, HTTP status) of key in both tiers."""
+    content = JSONRenderer().render(payload)  # what the client receives, and its size
+    local.put(key, (payload, code), len(content), local_max_bytes(), result_timeout())
+    try:
+        shared_cache().set(key, (code, zlib.compress(content, 6)), result_timeout())
+    except DatabaseError as e:
+        print(f"Result cache not available: {e}")
+
+
+def set_tables(result_id, value):
+    """Keeps the tables of an answer under its result_id; False if the shared tier is not available."""
+    content = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+    try:
+        tables_cache().set(f"tables:{result_id}", zlib.compress(content, 6), tables_timeout())
+    except DatabaseError as e:
+        print(f"Result cache not available: {e}")
+        return False
+    local.put(f"tables:{result_id}", value, len(content), local_max_bytes(), tables_timeout())
+    return True
+
+
+def get_tables(result_id):
+    """Returns the tables kept under result_id, None if unknown or expired."""
+    key = f"tables:{result_id}"
+    value = local.get(key)
+    if value is not None:
+        return value
+    try:
+        blob = tables_cache().get(key)
+    except DatabaseError as e:
+        print(f"Result cache not available: {e}")
+        return None
+    if blob is None:
+        return None
+    content = zlib.decompress(blob)
+    value = pickle.loads(content)
+    local.put(key, value, len(content), local_max_bytes(), tables_timeout())
+    return value
+
+
+def has_tables(result_id):
+    """Whether the tables of result_id are still kept (without reading them)."""
+    key = f"tables:{result_id}"
+    if local.get(key) is not None:
+        return True
+    try:
+        return tables_cache().has_key(key)
+    except DatabaseError as e:
+        print(f"Result cache not available: {e}")
+        return False
+
+
+def clear():
+    """Empties the local tier of this process (the shared tier is cleared with its Django cache)."""
+    local.clear()
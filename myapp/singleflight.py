@@ -0,0 +1,121 @@
+"""Single-flight execution of identical computations.
+
+Concurrent calls of do() with the same key run the computation once:
+
+    threads    the first thread computes, the others wait for it and share its
+               result (or its exception)
+    processes  the computing process holds a lock in a shared Django cache
+               (cache.add is atomic); the other processes wait until the answer
+               appears where lookup() finds it (the result cache) instead of
+               computing it again. If the lock goes away without an answer (the
+               answer could not be cached, or its process died) the next waiting
+               process takes the lock and computes it. The lock holds a token of
+               its holder, which releases it only if it is still its own (it
+               expires after SINGLE_FLIGHT_WAIT and may be another process's by
+               then).
+
+Nobody waits more than settings.SINGLE_FLIGHT_WAIT seconds: after that a waiting
+call computes the answer itself.
+"""
+
+import os
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DatabaseError
+
+
+class Flight:
+    """A computation in progress in this process."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+_flights = {}  # key -> Flight
+_lock = threading.Lock()
+
+
+def lock_cache():
+    """The Django cache of the locks shared by the processes (settings.SINGLE_FLIGHT_CACHE)."""
+    return caches[getattr(settings, 'SINGLE_FLIGHT_CACHE', 'default')]
+
+
+def wait_timeout():
+    return getattr(settings, 'SINGLE_FLIGHT_WAIT', 60)
+
+
+def poll_interval():
+    return getattr(settings, 'SINGLE_FLIGHT_POLL', 0.1)
+
+
+def do(key, compute, lookup=None, cache=None):
+    """Returns compute(), computed once for all the concurrent calls with the same key.
+
+    cache (a Django cache) and lookup (returns the answer once another process
+    computed it, None before) extend the coalescing to the other processes.
+    """
+    with _lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = Flight()
+
+    if not leader:
+        if not flight.done.wait(wait_timeout()):
+            return compute()
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    try:
+        flight.result = compute() if cache is None else across_processes(key, compute, lookup, cache)
+        return flight.result
+    except BaseException as e:
+        flight.error = e
+        raise
+    finally:
+        with _lock:
+            del _flights[key]
+        flight.done.set()
+
+
+def across_processes(key, compute, lookup, cache):
+    """Computes under the lock of key in cache, or waits for the process holding it."""
+    lock_key = f"flight:{key}"
+    token = f"{os.getpid()}:{uuid.uuid4().hex}"
+    deadline = time.monotonic() + wait_timeout()
+    while True:
+        try:
+            acquired = cache.add(lock_key, token, timeout=wait_timeout())
+        except DatabaseError as e:
+            print(f"Single-flight lock not available: {e}")
+            return compute()
+        if acquired:
+            try:
+                return compute()
+            finally:
+                try:
+                    if cache.get(lock_key) == token:  # not yet expired and taken by another process
+                        cache.delete(lock_key)
+                except DatabaseError as e:
+                    print(f"Single-flight lock not released: {e}")
+
+        # another process computes it
+        while time.monotonic() < deadline:
+            time.sleep(poll_interval())
+            result = lookup() if lookup is not None else None
+            if result is not None:
+                return result
+            try:
+                if cache.get(lock_key) is None:
+                    break  # released without an answer that lookup() finds: take the lock
+            except DatabaseError:
+                break
+        else:
+            return compute()
@@ -0,0 +1,215 @@
+"""Parquet snapshot of the cleaned source tables.
+
+Reading and cleaning the Excel workbooks takes seconds, so the cleaned tables of
+every source are written once as Parquet files, one folder per source:
+
+    <SNAPSHOT_DIR>/<source>/manifest.json
+    <SNAPSHOT_DIR>/<source>/<table>-<fingerprint>-v<version>.parquet
+    <SNAPSHOT_DIR>/<source>/prepared-<fingerprint>-v<version>.pickle
+
+The pickle holds what the 'prepare' function of the source computed from the
+tables (precomputed query results), if it has one. Its dicts, e.g. {CAS: tables},
+are stored as PickledValues: reading the snapshot only reads their bytes, and the
+value of a key is unpickled when it is first used.
+
+The manifest stores the sha256 checksum of every raw file the source is built
+from and the version of its loader (SOURCES[name]['version'], to be increased
+when the tables a loader returns change); for a source built from the tables of
+other sources, the checksums also hold the versions of their loaders. A snapshot is only used while both
+still match, otherwise the source is rebuilt from the raw files (see SourceRegistry in views.py and the
+build_snapshot management command).
+"""
+
+import hashlib
+import json
+import os
+import pickle
+from collections.abc import Mapping
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+
+
+def snapshot_dir():
+    return str(getattr(settings, 'SNAPSHOT_DIR', os.path.join(settings.BASE_DIR, 'myproject', 'snapshot')))
+
+
+def file_checksum(filepath):
+    """Returns the sha256 of a file, None if the file does not exist."""
+    if not os.path.exists(filepath):
+        return None
+    sha = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def file_checksums(files):
+    """Returns {file name: sha256} for the raw files of a source."""
+    return {os.path.basename(f): file_checksum(f) for f in files}
+
+
+def file_stats(files):
+    """Returns {file path: (size, mtime)}, a cheap way to notice changed files before computing checksums."""
+    stats = {}
+    for f in files:
+        try:
+            st = os.stat(f)
+            stats[f] = (st.st_size, st.st_mtime_ns)
+        except OSError:
+            stats[f] = None
+    return stats
+
+
+def fingerprint(checksums):
+    """Short digest identifying one version of all the raw files of a source."""
+    joined = '|'.join(f"{name}:{checksums[name]}" for name in sorted(checksums))
+    return hashlib.sha256(joined.encode()).hexdigest()[:16]
+
+
+def _encode_frame(df):
+    """Makes a cleaned frame writable as Parquet without losing any value.
+
+    Object columns holding only strings are stored as they are, remembering if
+    their empty cells were NaN or None. Object columns mixing types (e.g. int and
+    str in the IARC 'Volume' column) are stored as pickled cells.
+    """
+    df = df.copy()
+    nan_nulls, pickled = [], []
+    for col in df.columns:
+        if df[col].dtype != object:
+            continue
+        s = df[col]
+        isna = s.isna()
+        value_types = {type(x) for x in s[~isna]}
+        null_types = {type(x) for x in s[isna]}
+        if value_types <= {str} and len(null_types) <= 1:
+            if float in null_types:
+                nan_nulls.append(col)
+        else:
+            df[col] = [pickle.dumps(x) for x in s]
+            pickled.append(col)
+    return df, {'nan_nulls': nan_nulls, 'pickled': pickled}
+
+
+def _decode_frame(df, encoding):
+    for col in encoding['pickled']:
+        df[col] = pd.Series([pickle.loads(x) for x in df[col]], index=df.index, dtype=object)
+    for col in encoding['nan_nulls']:
+        df[col] = df[col].astype(object).where(df[col].notna(), np.nan)
+    return df
+
+
+class PickledValues(Mapping):
+    """A read-only dict whose values are kept pickled, each one unpickled when it is first read."""
+
+    def __init__(self, values):
+        self._pickled = {key: pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL) for key, value in values.items()}
+        self._values = {}
+
+    def __getitem__(self, key):
+        try:
+            return self._values[key]
+        except KeyError:
+            value = self._values[key] = pickle.loads(self._pickled[key])  # two threads may both unpickle it: same value
+            return value
+
+    def __contains__(self, key):
+        return key in self._pickled
+
+    def __iter__(self):
+        return iter(self._pickled)
+
+    def __len__(self):
+        return len(self._pickled)
+
+    def __getstate__(self):
+        return {'_pickled': self._pickled, '_values': {}}
+
+
+def read_manifest(name):
+    path = os.path.join(snapshot_dir(), name, 'manifest.json')
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def is_current(manifest, checksums, version=1):
+    """True if a manifest was written from these raw files by this version of the loader."""
+    return manifest is not None and manifest.get('checksums') == checksums and manifest.get('version', 1) == version
+
+
+def read_source(name, checksums, version=1):
+    """Returns the snapshot tables of a source, None if missing or built from other files."""
+    manifest = read_manifest(name)
+    if not is_current(manifest, checksums, version):
+        return None
+    folder = os.path.join(snapshot_dir(), name)
+    tables = {}
+    try:
+        for key, entry in manifest['tables'].items():
+            df = pd.read_parquet(os.path.join(folder, entry['file']))
+            df.columns = entry['columns']  # parquet only keeps string column names
+            tables[key] = _decode_frame(df, entry)
+    except Exception as e:
+        print(f"Error reading snapshot of {name}: {e}")
+        return None
+    return tables
+
+
+def read_prepared(name, checksums, version=1):
+    """Returns the prepared objects stored with the snapshot of a source, None if there are none."""
+    manifest = read_manifest(name)
+    if not is_current(manifest, checksums, version) or not manifest.get('prepared'):
+        return None
+    try:
+        with open(os.path.join(snapshot_dir(), name, manifest['prepared']), 'rb') as f:
+            return pickle.load(f)
+    except Exception as e:
+        print(f"Error reading the prepared objects of {name}: {e}")
+        return None
+
+
+def write_source(name, checksums, tables, version=1, prepared=None):
+    """Writes the cleaned tables of a source and its manifest, the manifest last."""
+    if None in checksums.values():
+        return  # some raw file is missing: nothing worth keeping
+    folder = os.path.join(snapshot_dir(), name)
+    os.makedirs(folder, exist_ok=True)
+    manifest = {'checksums': checksums, 'version': version, 'fingerprint': fingerprint(checksums), 'tables': {}}
+    for key, df in tables.items():
+        encoded, encoding = _encode_frame(df)
+        columns = list(encoded.columns)
+        encoded.columns = [str(c) for c in columns]
+        filename = f"{key}-{manifest['fingerprint']}-v{version}.parquet"
+        tmp = os.path.join(folder, f".{filename}.{os.getpid()}.tmp")
+        encoded.to_parquet(tmp)
+        os.replace(tmp, os.path.join(folder, filename))
+        manifest['tables'][key] = {'file': filename, 'columns': columns, **encoding}
+
+    if prepared:
+        filename = f"prepared-{manifest['fingerprint']}-v{version}.pickle"
+        tmp = os.path.join(folder, f".{filename}.{os.getpid()}.tmp")
+        prepared = {key: PickledValues(value) if isinstance(value, dict) else value for key, value in prepared.items()}
+        with open(tmp, 'wb') as f:
+            pickle.dump(prepared, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, os.path.join(folder, filename))
+        manifest['prepared'] = filename
+
+    tmp = os.path.join(folder, f".manifest.json.{os.getpid()}.tmp")
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp, os.path.join(folder, 'manifest.json'))
+
+    # remove the tables of older versions
+    keep = {entry['file'] for entry in manifest['tables'].values()} | {'manifest.json', manifest.get('prepared')}
+    for filename in os.listdir(folder):
+        if filename not in keep and not filename.startswith('.'):
+            try:
+                os.remove(os.path.join(folder, filename))
+            except OSError:
+                pass
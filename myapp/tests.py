@@ -1,3 +1,1123 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+from io import BytesIO
+from unittest import mock, skipIf
 
-# Create your tests here.
+import openpyxl
+import pandas as pd
+from asgiref.sync import async_to_sync
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, TransactionTestCase, override_settings
+
+from . import evidence, jobs, resultcache, singleflight, snapshot, views
+from .cactus_stub import CactusStubServer
+
+
+class InChIKeyResolverTests(TestCase):
+    """CAS -> InChIKey resolution against the local Cactus stand-in."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.cactus = CactusStubServer().start()
+        cls.settings_override = override_settings(CACTUS_URL=cls.cactus.url)
+        cls.settings_override.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.settings_override.disable()
+        cls.cactus.stop()
+        super().tearDownClass()
+
+    def setUp(self):
+        views.inchikey_cache().clear()
+        self.cactus.requests.clear()
+        patcher = mock.patch.object(views, 'local_inchikey', return_value=None)  # resolve through the service
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_found_is_cached(self):
+        self.assertEqual(views.resolve_inchikey('71-43-2'), 'UHOVQNZJYSORNB-UHFFFAOYSA-N')
+        self.assertEqual(views.resolve_inchikey('71-43-2'), 'UHOVQNZJYSORNB-UHFFFAOYSA-N')
+        self.assertEqual(len(self.cactus.requests), 1)
+
+    def test_not_found_is_cached_with_negative_ttl(self):
+        with mock.patch.object(views.inchikey_cache(), 'set', wraps=views.inchikey_cache().set) as cache_set:
+            self.assertIsNone(views.resolve_inchikey('7439-93-2'))
+        cache_set.assert_called_once_with('inchikey:7439-93-2', views.INCHIKEY_NOT_FOUND, views.inchikey_cache_timeout(None))
+        self.assertIsNone(views.resolve_inchikey('7439-93-2'))
+        self.assertEqual(len(self.cactus.requests), 1)
+
+    def test_errors_are_not_cached(self):
+        self.assertIsNone(views.resolve_inchikey('0-00-0'))
+        self.assertIsNone(views.resolve_inchikey('0-00-0'))
+        self.assertEqual(len(self.cactus.requests), 2)
+
+    def test_unreachable_service(self):
+        with override_settings(CACTUS_URL="http://127.0.0.1:9/chemical/structure/{}/stdinchikey"):
+            self.assertIsNone(views.resolve_inchikey('71-43-2'))
+        # the failure was not cached: the next call reaches the service
+        self.assertEqual(views.resolve_inchikey('71-43-2'), 'UHOVQNZJYSORNB-UHFFFAOYSA-N')
+
+    def test_error_is_never_used_as_inchikey(self):
+        with mock.patch.object(views, 'query_ccris') as query_ccris:
+            self.assertEqual(views.query_ccris_by_cas('0-00-0', 'on'), (None, None))
+            self.assertEqual(views.query_ccris_by_cas('7439-93-2', 'on'), (None, None))
+        query_ccris.assert_not_called()
+
+    def test_async_resolver_shares_the_cache(self):
+        self.assertEqual(async_to_sync(views.aresolve_inchikey)('50-00-0'), 'WSFSSNUMVMOOMR-UHFFFAOYSA-N')
+        self.assertEqual(views.resolve_inchikey('50-00-0'), 'WSFSSNUMVMOOMR-UHFFFAOYSA-N')
+        self.assertIsNone(async_to_sync(views.aresolve_inchikey)('7439-93-2'))
+        self.assertIsNone(async_to_sync(views.aresolve_inchikey)('0-00-0'))
+        self.assertEqual(len(self.cactus.requests), 3)
+
+    def test_identity_table_first(self):
+        with mock.patch.object(views, 'local_inchikey', return_value='UHOVQNZJYSORNB-UHFFFAOYSA-N'):
+            self.assertEqual(views.resolve_inchikey('71-43-2'), 'UHOVQNZJYSORNB-UHFFFAOYSA-N')
+            self.assertEqual(async_to_sync(views.aresolve_inchikey)('71-43-2'), 'UHOVQNZJYSORNB-UHFFFAOYSA-N')
+        self.assertEqual(self.cactus.requests, [])
+
+
+class IdentityTableTests(TestCase):
+    """CAS / InChIKey / SMILES table built from the bundled sources."""
+
+    TABLES = {
+        ('ECVAM_NEG', 'data'): pd.DataFrame({'CAS_no': ['71-43-2', '50-00-0'],
+                                             'InChiKey': ['UHOVQNZJYSORNB-UHFFFAOYSA-N', 'not a key'],
+                                             'Smiles': ['c1ccccc1', 'C=O']}),
+        ('HOMNA', 'data'): pd.DataFrame({'CAS_NO': ['71-43-2', '50-00-0', 'no CAS'],
+                                         'SMILES': ['C1=CC=C C=C1', 'C=O', 'C']}),
+    }
+
+    def build(self):
+        def table(name, key='data'):
+            return self.TABLES.get((name, key), pd.DataFrame())
+        with mock.patch.object(views.registry, 'table', side_effect=table):
+            return views.load_identity_source()['data']
+
+    def test_given_inchikeys_first(self):
+        df = self.build()
+        self.assertNotIn('no CAS', set(df['CAS']))
+        benzene = df[df['CAS'] == '71-43-2']
+        self.assertEqual(benzene.iloc[0]['origin'], 'source')
+        self.assertEqual(benzene.iloc[0]['InChIKey'], 'UHOVQNZJYSORNB-UHFFFAOYSA-N')
+        self.assertIn('C1=CC=CC=C1', set(benzene['SMILES']))  # line breaks removed
+
+    @skipIf(views.Chem is None, "RDKit not installed")
+    def test_inchikeys_from_smiles(self):
+        df = self.build()
+        self.assertEqual(set(df.loc[df['CAS'] == '50-00-0', 'InChIKey']), {'WSFSSNUMVMOOMR-UHFFFAOYSA-N'})
+        self.assertEqual(set(df.loc[df['CAS'] == '71-43-2', 'InChIKey']), {'UHOVQNZJYSORNB-UHFFFAOYSA-N'})
+
+
+class SourceRegistryTests(TestCase):
+    """Sources read once, from their raw files or their snapshot, each one on its own."""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.files = {name: os.path.join(tmp.name, f'{name}.csv') for name in ('A', 'B', 'BROKEN')}
+        self.write('A', 'CAS_NO,Result\n71-43-2,Positive\n50-00-0,Negative\n71-43-2,Equivocal\n')
+        self.write('B', 'CASRN,Value\n50-00-0,0.1\n')
+        self.write('BROKEN', 'not read')
+        settings_override = override_settings(SNAPSHOT_DIR=os.path.join(tmp.name, 'snapshot'))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.loads = []
+
+    def write(self, name, content):
+        with open(self.files[name], 'w') as f:
+            f.write(content)
+        os.utime(self.files[name], ns=(time.time_ns(), time.time_ns() + 1_000_000_000))  # a newer mtime, even on coarse clocks
+
+    def registry(self):
+        def load(name):
+            self.loads.append(name)
+            if name == 'BROKEN':
+                raise ValueError('unreadable sheet')
+            return {'data': views.load_dataframe(self.files[name])}
+
+        return views.SourceRegistry({
+            'A': {'files': [self.files['A']], 'load': lambda: load('A'), 'index': {'data': 'CAS_NO'}},
+            'BROKEN': {'files': [self.files['BROKEN']], 'load': lambda: load('BROKEN'), 'index': {'data': 'CAS_NO'}},
+            'B': {'files': [self.files['B']], 'load': lambda: load('B'), 'index': {'data': 'CASRN'}},
+        })
+
+    def test_loaded_once(self):
+        registry = self.registry()
+        with mock.patch('builtins.print'):
+            registry.load_all()
+        self.assertEqual(list(registry.lookup('A', '71-43-2')['Result']), ['Positive', 'Equivocal'])
+        self.assertEqual(list(registry.lookup('B', ' 50-00-0')['Value']), [0.1])
+        self.assertTrue(registry.lookup('A', '7732-18-5').empty)
+        self.assertEqual(self.loads, ['A', 'BROKEN', 'B'])
+
+        with mock.patch('builtins.print'):
+            self.registry().load_all()  # another process: A and B from their snapshot
+        self.assertEqual(self.loads, ['A', 'BROKEN', 'B', 'BROKEN'])
+
+    def test_failed_source_alone(self):
+        registry = self.registry()
+        with mock.patch('builtins.print') as printed:
+            registry.load_all()
+        printed.assert_any_call('Error loading source BROKEN: unreadable sheet')
+        self.assertEqual(registry.get('BROKEN'), {})
+        self.assertTrue(registry.lookup('BROKEN', '71-43-2').empty)
+        self.assertEqual(len(registry.lookup('A', '50-00-0')), 1)
+
+    def test_changed_file_reloaded_alone(self):
+        registry = self.registry()
+        with mock.patch('builtins.print'):
+            registry.load_all()
+            unchanged, fingerprint = registry.entry('B'), registry.fingerprint()
+            self.write('A', 'CAS_NO,Result\n71-43-2,Negative\n')
+            self.assertEqual(registry.reload_changed(), ['A'])
+        self.assertEqual(list(registry.lookup('A', '71-43-2')['Result']), ['Negative'])
+        self.assertTrue(registry.lookup('A', '50-00-0').empty)
+        self.assertIs(registry.entry('B'), unchanged)
+        self.assertNotEqual(registry.fingerprint(), fingerprint)
+
+    def test_upstream_loader_version(self):
+        def registry(version):
+            def load_ids():  # built from the tables of A, as IDENTITY is from the other sources
+                self.loads.append('IDS')
+                return {'data': registry.get('A')['data'][['CAS_NO']]}
+
+            registry = views.SourceRegistry({
+                'A': {'files': [self.files['A']], 'load': lambda: {'data': views.load_dataframe(self.files['A'])}, 'version': version},
+                'IDS': {'files': [self.files['A']], 'sources': ['A'], 'load': load_ids, 'index': {'data': 'CAS_NO'}},
+            })
+            return registry
+
+        with mock.patch('builtins.print'):
+            registry(1).load_all()
+            self.assertEqual(len(registry(1).lookup('IDS', '71-43-2')), 2)  # same raw files and loaders: from the snapshot
+            self.assertEqual(self.loads, ['IDS'])
+            registry(2).load_all()  # the loader of A changed: the tables IDS is built from may have too
+        self.assertEqual(self.loads, ['IDS', 'IDS'])
+        self.assertEqual(registry(2).checksums('IDS')['A loader'], 'v2')
+
+
+class CASIndexTests(TestCase):
+    """Rows found through the CAS index, against the former scan of the whole identifier column."""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        settings_override = override_settings(SNAPSHOT_DIR=tmp.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.df = pd.DataFrame({'CAS_NO': ['71-43-2', '50-00-0', None, '71-43-2', 7732, '64-17-5', float('nan'), '71-43-2'],
+                                'Result': ['Positive', 'Negative', 'x', 'Equivocal', 'y', 'Negative', 'z', 'Positive']},
+                               index=[10, 11, 12, 13, 14, 15, 16, 17])
+        self.registry = views.SourceRegistry({'TEST': {'files': [], 'load': lambda: {'data': self.df}, 'index': {'data': 'CAS_NO'}}})
+
+    def test_same_rows_as_scan(self):
+        with mock.patch('builtins.print'):
+            self.registry.get('TEST')
+        for cas_rn in ['71-43-2', '50-00-0', '64-17-5', '7732-18-5', '']:  # duplicated, single, last row, missing, empty
+            pd.testing.assert_frame_equal(self.registry.lookup('TEST', cas_rn), self.df[self.df['CAS_NO'] == cas_rn])
+
+        rows, identifiers = self.registry.lookup_many('TEST', ['64-17-5', '7732-18-5', '71-43-2', '64-17-5'])
+        self.assertEqual(list(identifiers), ['64-17-5', '71-43-2', '71-43-2', '71-43-2'])
+        for cas_rn, group in rows.groupby(identifiers, sort=False):
+            pd.testing.assert_frame_equal(group, self.df[self.df['CAS_NO'] == cas_rn])
+
+    def test_padded_cas_numbers(self):
+        self.df.loc[11, 'CAS_NO'] = ' 50-00-0 '  # found through the index, where the scan missed it
+        with mock.patch('builtins.print'):
+            self.assertEqual(list(self.registry.lookup('TEST', '50-00-0').index), [11])
+
+
+class SnapshotTests(TestCase):
+    """Parquet snapshot of the cleaned tables: values kept as they are, used only from the same files and loader."""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        settings_override = override_settings(SNAPSHOT_DIR=tmp.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.checksums = {'source.xlsx': 'abc'}
+
+    def test_round_trip(self):
+        df = pd.DataFrame({
+            'CAS_NO': ['71-43-2', float('nan'), '50-00-0'],  # strings, NaN nulls
+            'Name': ['Benzene', 'Formaldehyde', None],  # strings, None nulls
+            'Volume': [29, 'Sup 7', None],  # mixed types: pickled cells
+            'Notes': [None, float('nan'), 'x'],  # both nulls: pickled cells
+            0: [0.5, float('nan'), 2.0],  # non-string column names
+            1: [1, 2, 3],
+        }, index=[3, 5, 7])
+        snapshot.write_source('TEST', self.checksums, {'data': df, 'empty': pd.DataFrame()}, 2, {'tables': {'71-43-2': df.iloc[[0]]}, 'rows': 3})
+        tables = snapshot.read_source('TEST', self.checksums, 2)
+        pd.testing.assert_frame_equal(tables['data'], df)
+        self.assertIsNone(tables['data'].loc[7, 'Name'])
+        self.assertIsInstance(tables['data'].loc[5, 'CAS_NO'], float)
+        self.assertEqual(tables['data']['Volume'].tolist()[:2], [29, 'Sup 7'])
+        self.assertTrue(tables['empty'].empty)
+        prepared = snapshot.read_prepared('TEST', self.checksums, 2)
+        self.assertIsInstance(prepared['tables'], snapshot.PickledValues)  # unpickled key by key, when used
+        self.assertEqual((list(prepared['tables']), '71-43-2' in prepared['tables'], prepared['tables'].get('50-00-0')), (['71-43-2'], True, None))
+        pd.testing.assert_frame_equal(prepared['tables']['71-43-2'], df.iloc[[0]])
+        self.assertIs(prepared['tables']['71-43-2'], prepared['tables']['71-43-2'])
+        self.assertEqual(prepared['rows'], 3)
+
+    def test_other_files_or_loader(self):
+        snapshot.write_source('TEST', self.checksums, {'data': pd.DataFrame({'CAS_NO': ['71-43-2']})}, 2, {'x': 1})
+        self.assertIsNone(snapshot.read_source('TEST', {'source.xlsx': 'def'}, 2))
+        self.assertIsNone(snapshot.read_source('TEST', self.checksums, 3))
+        self.assertIsNone(snapshot.read_prepared('TEST', {'source.xlsx': 'def'}, 2))
+        self.assertIsNone(snapshot.read_prepared('TEST', self.checksums, 3))
+        self.assertIsNone(snapshot.read_source('OTHER', self.checksums, 2))
+
+        snapshot.write_source('TEST', {'source.xlsx': None}, {'data': pd.DataFrame({'CAS_NO': ['50-00-0']})}, 2)  # a missing file
+        self.assertEqual(snapshot.read_source('TEST', self.checksums, 2)['data']['CAS_NO'].tolist(), ['71-43-2'])
+
+
+class SourceReloadTests(TestCase):
+    """Changed source files are re-ingested and swapped in."""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.file = os.path.join(tmp.name, 'source.csv')
+        self.write('CAS_NO,Result\n71-43-2,Positive\n')
+        settings_override = override_settings(SNAPSHOT_DIR=os.path.join(tmp.name, 'snapshot'))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        sources = {'TEST': {'files': [self.file], 'load': lambda: {'data': views.load_dataframe(self.file)},
+                            'index': {'data': 'CAS_NO'}}}
+        self.registry = views.SourceRegistry(sources)
+
+    def write(self, content):
+        with open(self.file, 'w') as f:
+            f.write(content)
+        os.utime(self.file, ns=(time.time_ns(), time.time_ns() + 1_000_000_000))  # a newer mtime, even on coarse clocks
+
+    def test_changed_files_are_reloaded(self):
+        old = self.registry.lookup('TEST', '71-43-2')
+        self.assertEqual(self.registry.reload_changed(), [])
+        self.write('CAS_NO,Result\n71-43-2,Negative\n50-00-0,Positive\n')
+        self.assertEqual(self.registry.reload_changed(), ['TEST'])
+        self.assertEqual(list(self.registry.lookup('TEST', '71-43-2')['Result']), ['Negative'])
+        self.assertEqual(len(self.registry.lookup('TEST', '50-00-0')), 1)
+        self.assertEqual(list(old['Result']), ['Positive'])  # rows already handed out are untouched
+
+    def test_touched_files_are_not_reloaded(self):
+        self.registry.get('TEST')
+        self.write('CAS_NO,Result\n71-43-2,Positive\n')
+        self.assertEqual(self.registry.reload_changed(), [])
+
+    def test_unreadable_files_keep_the_previous_version(self):
+        self.registry.get('TEST')
+        os.remove(self.file)
+        with mock.patch('builtins.print'):
+            self.assertEqual(self.registry.reload_changed(), [])
+        self.assertEqual(list(self.registry.lookup('TEST', '71-43-2')['Result']), ['Positive'])
+
+
+class EvidenceTests(TestCase):
+    """P/N/E counts and summary calls of the evidence engine."""
+
+    def test_encode(self):
+        outcomes = pd.Series(['Positive', 'weakly positive', 'Negative / Equivocal', None, 3.0])
+        codes = evidence.encode(outcomes, ('Positive', 'Negative', 'Equivocal'))
+        self.assertEqual(codes.tolist(), [evidence.POSITIVE, evidence.POSITIVE, evidence.NEGATIVE | evidence.EQUIVOCAL, 0, 0])
+        calls = pd.DataFrame({'a': ['+', '-', 'E', '(+/-)'], 'b': ['-', 'nan', 'ND', 'E']})
+        codes = evidence.encode(calls, views.ECVAM_CALL_PATTERNS, case=True, exclusive=True)
+        self.assertEqual(evidence.count(codes).tolist(), [[1, 1, 0], [0, 1, 0], [0, 0, 1], [1, 0, 1]])
+
+    def test_grouped_counts_and_calls(self):
+        df = pd.DataFrame({'key': ['A', 'A', 'B', None, 'C', 'D'],
+                           'outcome': ['Positive', 'Negative', 'Negative', 'Positive', 'Equivocal', 'unknown']})
+        table = evidence.summarize(df.groupby('key'), evidence.encode(df['outcome'], ('Positive', 'Negative', 'Equivocal')))
+        self.assertEqual(table.values.tolist(), [['A', 1, 1, 0], ['B', 0, 1, 0], ['C', 0, 0, 1], ['D', 0, 0, 0]])
+        counts = table[evidence.COUNT_COLUMNS].to_numpy()
+        self.assertEqual(evidence.calls(counts).tolist(), ['Conflicted', 'Negative', 'N/D', 'N/D'])
+        self.assertEqual(evidence.calls([[0, 2, 1]]).tolist(), ['Equivocal'])
+        self.assertEqual(evidence.calls([[0, 2, 1], [0, 0, 1]], negative_with_equivocal='Negative', equivocal_only=None).tolist(),
+                         ['Negative', None])
+        self.assertEqual(evidence.format_counts(counts[:1]), ['P/N/E= 1 / 1 / 0'])
+
+
+class CCRISSummaryTests(TestCase):
+    """Summaries of every InChIKey and Test System computed at ingest."""
+
+    def test_summaries(self):
+        df = pd.DataFrame({'INCHI_key': ['A', 'A', 'A', 'B', 'A'],
+                           'Test System': ['Mouse lymphoma', 'Mouse lymphoma', 'Rat', 'Rat', None],
+                           'Strain/Indicator': ['tk locus', 'tk locus', None, 'TA98', 'TA100'],
+                           'Results': ['POSITIVE', 'NEGATIVE', 'EQUIVOCAL', 'negative', 'POSITIVE']})
+        df = df.sort_values(['INCHI_key', 'Test System'], kind='stable', na_position='last')
+        summary = views.ccris_summaries(df)
+        self.assertEqual(summary.drop(columns=['start', 'stop'] + evidence.COUNT_COLUMNS).values.tolist(), [
+            ['A', 'Mouse lymphoma', 'tk locus', 'P/N/E= 1 / 1 / 0', 'Conflicted'],
+            ['A', 'Rat', 'None', 'P/N/E= 0 / 0 / 1', 'Conflicted'],  # only equivocal: call of the previous Test System
+            ['B', 'Rat', 'TA98', 'P/N/E= 0 / 1 / 0', 'Negative'],
+        ])
+        self.assertEqual(list(df.iloc[summary['start'][0]:summary['stop'][0]]['Results']), ['POSITIVE', 'NEGATIVE'])
+
+
+class CEBSSummaryTests(TestCase):
+    """Summaries of every CAS number, Strain and S9 condition of AMES CEBS computed at ingest."""
+
+    def test_summaries(self):
+        df = pd.DataFrame({'CAS_NO': ['50-00-0', '50-00-0', '50-00-0', '71-43-2', '50-00-0'],
+                           'Strain': ['TA98', 'TA100', 'TA98', 'TA98', 'TA98'],
+                           '+-s9': ['+S9', '-S9', '+S9', '-S9', '-S9'],
+                           'Trial Conclusion': ['Positive', 'Negative', 'Weakly Positive', 'Equivocal', 'Negative']})
+        summary, supersummary = views.cebs_summaries(df)
+        self.assertEqual(supersummary[evidence.COUNT_COLUMNS].values.tolist(), [[2, 2, 0], [0, 0, 1]])
+        summary, supersummary = summary.drop(columns=evidence.COUNT_COLUMNS), supersummary.drop(columns=evidence.COUNT_COLUMNS)
+        self.assertEqual(summary.values.tolist(), [
+            ['50-00-0', 'TA100', '-S9', 'P/N/E= 0 / 1 / 0', 'Negative'],
+            ['50-00-0', 'TA98', '+S9', 'P/N/E= 2 / 0 / 0', 'Positive'],
+            ['50-00-0', 'TA98', '-S9', 'P/N/E= 0 / 1 / 0', 'Negative'],
+            ['71-43-2', 'TA98', '-S9', 'P/N/E= 0 / 0 / 1', 'N/D'],
+        ])
+        self.assertEqual(supersummary.values.tolist(), [
+            ['50-00-0', 'TA98, TA100', 'Conflicted, P/N/E= 2 / 2 / 0'],
+            ['71-43-2', 'TA98', 'N/D, P/N/E= 0 / 0 / 1'],
+        ])
+
+
+class OECDValuesTests(TestCase):
+    """'Values' blob of the OECD tables parsed at ingest."""
+
+    def test_parse(self):
+        df = pd.DataFrame({'Number': ['50-00-0', '71-43-2'], 'Values': [
+            'Type of information:experimental study\nReliability:1\nReliability:1\nEndpoint:in vivo\n\n\nTest results,positive',
+            'Type of information:read-across\n\n\nReliability:2',
+        ]})
+        values = df['Values'].str.replace(r'\n{2,}', '\n', regex=True)
+        fields = ['Type_of_information', 'Reliability', 'Endpoint', 'Results']
+        long = views.parse_oecd_values(df, values, fields)
+        self.assertEqual(long[['Number', 'field', 'value']].astype(str).values.tolist(), [
+            ['50-00-0', 'Type_of_information', 'experimental study'],
+            ['50-00-0', 'Reliability', '1'],
+            ['50-00-0', 'Endpoint', 'in vivo'],
+            ['50-00-0', 'Results', 'positive'],
+            ['71-43-2', 'Type_of_information', 'read-across'],
+            ['71-43-2', 'Reliability', '2'],
+        ])
+        wide = views.oecd_wide_table(df, long, fields)
+        self.assertEqual(list(wide.columns), ['Number'] + fields)
+        self.assertEqual(wide.iloc[1].tolist(), ['71-43-2', 'read-across', '2', None, None])
+
+
+class ECVAMPositiveLiteratureTests(TestCase):
+    """Literature of the ECVAM positives from the reference-number index."""
+
+    def test_parse_citations(self):
+        self.assertEqual(views.parse_citations('+[3] -[4-6]; E[7, 9]'), [3, 4, 5, 6, 7, 9])
+        self.assertEqual(views.parse_citations(float('nan')), [])
+
+    def test_literature(self):
+        df_ref = pd.DataFrame({'Numerical Value': ['1', '2', '3'], 'List of References': ['[1] A', '[2] B', '[3] C']})
+        dt = pd.DataFrame({'Literature & Notes': ['+[3] [1]'], 'Literature & Notes.1': ['[2-3]'], 'EFSA': ['[2]']})
+        literature = views.ecvam_pos_literature(dt, views.build_reference_index(df_ref))
+        self.assertEqual(list(literature['List of References']), ['[1] A', '[3] C', '[2] B'])
+        self.assertIsNone(views.ecvam_pos_literature(dt[['EFSA']], views.build_reference_index(df_ref)))
+
+    def test_no_literature(self):
+        summary = pd.DataFrame({'Ames_Overall': ['Positive'], 'db_name': ['ECVAM Ames positive']}, index=['71-43-2'])
+        literature = pd.DataFrame({'List of References': ['[1] A']})
+        tables = {name: None for name in ['ames', 'vit_MLA', 'vit_MN', 'vit_CA', 'viv_MN', 'viv_CA', 'viv_UDS', 'vivo_TGR', 'vivo_DNA',
+                                          'CARC', 'add_info']}
+        prepared = {'tables': {'71-43-2': {**tables, 'summary': summary, 'literature': None},
+                               '50-00-0': {**tables, 'summary': summary, 'literature': literature}}}
+        with mock.patch.object(views.registry, 'entry'), mock.patch.object(views.registry, 'prepared', return_value=prepared), \
+                mock.patch('builtins.print'):
+            results = views.query_ecvam_pos('71-43-2', 'on')
+            self.assertNotIn('ECVAM_Pos_References', results)
+            self.assertEqual(results['ECVAM_Pos_Summary'].loc['Ames_Overall'].tolist(), ['Positive'])
+            answer = views.process_results(views.collect_results('71-43-2', 'on', {'ECVAM_Pos': results}))
+            self.assertNotIn('ECVAM_Pos_References', answer)  # as the empty table it used to be
+            self.assertIn('ECVAM_Pos_Summary', answer)
+
+            self.assertEqual(views.query_ecvam_pos('50-00-0', 'on')['ECVAM_Pos_References'].loc['List of References'].tolist(), ['[1] A'])
+            self.assertIsNone(views.query_ecvam_pos('71-43-2', 'off')['ECVAM_Pos_References'])
+
+    def test_substance_not_computed(self):
+        prepared = {'tables': {'71-43-2': {'error': 'ValueError: cannot convert float NaN to integer'}}}
+        with mock.patch.object(views.registry, 'entry'), mock.patch.object(views.registry, 'prepared', return_value=prepared):
+            errors = []
+            for details in ('on', 'off'):
+                with self.assertRaisesRegex(RuntimeError, r'71-43-2 not computed at ingest \(ValueError: cannot convert') as raised:
+                    views.ECVAM_pos_overall('71-43-2', details)
+                errors.append(raised.exception)
+        self.assertIsNot(errors[0], errors[1])  # a new exception for every query
+
+
+# The ECVAM negative query as it was before the tables were computed at ingest (the rows of the
+# substance given instead of looked up), the oracle of ECVAMNegativeTests.test_same_as_former_query.
+
+def former_ecvam_neg_subtable(dt, keyword):
+    a_list = [col for col in dt.columns if col.startswith(str(keyword))]
+    if str(keyword) in views.ECVAM_NEG_OVERALLS:
+        a_list.append(views.ECVAM_NEG_OVERALLS[str(keyword)])
+    a_dt = dt[a_list].dropna(axis=1)
+    return None if a_dt.empty else a_dt
+
+
+def former_ecvam_neg_summary_table(dt, cas_rn):
+    overall = {}
+    for pattern in ('AMES', 'in vitro', 'in vivo'):
+        P = N = E = 0
+        for col in dt.columns:
+            if pattern in col:
+                if '+' in str(dt[col].iloc[0]):
+                    P += 1
+                elif '-' in str(dt[col].iloc[0]):
+                    N += 1
+                elif 'E' in str(dt[col].iloc[0]):
+                    E += 1
+        overall[pattern] = (P, N, E)
+    pne = " P/N/E= {}/{}/{}".format(*overall['AMES'])
+    return pd.DataFrame({'Ames_Overall': (str(dt['AMES Overall'].iloc[0]) + ' ' + str(pne)),
+                         'vitro_overall': " P/N/E = {}/{}/{}".format(*overall['in vitro']),
+                         'vivo_overall': " P/N/E = {}/{}/{}".format(*overall['in vivo']),
+                         'CARC_overall': dt['Rodent Carcinogenicity Overall'].iloc[0], 'IARC': dt['IARC Classification'].iloc[0]},
+                        index=[cas_rn])
+
+
+def former_ecvam_neg_overall(dt, cas_rn):
+    subtables = [former_ecvam_neg_subtable(dt, keyword) for keyword in views.ECVAM_NEG_SUBTABLES]
+    add_info = pd.DataFrame()
+    add_info['other studies'] = dt[['Other Tests & Notes']].copy()
+    if add_info.empty:
+        add_info = None
+
+    processed_data = []
+    for df in subtables:
+        if df is not None:
+            for col in df.columns:
+                if ('Literature' in col) or ('reference' in col) or ('other' in col):
+                    series = df[col].apply(views.extract_references)
+                    processed_data.append({"essay": series.name.split()[0], "references": list(set(series.iloc[0]))})
+    final_df = pd.DataFrame([{"essay": item["essay"], "unique_references": ref} for item in processed_data for ref in item["references"]])
+    final_df = final_df.groupby('essay', group_keys=False).apply(lambda group: group.drop_duplicates(subset=["unique_references"]))
+    final_df["essay"] = final_df["essay"].mask(final_df["essay"].duplicated(), "")
+    final_df = final_df.reset_index(drop=True)
+    return (former_ecvam_neg_summary_table(dt, cas_rn), *subtables, add_info, final_df)
+
+
+class ECVAMNegativeTests(TestCase):
+    """Summary, sub-tables and references of the ECVAM negatives computed at ingest."""
+
+    def setUp(self):
+        df = pd.DataFrame({'CAS_no': ['71-43-2', '50-00-0'],
+                           'AMES NTP': ['-', '+'], 'AMES NTP references': ['#Smith 1990; #Jones 1991', None],
+                           'AMES Literature': ['#Smith 1990', None], 'AMES Overall': ['Negative', 'E'],
+                           'MCGM NTP ': ['E', None], 'MCGM Literature': ['#Doe 2000', None]})
+        for col in views.ECVAM_NEG_OVERALLS.values():
+            df[col] = None
+        df['in vitro MCGM Overall'] = ['-', None]
+        df['in vivo MN Overall'] = ['-', '+']
+        df['Rodent Carcinogenicity Overall'] = ['Negative', None]
+        df['IARC Classification'] = ['3', None]
+        df['Other Tests & Notes'] = [None, 'note']
+        self.df = df
+        self.tables = views.prepare_ecvam_neg({'data': df})['tables']
+
+    def test_summary(self):
+        self.assertEqual(self.tables['71-43-2']['summary'].values.tolist(),
+                         [['Negative  P/N/E= 0/1/0', ' P/N/E = 0/1/0', ' P/N/E = 0/1/0', 'Negative', '3']])
+        self.assertEqual(self.tables['50-00-0']['summary'].values.tolist(),
+                         [['E  P/N/E= 1/0/1', ' P/N/E = 0/0/0', ' P/N/E = 1/0/0', None, None]])
+
+    def test_subtables(self):
+        tables = self.tables['71-43-2']
+        self.assertEqual(list(tables['AMES'].columns), ['AMES NTP', 'AMES NTP references', 'AMES Literature', 'AMES Overall'])
+        self.assertEqual(list(tables['MCGM'].columns), ['MCGM NTP ', 'MCGM Literature', 'in vitro MCGM Overall'])
+        self.assertEqual(list(tables['MNvivo'].columns), ['in vivo MN Overall'])
+        self.assertIsNone(tables['CAvit'])  # only empty columns
+        self.assertEqual(list(self.tables['50-00-0']['AMES'].columns), ['AMES NTP', 'AMES Overall'])
+
+    def test_references(self):
+        self.assertEqual(self.tables['71-43-2']['references'].values.tolist(),
+                         [['AMES', 'Smith 1990'], ['', 'Jones 1991'], ['MCGM', 'Doe 2000']])
+        self.assertIsNone(self.tables['50-00-0']['references'])
+
+    def test_substance_not_computed(self):
+        self.df.loc[0, 'AMES Literature'] = 1990  # not text
+        with mock.patch('builtins.print') as printed:
+            prepared = views.prepare_ecvam_neg({'data': self.df})
+        error = "AttributeError: 'int' object has no attribute 'split'"
+        self.assertEqual(prepared['tables']['71-43-2'], {'error': error})
+        printed.assert_any_call(f"ECVAM negatives: tables of 71-43-2 not computed ({error})")
+        with mock.patch.object(views.registry, 'entry'), mock.patch.object(views.registry, 'prepared', return_value=prepared), \
+                mock.patch('builtins.print'):
+            with self.assertRaisesRegex(RuntimeError, r'71-43-2 not computed at ingest \(AttributeError'):
+                views.ECVAM_neg_overall('71-43-2')
+            self.assertEqual(views.ECVAM_neg_overall('50-00-0')[0].index.tolist(), ['50-00-0'])  # the other substances answer
+
+    def test_same_as_former_query(self):
+        df = pd.concat([self.df, pd.DataFrame({
+            'CAS_no': ['7732-18-5', '7732-18-5', '64-17-5'], 'AMES NTP': ['+', '-', '-'],
+            'AMES NTP references': ['#A 1; #B 2; #A 1', '#C 3', '#A 1'], 'AMES Literature': ['#B 2; #D 4', None, '#A 1; #D 4'],
+            'AMES Overall': ['Positive', 'Negative', 'Negative'], 'MCGM NTP ': [None, 'E', 'E'], 'MCGM Literature': ['#E 5', '#G 7', '#E 5'],
+            'COMET other': ['see #F 6', 'see #H 8', 'see #F 6'], ' in vivo DNA damage Overall': ['+ (E)', None, '-'],
+            'in vivo MN Overall': ['E', '-', '-'], 'Rodent Carcinogenicity Overall': ['Positive', None, 'Negative'],
+            'Other Tests & Notes': ['note', 'other', None],
+        })], ignore_index=True)  # two rows of one substance (the first one is summarized), one citing #A 1 in two AMES columns
+        tables = views.prepare_ecvam_neg({'data': df})['tables']
+        names = ['summary', *views.ECVAM_NEG_SUBTABLES, 'add_info']
+        for cas_rn in ['71-43-2', '7732-18-5', '64-17-5']:
+            with mock.patch('builtins.print'):
+                former = former_ecvam_neg_overall(df[df['CAS_no'] == cas_rn], cas_rn)
+            for name, old in zip(names, former):
+                if old is None:
+                    self.assertIsNone(tables[cas_rn][name], name)
+                else:
+                    pd.testing.assert_frame_equal(tables[cas_rn][name], old)
+            # the assays in the same order, their references in the order of the sheet where they were in the order of a set()
+            old, new = former[-1].replace('', None).ffill(), tables[cas_rn]['references'].replace('', None).ffill()
+            self.assertEqual(list(new['essay']), list(old['essay']))
+            self.assertEqual(sorted(new.values.tolist()), sorted(old.values.tolist()))
+            self.assertEqual(list(tables[cas_rn]['references']['essay'] != ''), list(former[-1]['essay'] != ''))
+        with self.assertRaises(KeyError):  # no references: the former query failed, the references table is None now
+            former_ecvam_neg_overall(df[df['CAS_no'] == '50-00-0'], '50-00-0')
+
+
+class OpenFoodToxIndexTests(TestCase):
+    """OpenFoodTox rows of every CAS number found at ingest."""
+
+    def test_component_then_substance_name(self):
+        tables = {
+            'genotox': pd.DataFrame({'Substance': ['Dimoxystrobin', 'Dimoxystrobin', 'Dimoxystrobin ', 'Benzene'],
+                                     'Genotoxicity': ['Positive', 'negative', 'Positive', None]}),
+            'refpoint': pd.DataFrame({'Substance': ['Benzene mixture', 'Dimoxystrobin']}),
+            'refvalue': pd.DataFrame({'Substance': ['Other']}),
+            'substcharact': pd.DataFrame({'Component': ['Dimoxystrobin', 'Benzene', 'Benzene'],
+                                          'Substance': ['Dimoxystrobin mixture', 'Benzene mixture', 'Benzene'],
+                                          'CASNumber': ['149961-52-4', '71-43-2 ', '71-43-2']}),
+        }
+        substances = views.prepare_openfoodtox(tables)['substances']
+        self.assertEqual(list(substances['149961-52-4']['genotox']), [0, 1])  # exact names only
+        self.assertEqual(substances['149961-52-4']['genotox_result'], 'Conflicted, P/N/E= 1 / 1 / 0')
+        self.assertEqual(list(substances['149961-52-4']['refpoint']), [1])
+        self.assertIsNone(substances['149961-52-4']['refvalue'])
+        self.assertEqual(list(substances['71-43-2']['refpoint']), [0])  # substance name of the first row
+        self.assertEqual(substances['71-43-2']['genotox_result'], 'N/D, P/N/E= 0 / 0 / 0')
+
+
+class PPRTVIRISTests(TestCase):
+    """PPRTV and IRIS rows joined by CAS number at ingest."""
+
+    def test_tables(self):
+        pprtv = pd.DataFrame({'Chemical': ['Benzene', 'Formaldehyde', 'Formaldehyde'], 'CASRN': ['71-43-2', '50-00-0', '50-00-0'],
+                              'RfC Value': ['0.03', 'Not available', 'Not available'],
+                              'RfD Value': ['0.004', 'Not available', 'Not available']})
+        iris = pd.DataFrame({'Chemical Name': ['benzene', 'Acetone'], 'CASRN': ['71-43-2', '67-64-1'], 'Tumor Site': ['blood', None]})
+        tables = views.prepare_pprtv_iris({'pprtv': pprtv, 'iris': iris})['tables']
+
+        benzene = tables['71-43-2']
+        self.assertIn(('PPRTV', 'Chemical'), benzene.index)
+        self.assertNotIn(('IRIS', 'Chemical Name'), benzene.index)  # same name as the PPRTV one
+        self.assertEqual(benzene.loc[('IRIS', 'Tumor Site')].tolist(), ['blood'])
+        self.assertEqual(len(tables['50-00-0'].columns), 1)  # only the first row without values is left out
+        self.assertNotIn('Tumor Site', tables['67-64-1'].index)  # IRIS only, without empty columns
+
+
+class BatchProcessTests(TestCase):
+    """Batch process API: a list of CAS numbers joined with every source at once."""
+
+    def test_validate_cas_list(self):
+        valid, invalid = views.validate_cas_list(['71-43-2', ' 71-43-2 ', '50-00-1', 50, '50-00-0'])
+        self.assertEqual(valid, ['71-43-2', '50-00-0'])
+        self.assertEqual(invalid, ['50-00-1', 50])
+
+    def test_lookup_many(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        path = os.path.join(tmp.name, 'source.csv')
+        with open(path, 'w') as f:
+            f.write('CAS_NO,Result\n71-43-2,Positive\n50-00-0,Negative\n71-43-2,Equivocal\n')
+        with override_settings(SNAPSHOT_DIR=os.path.join(tmp.name, 'snapshot')):
+            registry = views.SourceRegistry({'TEST': {'files': [path], 'load': lambda: {'data': views.load_dataframe(path)},
+                                                      'index': {'data': 'CAS_NO'}}})
+            rows, identifiers = registry.lookup_many('TEST', ['50-00-0', '7439-93-2', '71-43-2', '50-00-0'])
+            self.assertEqual(list(identifiers), ['50-00-0', '71-43-2', '71-43-2'])
+            for cas_rn, dt in rows.groupby(identifiers, sort=False):
+                pd.testing.assert_frame_equal(dt, registry.lookup('TEST', cas_rn))
+
+    @override_settings(BATCH_CACTUS_MAX=2)
+    def test_inchikeys(self):
+        identity = (pd.DataFrame({'InChIKey': ['UHOVQNZJYSORNB-UHFFFAOYSA-N']}), pd.Index(['71-43-2']))
+        views.inchikey_cache().set_many({views.inchikey_cache_key('50-00-0'): 'WSFSSNUMVMOOMR-UHFFFAOYSA-N',
+                                          views.inchikey_cache_key('7439-93-2'): views.INCHIKEY_NOT_FOUND})
+        self.addCleanup(views.inchikey_cache().clear)
+        with mock.patch.object(views.registry, 'lookup_many', return_value=identity), \
+                mock.patch.object(views, 'cactus_inchikey', side_effect=lambda cas_rn: {'64-17-5': 'LFQSCWFLJHTTHZ-UHFFFAOYSA-N'}.get(cas_rn)) as cactus:
+            inchikeys, timed_out, not_asked = views.batch_inchikeys(['71-43-2', '50-00-0', '7439-93-2', '64-17-5', '7732-18-5', '67-64-1'])
+        self.assertEqual(inchikeys, {'71-43-2': 'UHOVQNZJYSORNB-UHFFFAOYSA-N', '50-00-0': 'WSFSSNUMVMOOMR-UHFFFAOYSA-N',
+                                     '64-17-5': 'LFQSCWFLJHTTHZ-UHFFFAOYSA-N'})
+        self.assertEqual(sorted(call.args[0] for call in cactus.call_args_list), ['64-17-5', '7732-18-5'])  # neither known nor cached
+        self.assertEqual(timed_out, [])
+        self.assertEqual(not_asked, ['67-64-1'])  # over BATCH_CACTUS_MAX
+
+    def test_view(self):
+        found = pd.DataFrame({'Result': ['Positive']}).transpose()
+        answers = {'71-43-2': ({'DeepAmes': found}, [], {}), '50-00-0': ({'DeepAmes': None}, ['CCRIS'], {})}
+        with mock.patch.object(views, 'run_batch_queries', return_value=answers) as run:
+            response = self.client.post('/myapp/api/process-batch/', {'cas_rns': '71-43-2, 50-00-0;bad', 'details': 'on'},
+                                        content_type='application/json')
+        run.assert_called_once_with(['71-43-2', '50-00-0'], 'on', None)
+        body = response.json()
+        self.assertEqual(list(body['results']), ['71-43-2'])
+        self.assertEqual(body['results']['71-43-2']['data']['DeepAmes'], {'index': ['Result'], 'columns': [0], 'data': [['Positive']]})
+        self.assertEqual(body['no_hits'], ['50-00-0'])
+        self.assertEqual(body['invalid'], ['bad'])
+        self.assertEqual(body['incomplete'], {'50-00-0': {'sources_timed_out': ['CCRIS'], 'sources_failed': {}}})
+
+        with mock.patch.object(views, 'run_batch_queries', return_value=answers):
+            response = self.client.post('/myapp/api/process-batch/?layout=columnar', {'cas_rns': '71-43-2', 'details': 'on'},
+                                        content_type='application/json')
+        answer = response.json()['results']['71-43-2']
+        self.assertEqual(answer['data']['DeepAmes'], {'index': ['Result'], 'columns': {'cells': [0]}, 'data': [['Positive']]})
+        self.assertEqual(answer['strings'], [])
+
+
+class ScreeningJobTests(TestCase):
+    """Bulk screening jobs: SQLite queue, checkpoints and output files."""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        settings_override = override_settings(JOBS_DB=os.path.join(tmp.name, 'jobs.sqlite3'), JOBS_DIR=os.path.join(tmp.name, 'jobs'),
+                                              JOBS_CHUNK_SIZE=2)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    @staticmethod
+    def fake_batch(cas_rns, details, progress=None):
+        for name in views.BATCH_SOURCE_NAMES:
+            progress(name)
+        found = [cas_rn for cas_rn in cas_rns if cas_rn != '7439-93-2']
+        return {cas_rn: {'cas_rn': cas_rn, 'data': {'DeepAmes': {'index': ['Result'], 'columns': [0], 'data': [['Positive']]}, 'Hansen': None}} for cas_rn in found}, \
+            [cas_rn for cas_rn in cas_rns if cas_rn not in found], {}
+
+    def test_read_cas_csv(self):
+        def read(text):
+            return views.read_cas_csv(SimpleUploadedFile('inventory.csv', text.encode()))
+        self.assertEqual(read('Name;CAS No\nbenzene;71-43-2\nformaldehyde; 50-00-0\n'), ['71-43-2', ' 50-00-0'])
+        self.assertEqual(read('71-43-2\n\n50-00-0\n'), ['71-43-2', '50-00-0'])
+        self.assertEqual(read('Substance\n71-43-2\n'), ['71-43-2'])
+
+    def test_upload_and_progress(self):
+        upload = SimpleUploadedFile('inventory.csv', b'CAS\n71-43-2\nnot a CAS\n50-00-0\n')
+        response = self.client.post('/myapp/api/jobs/', {'file': upload, 'details': 'on'})
+        self.assertEqual(response.status_code, 202)
+        job_id = response.json()['job_id']
+        self.assertEqual(response.json()['invalid'], ['not a CAS'])
+        progress = self.client.get('/myapp/api/jobs/progress/').json()  # the last job of the session
+        self.assertEqual((progress['job_id'], progress['status'], progress['total'], progress['done']), (job_id, 'queued', 2, 0))
+        self.assertEqual(self.client.get('/myapp/api/jobs/unknown/progress/').status_code, 404)
+
+    def test_interrupted_job_resumes(self):
+        job_id = jobs.create_job(['71-43-2', '50-00-0', '7439-93-2'], ['bad'], 'on', 'inventory.csv')
+        self.assertEqual(jobs.claim_job('dead worker')['id'], job_id)
+        self.assertTrue(jobs.save_results(job_id, 'dead worker', [(0, True, b'{"cas_rn": "71-43-2", "data": {}}')]))
+        self.assertIsNone(jobs.claim_job('other worker'))  # still running
+
+        with override_settings(JOBS_STALE_AFTER=0), mock.patch.object(views, 'process_batch', side_effect=self.fake_batch) as batch, \
+                mock.patch('builtins.print'):
+            views.run_screening_worker(once=True)
+        self.assertEqual([call.args[0] for call in batch.call_args_list], [['50-00-0', '7439-93-2']])  # the rest only
+        self.assertFalse(jobs.save_results(job_id, 'dead worker', []))  # the job is not its own any more
+
+        progress = self.client.get(f'/myapp/api/jobs/{job_id}/progress/').json()
+        self.assertEqual((progress['status'], progress['done'], progress['hits'], progress['no_hits']), ('done', 3, 2, 1))
+        summary = b''.join(self.client.get(progress['files']['summary.csv']).streaming_content).decode().splitlines()
+        self.assertEqual(summary, ['cas_rn,status,tables,sources_timed_out,sources_failed', '71-43-2,found,,,', '50-00-0,found,DeepAmes,,',
+                                   '7439-93-2,no hits,,,', 'bad,invalid CAS number,,,'])
+        results = b''.join(self.client.get(progress['files']['results.jsonl']).streaming_content).splitlines()
+        self.assertEqual([json.loads(line)['cas_rn'] for line in results], ['71-43-2', '50-00-0'])
+        workbook = openpyxl.load_workbook(BytesIO(b''.join(self.client.get(progress['files']['results.xlsx']).streaming_content)))
+        self.assertEqual(workbook.sheetnames, ['DeepAmes'])  # 71-43-2 has no table
+        self.assertEqual(list(workbook['DeepAmes'].iter_rows(values_only=True)), [('50-00-0', '0'), ('Result', 'Positive')])
+
+    def test_job_taken_over_while_writing(self):
+        job_id = jobs.create_job(['71-43-2', '50-00-0', '7439-93-2'], [], 'on', 'inventory.csv')
+        job = jobs.claim_job('slow worker')
+        with mock.patch.object(views, 'process_batch', side_effect=self.fake_batch), mock.patch('builtins.print'):
+            with override_settings(JOBS_STALE_AFTER=0):
+                original = jobs.set_progress
+
+                def set_progress(job_id, worker, progress):  # another worker takes the job over once the writing started
+                    if progress.get('written') == 2:
+                        jobs.claim_job('other worker')
+                    return original(job_id, worker, progress)
+
+                with mock.patch.object(jobs, 'set_progress', side_effect=set_progress):
+                    self.assertFalse(views.screen_job(job, 'slow worker'))
+        self.assertEqual(os.listdir(jobs.job_dir(job_id)), [])  # no file of its own left, complete or not
+        self.assertEqual(jobs.get_job(job_id)['worker'], 'other worker')
+
+
+@override_settings(SOURCE_QUERY_TIMEOUTS={'Hansen': 0.05})
+class SourceQueryTests(TestCase):
+    """Sources queried in parallel: one that is too slow or fails leaves the others in the answer."""
+
+    def setUp(self):
+        resultcache.shared_cache().clear()
+        resultcache.clear()
+        self.addCleanup(resultcache.clear)
+        patcher = mock.patch.object(views.registry, 'fingerprint', return_value='sources-v1')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+
+    def queries(self, cas_rn, details):
+        def slow():
+            self.release.wait(5)
+            return pd.DataFrame({'Result': ['Positive']}).transpose()
+
+        def broken():
+            raise ValueError('no such column')
+
+        return {'DeepAmes': lambda: pd.DataFrame({'Result': ['Negative'], 'db_name': ['DeepAmes']}).transpose(),
+                'Hansen': slow, 'IARC': broken,
+                'PPRTV&IRIS': lambda: pd.DataFrame({'71-43-2': ['Benzene']}, index=pd.MultiIndex.from_tuples([('PPRTV', 'Chemical')]))}
+
+    def test_timed_out_and_failed_sources(self):
+        with mock.patch.object(views, 'source_queries', side_effect=self.queries), mock.patch('builtins.print'):
+            response = self.client.post('/myapp/api/process/', {'cas_rn': '71-43-2', 'details': 'on'}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual(body['sources_timed_out'], ['Hansen'])
+        self.assertEqual(body['sources_failed'], {'IARC': 'ValueError: no such column'})
+        self.assertEqual(set(body['data']), {'DeepAmes', 'PPRTV&IRIS'})
+        self.assertEqual(body['data']['DeepAmes']['data'], [['Negative'], ['DeepAmes']])
+        self.assertIsNone(resultcache.get(views.result_cache_key('71-43-2', 'on')))  # an incomplete answer is not cached
+
+
+class AsyncProcessTests(TransactionTestCase):  # the async view writes the result cache from the executor threads
+    """The async process API answers as ProcessAPIView does."""
+
+    def setUp(self):
+        patcher = mock.patch.object(views.registry, 'fingerprint', return_value='sources-v1')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(resultcache.clear)
+
+    @staticmethod
+    def queries(cas_rn, details):
+        def broken():
+            raise KeyError('CAS_NO')
+
+        return {'DeepAmes': lambda: pd.DataFrame({'Result': ['Negative'], 'db_name': ['DeepAmes']}).transpose(),
+                'HOMNA': lambda: None, 'ECVAM_Neg': broken,
+                'AMESCEBS': lambda: (pd.DataFrame({0: ['Positive']}, index=['Summary call']), None),
+                'PPRTV&IRIS': lambda: pd.DataFrame({cas_rn: ['Benzene']}, index=pd.MultiIndex.from_tuples([('PPRTV', 'Chemical')])),
+                'CCRIS': lambda: views.query_ccris_by_cas(cas_rn, details)}
+
+    def post(self, url, body):
+        resultcache.shared_cache().clear()  # computed by each view, not answered from the other one's cache
+        resultcache.clear()
+        with mock.patch.object(views, 'source_queries', side_effect=self.queries), mock.patch('builtins.print'), \
+                mock.patch.object(views, 'resolve_inchikey', return_value=None), \
+                mock.patch.object(views, 'aresolve_inchikey', new=mock.AsyncMock(return_value=None)):
+            if url.startswith('/myapp/api/process-async/'):
+                return async_to_sync(self.async_client.post)(url, body, content_type='application/json')
+            return self.client.post(url, body, content_type='application/json')
+
+    def test_same_answer_as_process_api(self):
+        for layout in ('', '?layout=columnar'):
+            for body in ({'cas_rn': '71-43-2', 'details': 'on'}, {'cas_rn': '71-43-2'}, {'cas_rn': '7439-93-2x'}):
+                sync, asynchronous = self.post(f'/myapp/api/process/{layout}', body), self.post(f'/myapp/api/process-async/{layout}', body)
+                self.assertEqual(asynchronous.status_code, sync.status_code)
+                self.assertEqual(asynchronous['Content-Type'], sync['Content-Type'])
+                sync, asynchronous = sync.json(), asynchronous.json()
+                if 'result_id' in sync:  # a new one for every answer computed
+                    self.assertEqual(asynchronous.pop('download_url').replace(asynchronous.pop('result_id'), ''),
+                                     sync.pop('download_url').replace(sync.pop('result_id'), ''))
+                self.assertEqual(asynchronous, sync)
+                if 'data' in sync:
+                    self.assertEqual(sync['sources_failed'], {'ECVAM_Neg': "KeyError: 'CAS_NO'"})
+
+    def test_same_cache_and_single_flight_as_process_api(self):
+        def queries(cas_rn, details):
+            answers = self.queries(cas_rn, details)
+            del answers['ECVAM_Neg'], answers['CCRIS']  # every source answers: the answer is cached
+            answers['DeepAmes'] = lambda: time.sleep(0.3)  # the second request comes while the first one computes
+            return answers
+
+        async def post_twice():
+            return await asyncio.gather(*(self.async_client.post('/myapp/api/process-async/', body, content_type='application/json')
+                                          for _ in range(2)))
+
+        resultcache.shared_cache().clear()
+        body = {'cas_rn': '71-43-2', 'details': 'on'}
+        with mock.patch.object(views, 'source_queries', side_effect=queries) as source_queries, mock.patch('builtins.print'), \
+                mock.patch.object(views, 'aresolve_inchikey', new=mock.AsyncMock(return_value=None)):
+            first, second = async_to_sync(post_twice)()
+            cached = self.client.post('/myapp/api/process/', body, content_type='application/json')
+        self.assertEqual(source_queries.call_count, 1)
+        self.assertEqual(first.json()['sources_failed'], {})
+        self.assertEqual(second.json(), first.json())  # the same result_id too
+        self.assertEqual(cached.json(), first.json())
+
+
+class ResultCacheTests(TestCase):
+    """Two-tier cache of the process API answers."""
+
+    def setUp(self):
+        resultcache.shared_cache().clear()
+        resultcache.tables_cache().clear()
+        resultcache.clear()
+        self.addCleanup(resultcache.clear)
+        patcher = mock.patch.object(views.registry, 'fingerprint', return_value='sources-v1')
+        self.fingerprint = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def post(self, outputs, timed_out=()):
+        answer = (outputs, list(timed_out), {})
+        with mock.patch.object(views, 'run_source_queries', return_value=answer) as run, mock.patch('builtins.print'):
+            response = self.client.post('/myapp/api/process/', {'cas_rn': '71-43-2', 'details': 'on'}, content_type='application/json')
+        return response, run.called
+
+    def test_lru_size_bound(self):
+        lru = resultcache.LRU()
+        lru.put('a', 1, 40, 100)
+        lru.put('b', 2, 40, 100)
+        lru.get('a')
+        lru.put('c', 3, 40, 100)  # evicts b, the least recently used
+        self.assertEqual((lru.get('a'), lru.get('b'), lru.get('c'), lru.size), (1, None, 3, 80))
+        lru.put('d', 4, 101, 100)  # larger than the bound: not kept
+        self.assertIsNone(lru.get('d'))
+
+    def test_answers_are_cached(self):
+        outputs = {'DeepAmes': pd.DataFrame({'Result': ['Positive']}).transpose()}
+        first, computed = self.post(outputs)
+        self.assertTrue(computed)
+        second, computed = self.post(outputs)
+        self.assertFalse(computed)
+        self.assertEqual(first.json(), second.json())
+
+        resultcache.clear()  # another process: the shared tier answers
+        third, computed = self.post(outputs)
+        self.assertFalse(computed)
+        self.assertEqual(first.json(), third.json())
+
+        self.fingerprint.return_value = 'sources-v2'  # a source file changed
+        self.assertTrue(self.post(outputs)[1])
+
+    def test_incomplete_answers_are_not_cached(self):
+        self.assertEqual(self.post({}, timed_out=['CCRIS'])[0].status_code, 404)
+        self.assertTrue(self.post({}, timed_out=['CCRIS'])[1])
+        self.assertEqual(self.post({})[0].status_code, 404)
+        self.assertFalse(self.post({})[1])  # no data in any source is an answer too
+
+    def test_answers_do_not_evict_locks_or_inchikeys(self):
+        views.inchikey_cache().set('inchikey:71-43-2', 'UHOVQNZJYSORNB-UHFFFAOYSA-N')
+        singleflight.lock_cache().set('flight:result', 'other process')
+        shared = resultcache.shared_cache()
+        with mock.patch.object(shared, '_max_entries', 3):  # the answers culled at the 4th one
+            for i in range(10):
+                resultcache.set(f'result:{i}', {'n': i}, 200)
+        self.assertLessEqual(len([i for i in range(10) if shared.get(f'result:{i}') is not None]), 4)
+        self.assertEqual(views.inchikey_cache().get('inchikey:71-43-2'), 'UHOVQNZJYSORNB-UHFFFAOYSA-N')
+        self.assertEqual(singleflight.lock_cache().get('flight:result'), 'other process')
+
+
+@override_settings(SINGLE_FLIGHT_POLL=0.01)
+class SingleFlightTests(TestCase):
+    """Concurrent identical computations run once."""
+
+    def run_in_threads(self, n, fn):
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(fn())) for _ in range(n)]
+        for thread in threads:
+            thread.start()
+        return threads, results
+
+    def test_threads_share_one_computation(self):
+        started, release, calls = threading.Event(), threading.Event(), []
+
+        def compute():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return 'answer'
+
+        threads, results = self.run_in_threads(5, lambda: singleflight.do('key', compute))
+        started.wait(5)
+        time.sleep(0.05)  # the other threads are waiting now
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, ['answer'] * 5)
+        self.assertEqual(len(calls), 1)
+
+    def test_other_process_computing(self):
+        cache, answers, calls = LocMemCache('singleflight-tests', {}), [], []
+        cache.add('flight:key', 'other process')
+        threads, results = self.run_in_threads(1, lambda: singleflight.do(
+            'key', lambda: calls.append(1) or 'computed here', lookup=lambda: answers[0] if answers else None, cache=cache))
+        time.sleep(0.05)
+        answers.append('computed there')  # the other process stored its answer
+        threads[0].join()
+        self.assertEqual((results, calls), (['computed there'], []))
+
+    def test_lock_released_without_answer(self):
+        cache = LocMemCache('singleflight-tests-2', {})
+        cache.add('flight:key', 'other process')
+        threads, results = self.run_in_threads(1, lambda: singleflight.do('key', lambda: 'computed here', lookup=lambda: None, cache=cache))
+        time.sleep(0.05)
+        cache.delete('flight:key')  # e.g. its answer had a source that timed out
+        threads[0].join()
+        self.assertEqual(results, ['computed here'])
+        self.assertIsNone(cache.get('flight:key'))  # released by this one too
+
+    def test_processes_share_one_computation(self):
+        cache, answers, calls = LocMemCache('singleflight-tests-3', {}), {}, []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.05)
+            answers['key'] = 'answer'  # stored where the other process looks it up
+            return 'answer'
+
+        # two processes: each one calls across_processes, without the coalescing of the threads of one process
+        threads, results = self.run_in_threads(2, lambda: singleflight.across_processes('key', compute, lambda: answers.get('key'), cache))
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, ['answer'] * 2)
+        self.assertEqual(len(calls), 1)
+        self.assertIsNone(cache.get('flight:key'))
+
+    def test_expired_lock_of_another_process_kept(self):
+        cache = LocMemCache('singleflight-tests-4', {})
+
+        def compute():
+            cache.set('flight:key', 'other process')  # this lock expired, another process took it
+            return 'answer'
+
+        self.assertEqual(singleflight.across_processes('key', compute, lambda: None, cache), 'answer')
+        self.assertEqual(cache.get('flight:key'), 'other process')
+
+
+class ResultHandleTests(TestCase):
+    """Tables of the process API answers kept server-side for the download API."""
+
+    def setUp(self):
+        resultcache.shared_cache().clear()
+        resultcache.tables_cache().clear()
+        resultcache.clear()
+        self.addCleanup(resultcache.clear)
+        patcher = mock.patch.object(views.registry, 'fingerprint', return_value='sources-v1')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def process(self):
+        pprtv = pd.DataFrame({'71-43-2': ['Benzene', '0.03']},
+                             index=pd.MultiIndex.from_tuples([('PPRTV', 'Chemical'), ('PPRTV', 'RfC Value')]))
+        outputs = {'DeepAmes': pd.DataFrame({'Result': ['Positive'], 'db_name': ['DeepAmes']}).transpose(), 'PPRTV&IRIS': pprtv}
+        with mock.patch.object(views, 'run_source_queries', return_value=(outputs, [], {})), mock.patch('builtins.print'):
+            return self.client.post('/myapp/api/process/', {'cas_rn': '71-43-2', 'details': 'on'}, content_type='application/json').json()
+
+    def test_download_by_result_id(self):
+        payload = self.process()
+        self.assertEqual(payload['download_url'], f"/myapp/api/download/{payload['result_id']}/")
+        self.assertEqual(self.process()['result_id'], payload['result_id'])  # the cached answer gives the same tables
+
+        resultcache.clear()  # another process: the tables come from the shared tier
+        response = self.client.get(payload['download_url'])
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('71-43-2_results.xlsx', response['Content-Disposition'])
+        workbook = openpyxl.load_workbook(BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(workbook.sheetnames, ['DeepAmes', 'PPRTV&IRIS'])
+        self.assertEqual(list(workbook['DeepAmes'].iter_rows(values_only=True)), [(None, '0'), ('Result', 'Positive'), ('db_name', 'DeepAmes')])
+        self.assertEqual(list(workbook['PPRTV&IRIS'].iter_rows(values_only=True))[1], (0, 'PPRTV', 'Chemical', 'Benzene'))
+
+    def test_answer_computed_again_when_its_tables_are_gone(self):
+        payload = self.process()
+        resultcache.clear()
+        resultcache.tables_cache().clear()  # culled, the answer itself still cached
+        self.assertEqual(self.client.get(payload['download_url']).status_code, 404)
+        payload = self.process()
+        self.assertEqual(self.client.get(payload['download_url']).status_code, 200)
+
+    def test_download_of_posted_answer(self):
+        answer = {'cas_rn': '71-43-2', 'download_ready': True, 'data': {
+            'DeepAmes': {'index': ['Result', 'db_name'], 'columns': [0], 'data': [['Positive'], ['DeepAmes']]},
+            'HOMNA': None, 'notes': {'source': 'not a table'}, 'CCRIS_Data': [{'index': [0], 'columns': ['Test'], 'data': [['Ames']]}],
+        }}
+        with mock.patch('builtins.print'):
+            response = self.client.post('/myapp/api/download/', answer, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        workbook = openpyxl.load_workbook(BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(workbook.sheetnames, ['DeepAmes', 'CCRIS_Data_0'])  # the values that are not tables skipped
+
+    def test_unknown_result_id(self):
+        self.assertEqual(self.client.get('/myapp/api/download/unknown/').status_code, 404)
+
+
+class ColumnarPayloadTests(TestCase):
+    """Split (default) and columnar (?layout=columnar) JSON of the tables of the process API answers."""
+
+    results = {
+        'DeepAmes': pd.DataFrame({1198: ['71-43-2', 'Negative', float('nan'), '', 'DeepAmes'], 1199: ['71-43-2', None, 2018, ' ', 'DeepAmes']},
+                                 index=['CAS_NO', 'Activity', 'Year', 'Note', 'db_name']),
+        'Hansen': pd.DataFrame({0: ['NR', float('nan')]}),  # no data: left out
+        'HOMNA': None,
+        'CCRIS_Data': [pd.DataFrame({0: [None]}), pd.DataFrame({0: ['NR']})],  # None is data for is_empty_table
+        'PPRTV&IRIS': pd.DataFrame({'71-43-2': ['Benzene', 0.03]}, index=pd.MultiIndex.from_tuples([('PPRTV', 'Chemical'), ('PPRTV', 'RfC')])),
+    }
+
+    def test_encoding(self):
+        data, strings = views.encode_tables(views.prepare_tables(self.results))
+        self.assertEqual(strings, ['71-43-2', 'NR', 'PPRTV'])  # found more than once in the arrays of strings
+        self.assertEqual(data['DeepAmes'], {
+            'index': ['CAS_NO', 'Activity', 'Year', 'Note', 'db_name'], 'columns': {'cells': [1198, 1199]},
+            'data': [[0, 'Negative', 1, 1, 'DeepAmes'], {'cells': ['71-43-2', 'NR', 2018, 'NR', 'DeepAmes']}],
+        })
+        self.assertEqual(list(data), ['DeepAmes', 'HOMNA', 'CCRIS_Data', 'PPRTV&IRIS'])
+        self.assertEqual(data['CCRIS_Data'], [{'index': {'cells': [0]}, 'columns': {'cells': [0]}, 'data': [[1]]}])
+        self.assertEqual(data['PPRTV&IRIS']['data']['data'][:2], [[2, 2], ['Chemical', 'RfC']])
+
+    def test_same_tables_as_split_layout(self):
+        legacy = json.loads(views.JSONRenderer().render(views.process_results(self.results)))
+        data, strings = json.loads(views.JSONRenderer().render(views.encode_tables(views.prepare_tables(self.results))))
+        self.assertEqual(list(data), list(legacy))
+        tables = views.decode_tables(data, strings)
+        for name, table in views.decode_tables(legacy).items():
+            for new, old in zip(tables[name] if isinstance(table, list) else [tables[name]], table if isinstance(table, list) else [table]):
+                if isinstance(old, dict):
+                    new, old = new['data'], old['data']
+                pd.testing.assert_frame_equal(new, old)
+
+    def test_split_layout_unchanged(self):
+        legacy = views.JSONRenderer().render(views.process_results(self.results))
+        self.assertEqual(views.JSONRenderer().render(views.split_tables(views.prepare_tables(self.results))), legacy)
+
+    def test_default_response_unchanged(self):
+        resultcache.shared_cache().clear()
+        resultcache.clear()
+        self.addCleanup(resultcache.clear)
+        outputs = {'DeepAmes': self.results['DeepAmes'], 'PPRTV&IRIS': self.results['PPRTV&IRIS']}
+        with mock.patch.object(views.registry, 'fingerprint', return_value='sources-v1'), \
+                mock.patch.object(views, 'run_source_queries', return_value=(outputs, [], {})), mock.patch('builtins.print'):
+            post = lambda url: self.client.post(url, {'cas_rn': '71-43-2', 'details': 'on'}, content_type='application/json')
+            default, columnar, unknown = post('/myapp/api/process/'), post('/myapp/api/process/?layout=columnar'), \
+                post('/myapp/api/process/?layout=arrow')
+            legacy = json.loads(views.JSONRenderer().render(views.process_results(views.collect_results('71-43-2', 'on', outputs))))
+
+        body = default.json()
+        self.assertEqual(body['data'], legacy)
+        self.assertEqual(list(body), ['cas_rn', 'data', 'sources_timed_out', 'sources_failed', 'download_ready', 'result_id', 'download_url'])
+        body = columnar.json()
+        self.assertEqual(body['strings'], ['71-43-2', 'NR', 'PPRTV'])
+        tables = views.decode_tables(body['data'], body['strings'])
+        pd.testing.assert_frame_equal(tables['DeepAmes'], views.decode_tables(legacy)['DeepAmes'])
+        self.assertEqual(unknown.status_code, 400)
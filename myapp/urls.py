@@ -1,9 +1,18 @@
 from django.urls import path
-from .views import ProcessAPIView, DownloadAPIView
+from .views import (ProcessAPIView, BatchProcessAPIView, DownloadAPIView, ReloadSourcesAPIView, ScreeningJobsAPIView,
+                    process_api_async, progress_view, job_file_view)
 
 urlpatterns = [
     path('api/process/', ProcessAPIView.as_view(), name='process_api'),
+    path('api/process-batch/', BatchProcessAPIView.as_view(), name='process_batch_api'),
+    path('api/process-async/', process_api_async, name='process_api_async'),
     path('api/download/', DownloadAPIView.as_view(), name='download_api'),
+    path('api/download/<str:result_id>/', DownloadAPIView.as_view(), name='download_result'),
+    path('api/reload/', ReloadSourcesAPIView.as_view(), name='reload_sources_api'),
+    path('api/jobs/', ScreeningJobsAPIView.as_view(), name='screening_jobs_api'),
+    path('api/jobs/progress/', progress_view, name='screening_progress'),
+    path('api/jobs/<str:job_id>/progress/', progress_view, name='screening_job_progress'),
+    path('api/jobs/<str:job_id>/files/<str:name>', job_file_view, name='screening_job_file'),
 ]
 
 
@@ -1,18 +1,54 @@
 import pandas as pd
 import numpy as np
-from django.shortcuts import render
-from django.http import HttpResponse
-from io import BytesIO
-from collections import OrderedDict
+import asyncio
+import csv
+import datetime
+import hashlib
+import json
+import os
+import re
+import socket
+import tempfile
+import threading
+import time
+import uuid
+import weakref
+from functools import partial
+from itertools import chain
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DatabaseError
+from django.http import FileResponse, Http404, HttpResponse
+from django.urls import reverse
+from io import StringIO
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Border, Font, Side
+from pandas.api.types import is_scalar
+from collections import Counter, OrderedDict
 import requests
+import httpx
 from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from rest_framework.renderers import JSONRenderer
 from rest_framework.views import APIView
 from rest_framework.response import Response
+from rest_framework.permissions import IsAdminUser
 from rest_framework import status
 
+from . import evidence, jobs, resultcache, singleflight, snapshot
+
+try:
+    from rdkit import Chem, RDLogger
+    RDLogger.DisableLog('rdApp.*')
+except ImportError:  # optional: without RDKit the identity table only has the InChIKeys given by the sources
+    Chem = None
 
-# Working directory
-wd= r"C:\Users\s265626\Downloads\genotox_db_2"
+
+# Working directory (the folder that contains manage.py and myproject/media)
+wd= str(settings.BASE_DIR)
 
 # Constants for file paths 
 DEEPAMES_FILE = f"{wd}/myproject/media/DeepAmes.xlsx"  # Update with your actual path
@@ -42,10 +78,13 @@ ECVAM_POS_FILE=f"{wd}/myproject/media/ECVAM_Ames_positives_DB_2024-11-08.xls"
 
 # --- Data Loading and Cleaning Functions ---
 
-def load_dataframe(filepath):
-    """Generic function to load Excel data, handles errors and returns empty DataFrame on failure."""
+def load_dataframe(filepath, **kwargs):
+    """Generic function to load Excel/CSV data, handles errors and returns empty DataFrame on failure."""
     try:
-        df = pd.read_excel(filepath)
+        if str(filepath).endswith('.csv'):
+            df = pd.read_csv(filepath, **kwargs)
+        else:
+            df = pd.read_excel(filepath, **kwargs)
         print(f"Data loaded successfully from {filepath}: {df.shape}")
         return df
     except Exception as e:
@@ -73,7 +112,7 @@ def clean_hansen(df):
 
 
 def clean_oecd_vivo(df):
-    """Cleans and preprocesses the OECD DataFrame."""
+    """Cleans and preprocesses the OECD DataFrame (row by row version of parse_oecd_values, used by the benchmark command)."""
 
     #replace '\n\n\n' that separates the outcomes in 'Values' column with '\n' in order to split the column data
     df['Values'] = df['Values'].str.replace('\n\n\n','\n')
@@ -94,7 +133,7 @@ def clean_oecd_vivo(df):
     return df
 
 def clean_oecd_chromosome(df):
-    """Cleans and preprocesses the OECD chromosome DataFrame."""
+    """Cleans and preprocesses the OECD chromosome DataFrame (row by row version of parse_oecd_values, used by the benchmark command)."""
     df['Values'] = df['Values'].str.replace(r'\n{2,}', '\n', regex=True)
     df['Values1'] = (df['Values'].str.split('\n')
                     .apply(lambda x: OrderedDict.fromkeys(x).keys())
@@ -104,6 +143,52 @@ def clean_oecd_chromosome(df):
     df = df.drop(columns=['Values', 'Values1'] + [str(i) for i in range(9, 20)])
     return df
 
+OECD_VIVO_FIELDS = ['Type_of_information', 'Reliability', 'Endpoint', 'Guideline', 'GLP_compliance', 'Type_assay', 'Results']
+OECD_CHROMOSOME_FIELDS = ['Type_of_information', 'Reliability', 'Endpoint', 'Guideline', 'GLP_compliance', 'Type_assay', 'Strain', 'Metabolic_activation', 'Results']
+
+
+def parse_oecd_values(df, values, fields):
+    """Parses the 'Values' blob of an OECD table into a long table (the ingest version of clean_oecd_* + modify_oecd).
+
+    values are the 'Values' cells with the line separators already normalized.
+    Returns one row per distinct line of a cell: Number, row (position in df),
+    field (categorical, the first len(fields) distinct lines of a cell) and value
+    (categorical, without its prefix). Lines after the known fields are dropped.
+    """
+    lines = values.str.split('\n')
+    lines.index = np.arange(len(lines))
+    exploded = lines.explode()
+    long = pd.DataFrame({'row': exploded.index.to_numpy(), 'value': exploded.to_numpy()})
+    long = long.drop_duplicates(['row', 'value'])  # lines repeated in a cell
+    long['field'] = long.groupby('row').cumcount()
+    long = long[long['field'] < len(fields)].reset_index(drop=True)
+
+    # the prefixes are removed once per distinct line of a field, not once per cell
+    values = long['value'].to_numpy(dtype=object)
+    for code, field in enumerate(fields):
+        rows = np.flatnonzero(long['field'].to_numpy() == code)
+        if field in OECD_PREFIXES and len(rows):
+            codes, uniques = pd.factorize(values[rows])
+            values[rows] = pd.Series(uniques, dtype=object).str.replace(OECD_PREFIXES[field], '', regex=False).to_numpy()[codes]
+
+    return pd.DataFrame({
+        'Number': df['Number'].to_numpy()[long['row']],
+        'row': long['row'].to_numpy(),
+        'field': pd.Categorical.from_codes(long['field'], categories=fields),
+        'value': pd.Categorical(values),
+    })
+
+
+def oecd_wide_table(df, long, fields):
+    """Rebuilds the table the queries return (one column per field) from the long table of parse_oecd_values."""
+    wide = (long.pivot(index='row', columns='field', values='value')
+                .reindex(index=np.arange(len(df)), columns=fields)
+                .astype(object))
+    wide = wide.where(wide.notna(), None)  # like str.split(expand=True): None for the missing lines
+    wide.index = df.index
+    return pd.concat([df.drop(columns='Values'), wide], axis=1)
+
+
 def clean_iarc(df):
     """Cleans and preprocesses the IARC DataFrame."""
     print(f"IARC carc: {df.loc[df.index[-1],'CAS No.']}") # Print the update info
@@ -118,11 +203,11 @@ def clean_ccris(df):
     df.drop(columns=['PUBCHEM_RESULT_TAG', 'PUBCHEM_ACTIVITY_URL', 'PUBCHEM_ACTIVITY_SCORE', 'PUBCHEM_ASSAYDATA_COMMENT'], inplace=True, errors='ignore') # errors='ignore' in case the columns are not found
     df.drop(0, axis=0, inplace=True, errors='ignore') # errors='ignore' in case the row is not found
 
-    for index in df.index:
-        if str(df.loc[index, 'End Point']) == "Ames Salmonella typhimurium":
-            df.loc[index, 'Strain/Indicator'] = df.loc[index, 'Test System']
-            df.loc[index, 'Test System'] = df.loc[index, 'End Point']
-            df.loc[index, 'End Point'] = None
+    # Ames rows: the strain is in 'Test System' and the test system in 'End Point'
+    ames = df['End Point'].astype(str) == "Ames Salmonella typhimurium"
+    df.loc[ames, 'Strain/Indicator'] = df.loc[ames, 'Test System']
+    df.loc[ames, 'Test System'] = "Ames Salmonella typhimurium"
+    df.loc[ames, 'End Point'] = None
     return df
 
 def clean_amescebs(df):
@@ -141,8 +226,6 @@ def clean_PPRTVIRIS(pprtv,iris):
 
   iris.drop(columns='Unnamed: 0', inplace= True)
 
-  pd.options.mode.copy_on_write = True
-
   pprtv['Last Revision']=pprtv['Last Revision'].astype(str)
   pprtv['Last Revision']=pprtv['Last Revision'].str.replace('.0','')
 
@@ -154,27 +237,18 @@ def clean_PPRTVIRIS(pprtv,iris):
 
 
 def clean_jap(df1):
-
-  for col in df1.columns:
-    if str(col).startswith('Unnamed'):
-      df1.drop(col, axis=1, inplace=True)
-  # Create a list of indices to drop instead of modifying the dataframe in place
-  indices_to_drop = []
-  for index in df1.index:
-    # Access the 'Serial_Id' value for the current row using the index
-    if ('Class A' in str(df1.loc[index,'Serial_Id'])) or ('Serial_Id' in str(df1.loc[index,'Serial_Id'])):
-      indices_to_drop.append(index)
-    else: # Only process and modify rows that are not to be dropped
-      df1.loc[index,'SMILES'] = str(df1.loc[index,'SMILES']).replace('\n','')
-      df1.loc[index,'CAS#'] = str(df1.loc[index,'CAS#']).replace('\n','')
-      # Convert 'CAS#' to string if it exists in the DataFrame
-      if 'CAS#' in df1.columns:
-          df1.loc[index, 'CAS#'] = str(df1.loc[index, 'CAS#'])
-
-  # Now drop the rows outside the loop
-  df1.drop(indices_to_drop, axis=0, inplace=True)
-
-  df1['CAS#']=df1['CAS#'].str.replace(' 00:00:00','')
+  """Cleans a HOMNA Class A DataFrame."""
+  df1 = df1.drop(columns=[col for col in df1.columns if str(col).startswith('Unnamed')])
+
+  # drop the repeated header rows ('Class A ...' titles and 'Serial_Id' headers)
+  serial_id = df1['Serial_Id'].astype(str)
+  header_rows = serial_id.str.contains('Class A', regex=False) | serial_id.str.contains('Serial_Id', regex=False)
+  df1 = df1[~header_rows].copy()
+
+  # SMILES and CAS numbers are split over lines in the cells; dates are CAS numbers read by Excel
+  df1['SMILES'] = df1['SMILES'].astype(str).str.replace('\n', '', regex=False)
+  df1['CAS#'] = df1['CAS#'].astype(str).str.replace('\n', '', regex=False)
+  df1['CAS#'] = df1['CAS#'].str.replace(' 00:00:00', '', regex=False)
   if 'Structure' in df1.columns:
     df1.drop(columns='Structure',inplace=True)
 
@@ -188,19 +262,22 @@ def clean_jap(df1):
 
 # --- MODIFY FUNCTIONS --- #
 
+OECD_PREFIXES = {
+    'Type_of_information': 'Type of information:',
+    'Reliability': 'Reliability:',
+    'Endpoint': 'Endpoint:',
+    'Guideline': 'Guideline:',
+    'GLP_compliance': 'GLP compliance:',
+    'Type_assay': 'Type of assay:',
+    'Strain': 'Species / strain, Species / strain:',
+    'Metabolic_activation': 'Species / strain, Metabolic activation:',
+    'Results': 'Test results,'
+}
+
+
 def modify_oecd(df):
     """Modifies the OECD DataFrame to remove prefixes."""
-    prefixes = {
-        'Type_of_information': 'Type of information:',
-        'Reliability': 'Reliability:',
-        'Endpoint': 'Endpoint:',
-        'Guideline': 'Guideline:',
-        'GLP_compliance': 'GLP compliance:',
-        'Type_assay': 'Type of assay:',
-        'Strain': 'Species / strain, Species / strain:',
-        'Metabolic_activation': 'Species / strain, Metabolic activation:',
-        'Results': 'Test results,'
-    }
+    prefixes = OECD_PREFIXES
     for col, prefix in prefixes.items():
         if col in df.columns: #check if the column exists
             df[col] = df[col].str.replace(prefix, '', regex=False) #regex=False for literal string replacement
@@ -220,38 +297,25 @@ def modify_activity_iarc(dt):
 
 
 
-def ccris_summary_table(dt):
-    """Generates a summary table for CCRIS data."""
-    summarized_data = []
-    dg_list = []
-    summary_call = 'N/D'
-
-    for name, group in dt.groupby(['Test System']):
-        dg1 = group
-        dg_list.append(dg1)
+def ccris_summaries(df):
+    """Computes the summary of every InChIKey and Test System of CCRIS at ingest.
 
-        test_system = name  # Name is already a single value in this case
-        ames_strains = ', '.join(group['Strain/Indicator'].unique().astype(str))
-
-        positives = group['Results'].str.contains('POSITIVE', case=False).sum()
-        negatives = group['Results'].str.contains('NEGATIVE', case=False).sum()
-        equivocals = group['Results'].str.contains('EQUIVOCAL', case=False).sum()
-
-        result = f"P/N/E= {positives} / {negatives} / {equivocals}"
-
-        if positives != 0 and negatives != 0:
-            summary_call = 'Conflicted'
-        elif positives != 0 and negatives == 0:
-            summary_call = 'Positive'
-        elif negatives != 0 and positives == 0:
-            summary_call = 'Negative'
-        elif result == 'P/N/E= 0 / 0 / 0':
-            summary_call = 'N/D'
-
-        summarized_data.append([test_system, ames_strains, result, summary_call])
+    For each pair: the Ames strains, the P/N/E counts of the results and the summary call.
+    df must be sorted by INCHI_key and Test System: the rows of a summary are df.iloc[start:stop].
+    """
+    keys = ['INCHI_key', 'Test System']
+    grouped = df[keys].assign(position=np.arange(len(df))).groupby(keys, sort=False)
+    summary = evidence.summarize(grouped, evidence.encode(df['Results'], ('POSITIVE', 'NEGATIVE', 'EQUIVOCAL')))
+    summary['start'] = grouped['position'].min().to_numpy()
+    summary['stop'] = grouped['position'].max().to_numpy() + 1
+    summary['Ames Strains'] = df.groupby(keys, sort=False)['Strain/Indicator'].agg(lambda s: ', '.join(s.unique().astype(str))).to_numpy()
 
-    summary_df = pd.DataFrame(summarized_data, columns=['Test System', 'Ames Strains', 'Result', 'Summary call'])
-    return dg_list, summary_df
+    counts = summary[evidence.COUNT_COLUMNS].to_numpy()
+    summary['Result'] = evidence.format_counts(counts)
+    # as before, a Test System with only equivocal results keeps the call of the previous one
+    call = pd.Series(evidence.calls(counts, negative_with_equivocal='Negative', equivocal_only=None), index=summary.index)
+    summary['Summary call'] = call.groupby(summary['INCHI_key']).ffill().fillna('N/D')
+    return summary[['INCHI_key', 'Test System', 'Ames Strains', 'Result', 'Summary call', 'start', 'stop'] + evidence.COUNT_COLUMNS]
 
 
 def modify_amescebs(dt):
@@ -259,180 +323,131 @@ def modify_amescebs(dt):
     dt['+-s9'] = dt['Microsomal Activation Condition'].apply(lambda x: '-S9' if x == 'Without S9' else '+S9')  # More efficient using apply
     return dt
 
-def cebs_supersummary_table(dt):
-    """Generates the AMESCEBS supersummary table."""
-    positives = dt['Trial Conclusion'].str.contains('Positive', case=False).sum()
-    negatives = dt['Trial Conclusion'].str.contains('Negative', case=False).sum()
-    equivocals = dt['Trial Conclusion'].str.contains('Equivocal', case=False).sum()
-
-    summary_call = 'N/D'  # Default value
-    if positives != 0 and negatives != 0:
-        summary_call = 'Conflicted'
-    elif positives != 0 and negatives == 0:
-        summary_call = 'Positive'
-    elif negatives != 0 and positives == 0 and equivocals == 0:
-        summary_call = 'Negative'
-    elif negatives != 0 and positives == 0 and equivocals != 0:
-        summary_call = 'Equivocal'
-    # elif result == 'P/N/E= 0 / 0 / 0':  # This condition is always false, because result is defined after this if
-    #     summary_call = 'N/D' # removed this condition because it is redundant.
-
-    result = f"{summary_call}, P/N/E= {positives} / {negatives} / {equivocals}"
-
-    unique_strains = ', '.join(dt['Strain'].unique())
-
-    summary_df = pd.DataFrame(data=[[unique_strains, result]],
-                              columns=['Strains', 'Summary call'])
-
-    return summary_df
-
-
-
-def cebs_summary_table(dt):
-    """Generates the AMESCEBS summary table."""
-    summarized_data = []
-
-    for (strain, s9_condition), group in dt.groupby(['Strain', '+-s9']):
-        positives = group['Trial Conclusion'].str.contains('Positive', case=False).sum()
-        negatives = group['Trial Conclusion'].str.contains('Negative', case=False).sum()
-        equivocals = group['Trial Conclusion'].str.contains('Equivocal', case=False).sum()
-
-        summary_call = 'N/D'
-        if positives != 0 and negatives != 0:
-            summary_call = 'Conflicted'
-        elif positives != 0 and negatives == 0:
-            summary_call = 'Positive'
-        elif negatives != 0 and positives == 0 and equivocals == 0:
-            summary_call = 'Negative'
-        elif negatives != 0 and positives == 0 and equivocals != 0:
-            summary_call = 'Equivocal'
+def cebs_summaries(df):
+    """Computes the summary of every CAS number, Strain and S9 condition of AMES CEBS, and the supersummary of every CAS number.
 
-        result = f"P/N/E= {positives} / {negatives} / {equivocals}"
-
-        summarized_data.append([strain, s9_condition, result, summary_call])
-
-    summary_df = pd.DataFrame(summarized_data, columns=['Test System', 'Metabolic Activation', 'Result', 'Summary call'])
-    return summary_df
-
-
-def genotox_openfoodtox(cas_rn,subst_name,genotox_df,outputs_df):
-
-  dt_genotox = genotox_df[genotox_df['Substance'] == subst_name]
- # dt_genotox=genotox_df.query(f'Substance == "{subst_name}"')
-
-  genotox_ref=pd.merge(dt_genotox, outputs_df, on=['OutputID','Substance'], how='left')
-  # genotox_ref.drop(columns='URL',inplace=True)
-  if not genotox_ref.empty:
-
-    genotox_summary={}
-    try:
-      #generate smiles from CAS number
-      extracted_row_CAS = str(cas_rn)
-      smiles = cirpy.resolve(extracted_row_CAS, 'smiles')
-
-      #getting rdkit mol object from smiles
-      D_structure= Chem.MolFromSmiles(smiles)
-    except:
-      D_structure='No 2D structure found'
-      print(f"OpenFoodTox: No smiles found for CAS_NO: {cas_rn}")
-
-    # Calculate P/N/E counts for all strains
-    positives = dt_genotox['Genotoxicity'].str.contains('Positive', case=False).sum()
-    negatives = dt_genotox['Genotoxicity'].str.contains('Negative', case=False).sum()
-    equivocals = dt_genotox['Genotoxicity'].str.contains('Equivocal|Ambiguous', case=False).sum()
-
-    summary_call='N/D'
-    #decide the summary call
-    if positives != 0 and negatives != 0:
-      summary_call= 'Conflicted'
-    elif positives!=0 and negatives==0:
-      summary_call= 'Positive'
-    elif negatives!=0 and positives==0 and equivocals==0:
-      summary_call= 'Negative'
-    elif negatives!=0 and positives==0 and equivocals!=0:
-      summary_call= 'Equivocal'
-    elif negatives==0 and positives==0 and equivocals==0:
-      summary_call= 'N/D'
-
-    result =  f"{summary_call}, P/N/E= {positives} / {negatives} / {equivocals}"
-
-
-
-    genotox_summary=dt_genotox.iloc[0]['Substance'],result,D_structure
-    genotox_summary=pd.DataFrame(genotox_summary,index=['Substance','Summary','2D_structure'],columns=[str(cas_rn)])
-
-    if genotox_summary.empty:
-      genotox_summary=None
-  else:
-    genotox_summary=None
-    genotox_ref=None
-  return genotox_summary, genotox_ref
-
-def refpoint_openfoodtox(subst_name,refpoint_df,outputs_df):
+    For each: the P/N/E counts of the trial conclusions and the summary call. Both tables are
+    keyed by CAS_NO, the summary rows of a CAS number in Strain and S9 order.
+    """
+    rows = df[['Strain', '+-s9']].assign(CAS_NO=df['CAS_NO'].map(normalize_cas))
+    codes = evidence.encode(df['Trial Conclusion'], ('Positive', 'Negative', 'Equivocal'))
+
+    summary = evidence.summarize(rows.groupby(['CAS_NO', 'Strain', '+-s9']), codes)
+    summary = summary.rename(columns={'Strain': 'Test System', '+-s9': 'Metabolic Activation'})
+    counts = summary[evidence.COUNT_COLUMNS].to_numpy()
+    summary['Result'] = evidence.format_counts(counts)
+    summary['Summary call'] = evidence.calls(counts)
+
+    grouped = rows.groupby('CAS_NO', sort=False)
+    supersummary = evidence.summarize(grouped, codes)
+    supersummary['Strains'] = grouped['Strain'].agg(lambda s: ', '.join(s.dropna().unique().astype(str))).to_numpy()
+    counts = supersummary[evidence.COUNT_COLUMNS].to_numpy()
+    supersummary['Summary call'] = [f"{call}, {result}" for call, result in zip(evidence.calls(counts), evidence.format_counts(counts))]
+
+    return (summary[['CAS_NO', 'Test System', 'Metabolic Activation', 'Result', 'Summary call'] + evidence.COUNT_COLUMNS],
+            supersummary[['CAS_NO', 'Strains', 'Summary call'] + evidence.COUNT_COLUMNS])
+
+
+# --- OPENFOODTOX FUNCTIONS --- #
+# The genotoxicity, reference point and reference value tables are joined with the EFSA
+# outputs when the source is loaded; prepare_openfoodtox then finds, for every CAS number
+# of SubstanceCharacterisation, the rows of each table (by component name, else by
+# substance name) so that a query is a single lookup.
+OPENFOODTOX_TABLES = ['genotox', 'refpoint', 'refvalue']
+
+
+def openfoodtox_join_values(df, columns):
+  """Joins the values of the given columns of every row in one string, e.g. Endpoint, qualifier, value and unit."""
+  text = df[columns[0]].map(str)
+  for col in columns[1:]:
+    text = text + df[col].map(str)
+  return text
+
+
+def build_name_index(series):
+  """Maps every substance name of a column to the positions of its rows (exact names, not stripped like CAS numbers)."""
+  keys = series.where(series.map(lambda value: isinstance(value, str))).to_numpy()
+  return pd.Series(np.arange(len(keys))).groupby(keys, dropna=True).indices
+
+
+def prepare_openfoodtox(tables):
+  """Finds the OpenFoodTox rows of every CAS number: {'substances': {CAS: {table: row positions or None, 'genotox_result'}}}."""
+  names = {key: build_name_index(tables[key]['Substance']) for key in OPENFOODTOX_TABLES}
+
+  # summary call and P/N/E counts of the genotoxicity calls of every substance name
+  groups = np.full(len(tables['genotox']), -1)
+  for number, positions in enumerate(names['genotox'].values()):
+    groups[positions] = number
+  codes = evidence.encode(tables['genotox']['Genotoxicity'], ('Positive', 'Negative', 'Equivocal|Ambiguous'))
+  counts = evidence.count(codes, groups, len(names['genotox']))
+  results = {name: f"{call}, {result}"
+             for name, call, result in zip(names['genotox'], evidence.calls(counts), evidence.format_counts(counts))}
+
+  substcharact = tables['substcharact']
+  substances = {}
+  for cas_rn, positions in build_cas_index(substcharact['CASNumber']).items():
+    row = substcharact.iloc[positions[0]]
+    candidates = [str(row['Component']), str(row['Substance'])]
+    substance = {}
+    for key in OPENFOODTOX_TABLES:
+      name = next((name for name in candidates if name in names[key]), None)
+      substance[key] = None if name is None else names[key][name]
+      if key == 'genotox':
+        substance['genotox_result'] = results.get(name)
+    substances[cas_rn] = substance
+  return {'substances': substances}
 
-  dt_refpoint = refpoint_df[refpoint_df['Substance'] == subst_name]
-  #dt_refpoint=refpoint_df.query(f'Substance == "{subst_name}"')
 
-  if dt_refpoint.empty:
-    refpoint_ref=None
-  else:
-    for index in dt_refpoint.index:
-      dt_refpoint.loc[index,'refpoint']=str(f"{dt_refpoint.loc[index,'Endpoint']}{dt_refpoint.loc[index,'qualifier']}{dt_refpoint.loc[index,'value']}{dt_refpoint.loc[index,'unit']}")
+def joined_table_PPRTV_IRIS(pprtv_dt,iris_dt):
 
-    dt_refpoint.drop(columns=['Endpoint','qualifier','value','unit'], inplace=True)
+    left_j=pd.merge(pprtv_dt,iris_dt, on=['CASRN'], how='left')
+    # top-level header of every column: 'PPRTV', 'IRIS', or '' for the common ones like 'CASRN'
+    left_j.columns = pd.MultiIndex.from_tuples([('PPRTV', col) if col in pprtv_dt.columns else ('IRIS', col) if col in iris_dt.columns else ('', col)
+                                                for col in left_j.columns])
 
-    # dt_refpoint['DurationDays']=dt_refpoint['DurationDays'].astype(int)
+    # the IRIS chemical name is left out when it repeats the PPRTV one
+    if not left_j.empty and ('IRIS', 'Chemical Name') in left_j.columns and ('PPRTV', 'Chemical') in left_j.columns:
+      same_name = left_j[('IRIS', 'Chemical Name')].astype(str).str.lower() == left_j[('PPRTV', 'Chemical')].astype(str).str.lower()
+      if same_name.any():
+        left_j.drop(columns=('IRIS', 'Chemical Name'), inplace=True)
 
-    refpoint_ref=pd.merge(dt_refpoint,outputs_df , on=['OutputID','Substance'], how='left')
+    left_j.dropna(axis=1, how='all', inplace=True)
 
-  return refpoint_ref
+    return left_j.transpose()
 
-def refvalue_openfoodtox(subst_name,refvalue_df,outputs_df):
 
-  dt_refvalue = refvalue_df[refvalue_df['Substance'] == subst_name]
-  #dt_refvalue=refvalue_df.query(f'Substance == "{subst_name}"')
+def pprtv_iris_table(pprtv_dt, iris_dt, cas_rn):
+  """Builds the PPRTV/IRIS table of one substance from its PPRTV and IRIS rows (iris_dt None if none), None if there are none."""
+  pprtv_dt=add_cas_db_version_identificative(pprtv_dt,cas_rn,PPRTV_FILE)
+  iris_dt=add_cas_db_version_identificative(iris_dt,cas_rn,IRIS_FILE)
 
-  if dt_refvalue.empty:
-    refvalue_ref=None
+  if pprtv_dt.empty and iris_dt is None:
+    return None
+  elif pprtv_dt.empty:
+    return iris_dt.dropna(axis=1, how='all').transpose()
+  elif iris_dt is None:
+    return pprtv_dt.transpose()
   else:
-    for index in dt_refvalue.index:
-      dt_refvalue.loc[index,'Refvalue']=str(f"{dt_refvalue.loc[index,'Assessment']}{dt_refvalue.loc[index,'qualfier']}{dt_refvalue.loc[index,'value']}{dt_refvalue.loc[index,'unit']}")
-    dt_refvalue.drop(columns=['Assessment','qualfier','value','unit'], inplace=True)
+    return joined_table_PPRTV_IRIS(pprtv_dt,iris_dt)
 
-    refvalue_ref=pd.merge(dt_refvalue,outputs_df , on=['OutputID','Substance'], how='left')
 
+def prepare_pprtv_iris(tables):
+  """Joins the PPRTV and IRIS rows of every CAS number: {'tables': {CAS: PPRTV/IRIS table}}."""
+  pprtv, iris = tables['pprtv'], tables['iris']
 
-  return refvalue_ref
-
-def joined_table_PPRTV_IRIS(pprtv_dt,iris_dt):
+  # the first PPRTV row of a substance with neither an RfC nor an RfD value is left out
+  keys = pprtv['CASRN'].map(normalize_cas)
+  not_available = (pprtv['RfC Value'].astype(str) == 'Not available') & (pprtv['RfD Value'].astype(str) == 'Not available')
+  first = not_available & (not_available.astype(int).groupby(keys).cumsum() == 1)
+  pprtv = pprtv[~first]
 
-    left_j=pd.merge(pprtv_dt,iris_dt, on=['CASRN'], how='left')
-    # Create a list to store the multi-level column names
-    new_columns = []
-
-    # Iterate through the columns of left_j
-    for col in left_j.columns:
-      # If the column is in pprtv_dt, assign 'PPRTV' as the top-level header
-      if col in pprtv_dt.columns:
-          new_columns.append(('PPRTV', col))
-      # If the column is in iris_dt, assign 'IRIS' as the top-level header
-      elif col in iris_dt.columns:
-          new_columns.append(('IRIS', col))
-      else:  # For common columns like 'CASRN'
-          new_columns.append(('', col))
-
-    # Assign the new multi-level columns to left_j
-    left_j.columns = pd.MultiIndex.from_tuples(new_columns)
-
-    # If left_j is not empty and has the required columns
-    if not left_j.empty and ('IRIS', 'Chemical Name') in left_j.columns and ('PPRTV', 'Chemical') in left_j.columns:
-      for index in left_j.index:
-        if str(left_j.loc[index][('IRIS', 'Chemical Name')]).lower()==str(left_j.loc[index][('PPRTV','Chemical')]).lower():
-          left_j.drop(columns=('IRIS', 'Chemical Name'), inplace=True)
-
-    left_j.dropna(axis=1, how='all', inplace=True)
-
-    return left_j.transpose()
+  pprtv_index = build_cas_index(pprtv['CASRN'])
+  iris_index = build_cas_index(iris['CASRN'])
+  by_cas = {}
+  for cas_rn in pprtv_index.keys() | iris_index.keys():
+    iris_dt = iris.iloc[iris_index[cas_rn]] if cas_rn in iris_index else None
+    by_cas[cas_rn] = pprtv_iris_table(pprtv.iloc[pprtv_index.get(cas_rn, [])], iris_dt, cas_rn)
+  return {'tables': by_cas}
 
 
 def add_cas_db_version_identificative(dt,cas_rn,db_file):
@@ -484,55 +499,513 @@ def add_cas_db_version_identificative(dt,cas_rn,db_file):
   }
 
   if dt is not None:
-    dt['cas_rn'] = cas_rn
+    # new columns on a new frame: the rows given may be a slice of a source table
+    # (cas_rn can also be an array, the CAS number of every row)
+    columns = {'cas_rn': cas_rn}
     if str(db_file) in diz_db_name:
-      dt['db_name'] = diz_db_name[str(db_file)]
+      columns['db_name'] = diz_db_name[str(db_file)]
     if str(db_file) in diz_db_version:
-      dt['db_version']= diz_db_version[str(db_file)]
+      columns['db_version'] = diz_db_version[str(db_file)]
+    dt = dt.assign(**columns)
   return dt
 
 
 
 
+# --- SOURCE REGISTRY --- #
+
+def load_deepames_source():
+    """Loads and cleans the DeepAmes database."""
+    return {'data': clean_deepames(load_dataframe(DEEPAMES_FILE))}
+
+
+def load_hansen_source():
+    """Loads and cleans the Hansen database."""
+    return {'data': clean_hansen(load_dataframe(HANSEN_FILE))}
+
+
+def load_oecd_vivo_source():
+    """Loads the OECD in vivo database and parses its 'Values' into the long and the query tables."""
+    df = load_dataframe(OECD_VIVO_FILE)
+    if df.empty:
+        return {'data': df}
+    # same separators as clean_oecd_vivo: '\n\n\n' then '\n\n' become '\n'
+    values = df['Values'].str.replace('\n\n\n', '\n', regex=False).str.replace('\n\n', '\n', regex=False)
+    long = parse_oecd_values(df, values, OECD_VIVO_FIELDS)
+    return {'data': oecd_wide_table(df, long, OECD_VIVO_FIELDS), 'values': long}
+
+
+def load_oecd_chromosome_source():
+    """Loads the OECD in vitro chromosome database and parses its 'Values' into the long and the query tables."""
+    df = load_dataframe(OECD_CHROMOSOME_FILE)
+    if df.empty or 'Number' not in df.columns:
+        return {'data': df}
+    values = df['Values'].str.replace(r'\n{2,}', '\n', regex=True)
+    long = parse_oecd_values(df, values, OECD_CHROMOSOME_FIELDS)
+    return {'data': oecd_wide_table(df, long, OECD_CHROMOSOME_FIELDS), 'values': long}
+
+
+def load_iarc_source():
+    """Loads and cleans the IARC database, adding the activity descriptions."""
+    df = load_dataframe(IARC_FILE, header=0, skiprows=[0])
+    if not df.empty:
+        df = modify_activity_iarc(clean_iarc(df))
+    return {'data': df}
+
+
+def load_ccris_source():
+    """Loads and cleans the CCRIS database and computes the summary of every InChIKey."""
+    df = load_dataframe(CCRIS_FILE)
+    if df.empty:
+        return {'data': df}
+    df = clean_ccris(df)
+    # rows of a substance and Test System next to each other, in their original order
+    df = df.sort_values(['INCHI_key', 'Test System'], kind='stable', na_position='last')
+    return {'data': df, 'summary': ccris_summaries(df)}
+
+
+def load_amescebs_source():
+    """Loads and cleans the AMES CEBS database, adding the '+-s9' column, and computes the summaries of every CAS number."""
+    df = load_dataframe(AMESCEBS_FILE)
+    if df.empty:
+        return {'data': df}
+    df = modify_amescebs(clean_amescebs(df))
+    summary, supersummary = cebs_summaries(df)
+    return {'data': df, 'summary': summary, 'supersummary': supersummary}
+
+
+def load_openfoodtox_source():
+    """Loads the five OpenFoodTox workbooks and joins the genotoxicity, reference point and reference value tables with the EFSA outputs."""
+    outputs_df = load_dataframe(OPENFOODTOX_EFSA_OUPUTS_FILE)
+    genotox_df = load_dataframe(OPENFOODTOX_GENOTOX_FILE)
+    refpoint_df = load_dataframe(OPENFOODTOX_REFPOINT_FILE)
+    refvalue_df = load_dataframe(OPENFOODTOX_REFVALUE_FILE)
+    substcharact_df = load_dataframe(OPENFOODTOX_SUBSTCHARACT_FILE)
+    if outputs_df.empty or genotox_df.empty or refpoint_df.empty or refvalue_df.empty:
+        return {key: pd.DataFrame() for key in OPENFOODTOX_TABLES} | {'substcharact': substcharact_df}
+
+    outputs_df.drop(columns='URL',inplace=True)
+    outputs_df['Published']=outputs_df['Published'].astype(str)
+
+    refpoint_df['refpoint'] = openfoodtox_join_values(refpoint_df, ['Endpoint','qualifier','value','unit'])
+    refpoint_df.drop(columns=['Endpoint','qualifier','value','unit'], inplace=True)
+    refvalue_df['Refvalue'] = openfoodtox_join_values(refvalue_df, ['Assessment','qualfier','value','unit'])
+    refvalue_df.drop(columns=['Assessment','qualfier','value','unit'], inplace=True)
+
+    return {
+        'genotox': pd.merge(genotox_df, outputs_df, on=['OutputID','Substance'], how='left'),
+        'refpoint': pd.merge(refpoint_df, outputs_df, on=['OutputID','Substance'], how='left'),
+        'refvalue': pd.merge(refvalue_df, outputs_df, on=['OutputID','Substance'], how='left'),
+        'substcharact': substcharact_df,
+    }
+
+
+def load_pprtv_iris_source():
+    """Loads and cleans the PPRTV and IRIS databases."""
+    pprtv = load_dataframe(PPRTV_FILE)
+    iris = load_dataframe(IRIS_FILE)
+    if not pprtv.empty and not iris.empty:
+        pprtv, iris = clean_PPRTVIRIS(pprtv, iris)
+    return {'pprtv': pprtv, 'iris': iris}
+
+
+def load_homna_source():
+    """Loads and cleans the three HOMNA Class A files and merges them in one table."""
+    df1 = load_dataframe(HOMNA_183, header=0, skiprows=[0])
+    df2 = load_dataframe(HOMNA_236, header=0, skiprows=[0])
+    df3 = load_dataframe(HOMNA_253)
+    if df1.empty or df2.empty or df3.empty:
+        return {'data': pd.DataFrame()}
+
+    df_final=pd.concat([clean_jap(df1), clean_jap(df2), clean_jap(df3)], ignore_index=True)
+    df_final.drop_duplicates(inplace=True)
+    df_final.rename(columns={'CAS#':'CAS_NO'}, inplace=True)
+    df_final['AMES RESULT']='Class A: Strong Positive'  # every substance of the Class A lists
+    return {'data': df_final}
+
+
+def load_ecvam_neg_source():
+    """Loads and cleans the ECVAM negative database."""
+    df = load_dataframe(ECVAM_NEG_FILE, header=0, skiprows=[0])
+    if not df.empty:
+        df = clean_ecvam_neg(df)
+    return {'data': df}
+
+
+def load_ecvam_pos_source():
+    """Loads and cleans the ECVAM positive database and its references sheet."""
+    df = load_dataframe(ECVAM_POS_FILE, header=0, skiprows=[0])
+    if df.empty:
+        return {'data': df, 'references': pd.DataFrame()}
+    return {'data': clean_ecvam_pos(df), 'references': startcleanECVAM_pos_references()}
+
+
+# every source: the files it is read from, the function that loads and cleans them,
+# for each table the identifier column (CAS number or InChIKey) to index and the
+# version of the loader (increase it when the tables it returns change: see snapshot.py)
+SOURCES = {
+    'DeepAmes': {'files': [DEEPAMES_FILE], 'load': load_deepames_source, 'index': {'data': 'CAS_NO'}},
+    'Hansen': {'files': [HANSEN_FILE], 'load': load_hansen_source, 'index': {'data': 'CAS_NO'}},
+    'OECD_VIVO': {'files': [OECD_VIVO_FILE], 'load': load_oecd_vivo_source, 'index': {'data': 'Number', 'values': 'Number'},
+                  'version': 2},
+    'OECD_CHROMOSOME': {'files': [OECD_CHROMOSOME_FILE], 'load': load_oecd_chromosome_source,
+                        'index': {'data': 'Number', 'values': 'Number'}, 'version': 2},
+    'IARC': {'files': [IARC_FILE], 'load': load_iarc_source, 'index': {'data': 'CAS_numb'}},
+    'CCRIS': {'files': [CCRIS_FILE], 'load': load_ccris_source, 'index': {'data': 'INCHI_key', 'summary': 'INCHI_key'},
+              'version': 3},
+    'AMESCEBS': {'files': [AMESCEBS_FILE], 'load': load_amescebs_source,
+                 'index': {'data': 'CAS_NO', 'summary': 'CAS_NO', 'supersummary': 'CAS_NO'}, 'version': 3},
+    'OPENFOODTOX': {'files': [OPENFOODTOX_EFSA_OUPUTS_FILE, OPENFOODTOX_GENOTOX_FILE, OPENFOODTOX_REFPOINT_FILE,
+                              OPENFOODTOX_REFVALUE_FILE, OPENFOODTOX_SUBSTCHARACT_FILE], 'load': load_openfoodtox_source,
+                    'index': {'substcharact': 'CASNumber'}, 'prepare': prepare_openfoodtox, 'version': 3},
+    'PPRTV_IRIS': {'files': [PPRTV_FILE, IRIS_FILE], 'load': load_pprtv_iris_source, 'index': {'pprtv': 'CASRN', 'iris': 'CASRN'},
+                   'prepare': prepare_pprtv_iris, 'version': 2},
+    'HOMNA': {'files': [HOMNA_183, HOMNA_236, HOMNA_253], 'load': load_homna_source, 'index': {'data': 'CAS_NO'}, 'version': 2},
+    'ECVAM_NEG': {'files': [ECVAM_NEG_FILE], 'load': load_ecvam_neg_source, 'index': {'data': 'CAS_no'}, 'version': 5},
+    'ECVAM_POS': {'files': [ECVAM_POS_FILE], 'load': load_ecvam_pos_source, 'index': {'data': 'CAS_no_cleaned'}, 'version': 5},
+}
+
+
+# --- IDENTITY TABLE --- #
+# CCRIS is keyed by InChIKey, the other sources by CAS number: the identity table collects
+# the identifiers of every bundled source so that most CAS numbers are resolved without Cactus.
+# (source, table, CAS column, InChIKey column, SMILES column), the sources giving InChIKeys first
+IDENTITY_COLUMNS = [
+    ('ECVAM_NEG', 'data', 'CAS_no', 'InChiKey', 'Smiles'),
+    ('OPENFOODTOX', 'substcharact', 'CASNumber', None, 'smiles'),
+    ('DeepAmes', 'data', 'CAS_NO', None, 'Canonical_Smiles'),
+    ('Hansen', 'data', 'CAS_NO', None, 'Canonical_Smiles'),
+    ('HOMNA', 'data', 'CAS_NO', None, 'SMILES'),
+]
+
+
+def smiles_to_inchikey(smiles):
+    """Computes the standard InChIKey of a SMILES with RDKit, None if not possible."""
+    if Chem is None or not isinstance(smiles, str) or not smiles:
+        return None
+    mol = Chem.MolFromSmiles(smiles)
+    if mol is None:
+        return None
+    return Chem.MolToInchiKey(mol) or None
+
+
+def load_identity_source():
+    """Builds the CAS / InChIKey / SMILES table of the substances of the bundled sources.
+
+    InChIKeys given by a source come first, then the ones computed from the SMILES
+    (if RDKit is installed), the most frequent first.
+    """
+    frames = []
+    for name, key, cas_col, inchikey_col, smiles_col in IDENTITY_COLUMNS:
+        df = registry.table(name, key)
+        if cas_col not in df.columns:
+            continue
+        frames.append(pd.DataFrame({
+            'CAS': df[cas_col].map(normalize_cas),
+            'InChIKey': df[inchikey_col].map(normalize_cas) if inchikey_col else None,
+            'SMILES': df[smiles_col].astype('string').str.replace(r'\s+', '', regex=True).astype(object),  # HOMNA SMILES are split over lines
+            'source': name,
+        }))
+    columns = ['CAS', 'InChIKey', 'SMILES', 'origin', 'sources']
+    if not frames:
+        return {'data': pd.DataFrame(columns=columns)}
+    df = pd.concat(frames, ignore_index=True)
+    df = df[df['CAS'].notna() & df['CAS'].map(lambda cas: is_valid_cas(cas) if cas else False)]
+    df['SMILES'] = df['SMILES'].where(df['SMILES'].notna() & (df['SMILES'] != ''), None)
+
+    # keep only well formed InChIKeys, compute the missing ones from the SMILES
+    given = df['InChIKey'].map(lambda key: bool(key) and bool(INCHIKEY_RE.match(key)))
+    df['InChIKey'] = df['InChIKey'].where(given, None)
+    df['origin'] = np.where(given, 'source', 'smiles')
+    if Chem is None:
+        print("RDKit not installed: the identity table only has the InChIKeys given by the sources")
+    else:
+        missing = ~given & df['SMILES'].notna()
+        computed = {smiles: smiles_to_inchikey(smiles) for smiles in df.loc[missing, 'SMILES'].unique()}
+        df.loc[missing, 'InChIKey'] = df.loc[missing, 'SMILES'].map(computed)
+
+    df = df[df['InChIKey'].notna() | df['SMILES'].notna()]
+    df = (df.groupby(['CAS', 'InChIKey', 'SMILES', 'origin'], dropna=False, sort=False)['source']
+            .agg(lambda names: ', '.join(dict.fromkeys(names))).rename('sources').reset_index())
+    votes = df.groupby(['CAS', 'InChIKey'], dropna=False)['CAS'].transform('size')
+    df = (df.assign(rank=(df['origin'] != 'source').astype(int), votes=-votes)
+            .sort_values(['CAS', 'rank', 'votes'], kind='stable')
+            .drop(columns=['rank', 'votes']).reset_index(drop=True))
+    return {'data': df[columns]}
+
+
+SOURCES['IDENTITY'] = {'files': list(dict.fromkeys(f for name, *_ in IDENTITY_COLUMNS for f in SOURCES[name]['files'])),
+                       'sources': list(dict.fromkeys(name for name, *_ in IDENTITY_COLUMNS)),
+                       'load': load_identity_source, 'index': {'data': 'CAS'}}
+
+
+def normalize_cas(value):
+    """Returns the key under which a CAS number (or InChIKey) is indexed, None for non-string cells."""
+    return value.strip() if isinstance(value, str) else None
+
+
+def build_cas_index(series):
+    """Maps every normalized CAS number of a column to the positions of its rows, in table order."""
+    keys = series.map(normalize_cas).to_numpy()
+    return pd.Series(np.arange(len(keys))).groupby(keys, dropna=True).indices
+
+
+def build_indexes(tables, index_columns):
+    """Builds the CAS index of every indexed table of a source."""
+    indexes = {}
+    for key, col in index_columns.items():
+        if key in tables and col in tables[key].columns:
+            indexes[key] = build_cas_index(tables[key][col])
+    return indexes
+
+
+class SourceRegistry:
+    """Keeps the cleaned tables of every source in memory for the whole process.
+
+    Each source is read and cleaned only once (at startup through load_all(), or
+    on first use) and the query functions then work on the stored frames.
+    The frames are shared between requests: query functions must not modify them.
+
+    The cleaned tables are taken from the Parquet snapshot (see snapshot.py) when
+    it was built from the current raw files; otherwise the source is rebuilt from
+    the raw files and its snapshot rewritten. A source built from the tables of
+    other sources lists them in 'sources': their loader versions are checked as
+    well (see checksums()).
+
+    When a source is loaded a hash index {CAS number: row positions} is built on
+    its identifier column, so lookup() finds the rows of a substance without
+    scanning the table.
+
+    A source can also define a 'prepare' function, run on its tables when they
+    are built, for precomputed objects that are not tables (e.g. the frames a
+    query returns, per CAS number). They are stored in the snapshot with the
+    tables and prepared() returns them.
+
+    reload_changed() re-ingests the sources whose raw files changed since they
+    were loaded (size/mtime first, then checksum). The new tables and indexes are
+    built aside and swapped in with a single assignment: requests keep using the
+    previous version until then and never wait for a reload.
+    """
+
+    def __init__(self, sources):
+        self.sources = sources
+        self._loaded = {}  # name -> (tables, indexes, version, prepared)
+        self._locks = {name: threading.Lock() for name in sources}
+        self._reload_lock = threading.Lock()
+        self.last_reload = None  # {'started', 'finished', 'reloaded'} of the last reload_changed()
+
+    def _entry(self, name):
+        entry = self._loaded.get(name)
+        if entry is None:
+            with self._locks[name]:  # only one thread loads a given source
+                entry = self._loaded.get(name)
+                if entry is None:
+                    entry = self._build_entry(name)
+                    self._loaded[name] = entry
+        return entry
+
+    def _build_entry(self, name):
+        files = self.sources[name]['files']
+        version = {'stats': snapshot.file_stats(files)}  # before reading: a change while loading is seen next time
+        version['checksums'] = self.checksums(name)
+        tables, prepared = self._load(name, version['checksums'])
+        return tables, build_indexes(tables, self.sources[name].get('index', {})), version, prepared
+
+    def checksums(self, name):
+        """What the snapshot of a source is checked against: the checksums of its raw files and the loader versions of its 'sources'."""
+        spec = self.sources[name]
+        checksums = snapshot.file_checksums(spec['files'])
+        for upstream in spec.get('sources', []):
+            checksums[f"{upstream} loader"] = f"v{self.sources[upstream].get('version', 1)}"
+        return checksums
+
+    def _prepare(self, name, tables):
+        prepare = self.sources[name].get('prepare')
+        if prepare is None or not any(len(df) for df in tables.values()):
+            return {}
+        try:
+            start = time.time()
+            prepared = prepare(tables)
+            print(f"Source {name} prepared in {time.time() - start:.1f}s")
+            return prepared
+        except Exception as e:
+            print(f"Error preparing source {name}: {e}")
+            return {}
+
+    def get(self, name):
+        """Returns the dict of cleaned tables of a source, loading it if needed."""
+        return self._entry(name)[0]
+
+    def table(self, name, key='data', entry=None):
+        """Returns one cleaned table of a source, an empty DataFrame if it is not available."""
+        return (entry or self._entry(name))[0].get(key, pd.DataFrame())
+
+    def entry(self, name):
+        """Returns the current (tables, indexes, version, prepared) of a source, to read several of its tables consistently."""
+        return self._entry(name)
+
+    def prepared(self, name, entry=None):
+        """Returns what the 'prepare' function of a source computed from its tables (an empty dict if none)."""
+        return (entry or self._entry(name))[3]
+
+    def lookup(self, name, cas_rn, key='data', entry=None):
+        """Returns the rows of a table whose identifier is cas_rn (an empty frame if none).
+
+        entry, from entry(), reads a given version of the source instead of the current one.
+        """
+        tables, indexes = (entry or self._entry(name))[:2]
+        df = tables.get(key, pd.DataFrame())
+        positions = indexes.get(key, {}).get(normalize_cas(cas_rn), [])
+        return df.iloc[positions]
+
+    def lookup_many(self, name, cas_rns, key='data', entry=None):
+        """Returns the rows of a table for a list of identifiers with a single slice: (rows, identifier of every row).
+
+        The identifiers found come in the order of cas_rns (each once), the rows of
+        each identifier in table order: rows.groupby(identifiers, sort=False) gives
+        the frames lookup() returns for them.
+        """
+        tables, indexes = (entry or self._entry(name))[:2]
+        df = tables.get(key, pd.DataFrame())
+        index = indexes.get(key, {})
+        found = [cas_rn for cas_rn in dict.fromkeys(map(normalize_cas, cas_rns)) if cas_rn in index]
+        if not found:
+            return df.iloc[[]], np.array([], dtype=object)
+        positions = [index[cas_rn] for cas_rn in found]
+        identifiers = np.repeat(np.array(found, dtype=object), [len(p) for p in positions])
+        return df.iloc[np.concatenate(positions)], identifiers
+
+    def fingerprint(self):
+        """Hash of the raw file checksums and loader versions of every source as loaded: it changes when a source is reloaded."""
+        versions = {name: [self._entry(name)[2]['checksums'], spec.get('version', 1)] for name, spec in self.sources.items()}
+        return hashlib.sha256(json.dumps(versions, sort_keys=True).encode()).hexdigest()[:20]
+
+    def load_all(self):
+        """Loads every source, to be called once when the server starts."""
+        for name in self.sources:
+            self.get(name)
+
+    def build(self, name, checksums=None):
+        """Reads and cleans a source from its raw files and writes its snapshot: (tables, prepared)."""
+        if checksums is None:
+            checksums = self.checksums(name)
+        tables = self.sources[name]['load']()
+        prepared = self._prepare(name, tables)
+        try:
+            snapshot.write_source(name, checksums, tables, self.sources[name].get('version', 1), prepared)
+        except Exception as e:
+            print(f"Error writing snapshot of {name}: {e}")
+        return tables, prepared
+
+    def _load(self, name, checksums):
+        try:
+            version = self.sources[name].get('version', 1)
+            tables = snapshot.read_source(name, checksums, version)
+            origin = 'snapshot'
+            if tables is None:
+                tables, prepared = self.build(name, checksums)
+                origin = 'raw files'
+            else:
+                prepared = snapshot.read_prepared(name, checksums, version) if 'prepare' in self.sources[name] else {}
+                if prepared is None:
+                    prepared = self._prepare(name, tables)
+            print(f"Source {name} loaded from {origin}: {', '.join(f'{k} {v.shape}' for k, v in tables.items())}")
+            return tables, prepared
+        except Exception as e:
+            print(f"Error loading source {name}: {e}")
+            return {}, {}
+
+    def changed(self, name):
+        """True if the raw files of a loaded source are not the ones it was loaded from."""
+        entry = self._loaded.get(name)
+        if entry is None:
+            return False  # not loaded yet: it will be read from the current files
+        version = entry[2]
+        files = self.sources[name]['files']
+        stats = snapshot.file_stats(files)
+        if stats == version['stats']:
+            return False
+        if self.checksums(name) == version['checksums']:
+            version['stats'] = stats  # touched, not modified
+            return False
+        return True
+
+    def reload(self, name):
+        """Re-ingests a source and swaps its new tables in; keeps the old ones if the new files give no data."""
+        start = time.time()
+        entry = self._build_entry(name)
+        if not any(len(df) for df in entry[0].values()) and name in self._loaded:
+            print(f"Source {name}: no data in the new files, previous version kept")
+            return False
+        self._loaded[name] = entry
+        print(f"Source {name} reloaded in {time.time() - start:.1f}s")
+        return True
+
+    def reload_changed(self):
+        """Reloads every source whose raw files changed; returns their names (None if a reload is already running)."""
+        if not self._reload_lock.acquire(blocking=False):
+            return None
+        try:
+            status = {'started': time.time(), 'finished': None, 'reloaded': []}
+            self.last_reload = status
+            # in SOURCES order: IDENTITY, built from the other sources, comes after them
+            for name in self.sources:
+                if self.changed(name) and self.reload(name):
+                    status['reloaded'].append(name)
+            status['finished'] = time.time()
+            return status['reloaded']
+        finally:
+            self._reload_lock.release()
+
+    def reload_in_background(self):
+        """Starts reload_changed() in a thread; False if a reload is already running."""
+        if self._reload_lock.locked():
+            return False
+        threading.Thread(target=self.reload_changed, name='source_reload', daemon=True).start()
+        return True
+
+    def watch(self, interval):
+        """Checks the raw files every interval seconds and reloads the changed sources (0: no watcher)."""
+        if not interval:
+            return
+
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.reload_changed()
+                except Exception as e:
+                    print(f"Error reloading the sources: {e}")
+
+        threading.Thread(target=run, name='source_watcher', daemon=True).start()
+
+
+registry = SourceRegistry(SOURCES)
+
+
+
+
 # --- Query Functions ---
 
 def query_deepames(cas_rn):
-    df = load_dataframe(DEEPAMES_FILE)
-    if df.empty or"CAS_NO" not in df.columns:  #Check if df is empty or if CAS_NO exists
-        return None
-    df["CAS_NO"] = df["CAS_NO"].astype(str).fillna("")
-    dt = df.loc[df["CAS_NO"] == cas_rn]
+    dt = registry.lookup('DeepAmes', cas_rn)  # cleaned table, indexed on CAS_NO
     dt=add_cas_db_version_identificative(dt,cas_rn,DEEPAMES_FILE)
-    return clean_deepames(dt).transpose() if not dt.empty else None #combined return and transpose
+    return dt.transpose() if not dt.empty else None #combined return and transpose
 
 
 def query_hansen(cas_rn):
-    df = load_dataframe(HANSEN_FILE)
-    if df.empty or"CAS_NO" not in df.columns: #Check if df is empty or if CAS_NO exists
-        return None
-    dt = df[df['CAS_NO'] == cas_rn]
+    dt = registry.lookup('Hansen', cas_rn)  # cleaned table, indexed on CAS_NO
     dt=add_cas_db_version_identificative(dt,cas_rn,HANSEN_FILE)
-    return clean_hansen(dt).transpose() if not dt.empty else None
+    return dt.transpose() if not dt.empty else None
 
 
 def query_oecd_vivo(cas_rn):
-    df = load_dataframe(OECD_VIVO_FILE)
-    df=clean_oecd_vivo(df)
-    if df.empty or"Number" not in df.columns: #Check if df is empty or if Number exists
-       return None
-    dt = df[df['Number'] == cas_rn]
+    dt = registry.lookup('OECD_VIVO', cas_rn)  # cleaned and prefixes already removed, indexed on Number
     dt=add_cas_db_version_identificative(dt,cas_rn,OECD_VIVO_FILE)
-    return modify_oecd(dt).transpose() if not dt.empty else None
+    return dt.transpose() if not dt.empty else None
 
 def query_oecd_chromosome(cas_rn):
-    df = load_dataframe(OECD_CHROMOSOME_FILE)  # Use load_dataframe
-    if df.empty or"Number" not in df.columns:
-        return None
-    df = clean_oecd_chromosome(df)  # Clean the DataFrame
-    dt = df[df['Number'] == cas_rn]
-
-
-    dt = modify_oecd(dt) # apply modifications
+    dt = registry.lookup('OECD_CHROMOSOME', cas_rn)  # cleaned and prefixes already removed, indexed on Number
 
     if not dt.empty:
         dt=add_cas_db_version_identificative(dt,cas_rn,OECD_CHROMOSOME_FILE)
@@ -542,107 +1015,78 @@ def query_oecd_chromosome(cas_rn):
 
 
 def query_iarc(cas_rn):
-    df=pd.read_excel(IARC_FILE, header=0, skiprows=[0])  # Use load_dataframe and parameters
-    if df.empty:
-        return None
-    else:
-     df = clean_iarc(df) # clean the dataframe
-     dt = df[df['CAS_numb'] == cas_rn]
+    dt = registry.lookup('IARC', cas_rn)  # cleaned, activity descriptions already added, indexed on CAS_numb
 
-     if not dt.empty:
-         dt = modify_activity_iarc(dt)  # Modify activity descriptions
-         dt=add_cas_db_version_identificative(dt,cas_rn,IARC_FILE)
-         return dt.transpose()
-     else:
-         return None
+    if not dt.empty:
+        dt=add_cas_db_version_identificative(dt,cas_rn,IARC_FILE)
+        return dt.transpose()
+    else:
+        return None
 
 
 
 def query_ccris(inchi_key,details):
-    df = load_dataframe(CCRIS_FILE)  # Use load_dataframe
-    if df.empty or"INCHI_key" not in df.columns:
-        return None, None
+    entry = registry.entry('CCRIS')  # summary and data of the same version
+    summary = registry.lookup('CCRIS', inchi_key, 'summary', entry)  # computed at ingest, one row per Test System
 
-    df = clean_ccris(df)
-    dt = df[df['INCHI_key'] == inchi_key]
-
-    if not dt.empty and details=='on':
-        print(f"CCRIS muta: Data found for INCHI_key: {inchi_key}")
-
-        dg, summary_df = ccris_summary_table(dt)
-        return dg, summary_df
-    elif not dt.empty and details!='on':
-        dg, summary_df = ccris_summary_table(dt)
-        return None, summary_df
-    else:
+    if summary.empty:
         print(f"CCRIS muta: No data found for INCHI_key: {inchi_key}")
         return None, None
 
+    summary_df = summary[['Test System', 'Ames Strains', 'Result', 'Summary call']].reset_index(drop=True)
+    summary_df['Test System'] = [(name,) for name in summary_df['Test System']]  # group names of groupby(['Test System'])
+    if details != 'on':
+        return None, summary_df
 
+    print(f"CCRIS muta: Data found for INCHI_key: {inchi_key}")
+    data = entry[0]['data']
+    dg = [data.iloc[start:stop] for start, stop in zip(summary['start'], summary['stop'])]
+    return dg, summary_df
 
-def query_amescebs(cas_rn,details):
-    """Queries the AMESCEBS data and generates summary tables."""
-    df = pd.read_csv(AMESCEBS_FILE) # Use load_dataframe
-    # print(df)
-    if df.empty:
-        return None, None
-
-    df = clean_amescebs(df)
-    dt = df[df['CAS_NO'] == cas_rn]
-    # print(dt)
 
-    if not dt.empty and details=='on':
-        print(f"AMES CEBS muta: Data found for CAS_NO: {cas_rn}")
 
-        dt = modify_amescebs(dt)
+def query_amescebs(cas_rn,details):
+    """Returns the AMESCEBS summary tables computed at ingest (see cebs_summaries)."""
+    entry = registry.entry('AMESCEBS')  # all tables of the same version
+    supersummary = registry.lookup('AMESCEBS', cas_rn, 'supersummary', entry)
 
-        supersummary = cebs_supersummary_table(dt)
-        summary = cebs_summary_table(dt)
-        supersummary = add_cas_db_version_identificative(supersummary,cas_rn,AMESCEBS_FILE)
-        summary = add_cas_db_version_identificative(summary,cas_rn,AMESCEBS_FILE)
-        return summary.transpose(), supersummary.transpose()
-    elif not dt.empty and details!='on':
-        dt = modify_amescebs(dt)
-        supersummary = cebs_supersummary_table(dt)
-        supersummary = add_cas_db_version_identificative(supersummary,cas_rn,AMESCEBS_FILE)
-        return None, supersummary.transpose()
-    else:
+    if supersummary.empty:
         print(f"AMES CEBS muta: No data found for CAS_NO: {cas_rn}")
         return None, None
 
+    supersummary = supersummary[['Strains', 'Summary call']].reset_index(drop=True)
+    supersummary = add_cas_db_version_identificative(supersummary,cas_rn,AMESCEBS_FILE)
+    if details!='on':
+        return None, supersummary.transpose()
+
+    print(f"AMES CEBS muta: Data found for CAS_NO: {cas_rn}")
+    summary = registry.lookup('AMESCEBS', cas_rn, 'summary', entry)
+    summary = summary[['Test System', 'Metabolic Activation', 'Result', 'Summary call']].reset_index(drop=True)
+    summary = add_cas_db_version_identificative(summary,cas_rn,AMESCEBS_FILE)
+    return summary.transpose(), supersummary.transpose()
+
 def query_openfoodtox(cas_rn):
   """Queries the Open Food Tox data."""
 
-  outputs_df = load_dataframe(OPENFOODTOX_EFSA_OUPUTS_FILE)
-  genotox_df = load_dataframe(OPENFOODTOX_GENOTOX_FILE)
-  refpoint_df= load_dataframe(OPENFOODTOX_REFPOINT_FILE)
-  refvalue_df= load_dataframe(OPENFOODTOX_REFVALUE_FILE)
-  substcharact_df= load_dataframe(OPENFOODTOX_SUBSTCHARACT_FILE)
-
-  # dt=substcharact_df.query(f'CASNumber == "{cas_rn}"')
-  dt = substcharact_df[substcharact_df['CASNumber'] == cas_rn]
+  entry = registry.entry('OPENFOODTOX')  # all tables of the same version
+  substance = registry.prepared('OPENFOODTOX', entry).get('substances', {}).get(normalize_cas(cas_rn))
 
-  if not dt.empty:
+  if substance is not None:
 
-    outputs_df.drop(columns='URL',inplace=True)
-    outputs_df['Published']=outputs_df['Published'].astype(str)
     print(f"OpenFoodTox: data found for {cas_rn}")
 
-    subst_name=str(dt.iloc[0]['Component'])
+    # rows of the tables joined with the EFSA outputs at ingest (see prepare_openfoodtox)
+    genotox_ref, refpoint_ref, refvalue_ref = [
+      None if substance[key] is None else registry.table('OPENFOODTOX', key, entry).iloc[substance[key]].reset_index(drop=True)
+      for key in OPENFOODTOX_TABLES]
 
-    subst_name2=str(dt.iloc[0]['Substance'])
-
-    # Query different tables
-
-    genotox_summary, genotox_ref=genotox_openfoodtox(cas_rn,subst_name,genotox_df,outputs_df)
-    if genotox_ref is None:
-      genotox_summary, genotox_ref=genotox_openfoodtox(cas_rn,subst_name2,genotox_df,outputs_df)
-    refpoint_ref=refpoint_openfoodtox(subst_name,refpoint_df,outputs_df)
-    if refpoint_ref is None:
-      refpoint_ref=refpoint_openfoodtox(subst_name2,refpoint_df,outputs_df)
-    refvalue_ref=refvalue_openfoodtox(subst_name,refvalue_df,outputs_df)
-    if refvalue_ref is None:
-      refvalue_ref=refvalue_openfoodtox(subst_name2,refvalue_df,outputs_df)
+    genotox_summary=None
+    if genotox_ref is not None:
+      # the 2D structure is not resolved: cirpy, which the former lookup called, is not a dependency
+      D_structure='No 2D structure found'
+      print(f"OpenFoodTox: No smiles found for CAS_NO: {cas_rn}")
+      genotox_summary=genotox_ref.iloc[0]['Substance'],substance['genotox_result'],D_structure
+      genotox_summary=pd.DataFrame(genotox_summary,index=['Substance','Summary','2D_structure'],columns=[str(cas_rn)])
 
     if genotox_summary is not None:
       genotox_summary = add_cas_db_version_identificative(genotox_summary.transpose(),cas_rn,OPENFOODTOX_GENOTOX_FILE).transpose()
@@ -658,96 +1102,26 @@ def query_openfoodtox(cas_rn):
   else:
     print(f" OpenFoodTox: data not found for: {cas_rn}")
     return None, None, None, None
-def query_PPRTV(cas_rn,pprtv):
-
-  pprtv_dt = pprtv[pprtv['CASRN'] == cas_rn]
-  # pprtv_dt=pprtv.query(f'CASRN == "{cas_rn}"')
-
-  # Iterate through rows using .iterrows()
-  for index, row in pprtv_dt.iterrows():
-    # Access values using column names
-    if str(row['RfC Value'])=='Not available' and str(row['RfD Value'])=='Not available':
-      pprtv_dt=pprtv_dt.drop(index) # Consider using pprtv_dt = pprtv_dt.drop(index) instead if you intend to remove the row
-      print('pprtv is empty')
-      break # Exit the loop once the condition is met
-
-  return pprtv_dt
-
-def query_IRIS(cas_rn,iris):
-
-  iris_dt = iris[iris['CASRN'] == cas_rn]
-  # iris_dt=iris.query(f'CASRN == "{cas_rn}"')
-
-  if iris_dt.empty:
-    iris_dt=None
-
-
-  return iris_dt
-
-
 def query_IRIS_PPRTV(cas_rn):
 
-  pprtv = load_dataframe(PPRTV_FILE)
-  iris = load_dataframe(IRIS_FILE)
-
-  #upload and clean pprtv and iris db
-  pprtv,iris=clean_PPRTVIRIS(pprtv,iris)
-  pd.options.mode.copy_on_write = True
-
-  #Query both pprtv and iris db cleaned
-  pprtv_dt=query_PPRTV(cas_rn,pprtv)
-  pprtv_dt=add_cas_db_version_identificative(pprtv_dt,cas_rn,PPRTV_FILE)
-
-  iris_dt=query_IRIS(cas_rn,iris)
-  iris_dt=add_cas_db_version_identificative(iris_dt,cas_rn,IRIS_FILE)
-
-  #Check if both IRIS and PPRTV are empty
-  if  pprtv_dt.empty==True and iris_dt is None:
+  # PPRTV and IRIS rows already joined by the source registry (see prepare_pprtv_iris)
+  dtj = registry.prepared('PPRTV_IRIS').get('tables', {}).get(normalize_cas(cas_rn))
+  if dtj is None:
     print(f" PPRTV/IRIS: No data for {cas_rn}")
     return None
-
-  #Check if PPRTV is empty and IRIS is not
-  elif pprtv_dt.empty==True and iris_dt is not None:
-    iris_dt.dropna(axis=1, how='all', inplace=True)
-    print(f" PPRTV/IRIS: IRIS data found for {cas_rn}")
-    return iris_dt.transpose()
-
-  #Check if PPRTV is full and IRIS is not
-  elif pprtv_dt.empty!=True and iris_dt is None:
-    print(f" PPRTV data found for {cas_rn}")
-    return pprtv_dt.transpose()
-
-  #Both are full
-  else:
-    print(f" PPRTV/IRIS: Data found for {cas_rn}")
-    dtj=joined_table_PPRTV_IRIS(pprtv_dt,iris_dt)
-    #dtj=add_cas_db_version_identificative(dtj,cas_rn,PPRTV_FILE)
-    return dtj
+  print(f" PPRTV/IRIS: Data found for {cas_rn}")
+  return dtj.copy()  # the tables computed at ingest are shared
 
 def query_homna(cas_rn):
 
-  # read DeepAmes xlsx data
-  df1=pd.read_excel(HOMNA_183, header=0, skiprows=[0])
-  df2=pd.read_excel(HOMNA_236, header=0, skiprows=[0])
-  df3=pd.read_excel(HOMNA_253)
-
-  df_a=clean_jap(df1)
-  df_b=clean_jap(df2)
-  df_c=clean_jap(df3)
-
-  df_final=pd.concat([df_a, df_b, df_c], ignore_index=True)
-  df_final.drop_duplicates(inplace=True)
-  df_final.rename(columns={'CAS#':'CAS_NO'}, inplace=True)
-
-  jap_dt = df_final[df_final['CAS_NO'] == cas_rn]
+  # HOMNA Class A files already merged, deduplicated and cleaned by the source registry
+  jap_dt = registry.lookup('HOMNA', cas_rn)
   # jap_dt=df_final.query(f'CAS_NO == "{cas_rn}"')
   if jap_dt.empty:
     print(f"HOMNA: No data found for {cas_rn}")
     return None
   else:
     print(f"Homna data found for {cas_rn}")
-    jap_dt['AMES RESULT']='Class A: Strong Positive'
-
     jap_dt=add_cas_db_version_identificative(jap_dt,cas_rn,HOMNA_183)
     return jap_dt.transpose()
 
@@ -758,7 +1132,7 @@ def query_ecvam_neg(cas_rn):
     list_ecvam_neg_df=[summary, df_ames, df_mcgm, df_mnvit, df_cavit, df_mnvivo, df_cavivo, df_tgr, df_uds, df_comet, df_carc, add_info]
     for i,df in enumerate(list_ecvam_neg_df):
       if df is not None:
-        df=pd.DataFrame(df)
+        df=pd.DataFrame(df).copy()  # the frames computed at ingest are shared
         df=add_cas_db_version_identificative(df,cas_rn,ECVAM_NEG_FILE)
         df=df.transpose()
         list_ecvam_neg_df[i]=df
@@ -775,7 +1149,7 @@ def query_ecvam_neg(cas_rn):
         'ECVAM_Neg_COMET': list_ecvam_neg_df[9],
         'ECVAM_Neg_CARC': list_ecvam_neg_df[10],
         'ECVAM_Neg_Other_Studies':list_ecvam_neg_df[11],
-        'ECVAM_Neg_References': final_df,
+        'ECVAM_Neg_References': final_df.copy() if final_df is not None else None,
     }
     return results if any(value is not None for value in results.values()) else None # Return None if all values are None
 
@@ -786,7 +1160,7 @@ def query_ecvam_pos(cas_rn, details):
     list_ecvam_pos_df=[summary, ames, vit_mla, vit_mn, vit_ca, viv_mn, viv_ca, viv_uds, vivo_tgr, vivo_dna, carc, add_info, lit_table]
     for i,df in enumerate(list_ecvam_pos_df):
       if df is not None:
-        df=pd.DataFrame(df)
+        df=pd.DataFrame(df).copy()  # the frames computed at ingest are shared
         # print(i)
         # display(df)
         df=add_cas_db_version_identificative(df,cas_rn,ECVAM_POS_FILE)
@@ -810,6 +1184,8 @@ def query_ecvam_pos(cas_rn, details):
         'ECVAM_Pos_Other_Studies': list_ecvam_pos_df[11],
         'ECVAM_Pos_References': list_ecvam_pos_df[12],
     }
+    if details == 'on' and lit_table is None and summary is not None:
+      del results['ECVAM_Pos_References']  # no literature: no References table in the answer
     return results if any(value is not None for value in results.values()) else None # Return None if all values are None
 
 
@@ -817,71 +1193,34 @@ def query_ecvam_pos(cas_rn, details):
 
 
 # --- ECVAM NEGATIVE FUNCTIONS --- #
-def ECVAM_neg_subtable(dt,keyword):
-  overall_diz={'MCGM':'in vitro MCGM Overall', 'MNvit':'in vitro MN Overall', 'CAvit': 'in vitro CA  Overall', 'MNvivo': 'in vivo MN Overall', 'CAvivo': 'in vivo CA Overall','UDS ':'in vivo UDS Overall', 'COMET': ' in vivo DNA damage Overall', 'CARC': 'Rodent Carcinogenicity Overall'}
-
-  a_list=[]
-  for col in dt.columns:
-    if col.startswith(str(keyword)):
-      a_list.append(col)
-  if str(keyword) in overall_diz: # Assuming you want to check if it's not None or empty.  Replace with appropriate check if needed.
-    a_list.append(overall_diz[str(keyword)])
-  a_dt=dt[a_list]
-  a_dt.dropna(axis=1,inplace=True)
-  if a_dt.empty:
-    print(' ')
-  else:
-    return a_dt
-
-def ECVAM_neg_summary_table(dt,cas_rn):
-
-  P=0
-  N=0
-  E=0
-  for col in dt.columns:
-    if 'AMES' in col:
-      if '+' in str(dt[col].iloc[0]):
-        P+=1
-      elif '-' in str(dt[col].iloc[0]):
-        N+=1
-      elif 'E' in str(dt[col].iloc[0]):
-        E+=1
-  pne=(f" P/N/E= {P}/{N}/{E}")
-
-
-  P=0
-  N=0
-  E=0
-  for col in dt.columns:
-    if 'in vitro' in col:
-      if '+' in str(dt[col].iloc[0]):
-        P+=1
-      elif '-' in str(dt[col].iloc[0]):
-        N+=1
-      elif 'E' in str(dt[col].iloc[0]):
-        E+=1
+# ECVAM negative sub-tables: the columns starting with the name of the assay, and its overall
+# call. The columns are found once from the header of the cleaned table, then the sub-tables,
+# summary and references of every substance are computed when the source is loaded
+# (prepare_ecvam_neg). As before, the UDS sub-table has no overall column ('UDS ' matches no assay).
+ECVAM_NEG_SUBTABLES = ['AMES', 'MCGM', 'MNvit', 'CAvit', 'MNvivo', 'CAvivo', 'TGR', 'UDS', 'COMET', 'CARC']
+ECVAM_NEG_OVERALLS = {'MCGM':'in vitro MCGM Overall', 'MNvit':'in vitro MN Overall', 'CAvit': 'in vitro CA  Overall', 'MNvivo': 'in vivo MN Overall', 'CAvivo': 'in vivo CA Overall','UDS ':'in vivo UDS Overall', 'COMET': ' in vivo DNA damage Overall', 'CARC': 'Rodent Carcinogenicity Overall'}
 
-  vit_overall= (f" P/N/E = {P}/{N}/{E}")
 
-  P=0
-  N=0
-  E=0
+def compile_ecvam_neg_schema(columns):
+  """Finds the columns of every sub-table in the cleaned table: {assay: column positions}."""
+  positions = {col: i for i, col in enumerate(columns)}
+  schema = {}
+  for keyword in ECVAM_NEG_SUBTABLES:
+    cols = [col for col in columns if col.startswith(keyword)]
+    if keyword in ECVAM_NEG_OVERALLS:
+      cols.append(ECVAM_NEG_OVERALLS[keyword])
+    schema[keyword] = [positions[col] for col in cols]
+  return schema
 
-  for col in dt.columns:
-    if 'in vivo' in col:
-      if '+' in str(dt[col].iloc[0]):
-        P+=1
-      elif '-' in str(dt[col].iloc[0]):
-        N+=1
-      elif 'E' in str(dt[col].iloc[0]):
-        E+=1
 
+# the '+', '-' and 'E' calls of the ECVAM tables: a cell counts once, '+' first
+ECVAM_CALL_PATTERNS = (r'\+', '-', 'E')
 
 
-  viv_overall=(f" P/N/E = {P}/{N}/{E}")
+def ecvam_call_counts(df, columns):
+  """P/N/E counts of the calls of every row in the given columns, shape (rows, 3)."""
+  return evidence.count(evidence.encode(df[columns], ECVAM_CALL_PATTERNS, case=True, exclusive=True))
 
-  summary_df=pd.DataFrame({ 'Ames_Overall' :(str(dt['AMES Overall'].iloc[0])+ ' '+ str(pne)), 'vitro_overall':vit_overall , 'vivo_overall':viv_overall , 'CARC_overall':dt['Rodent Carcinogenicity Overall'].iloc[0] ,'IARC':dt['IARC Classification'].iloc[0]}, index=[cas_rn])
-  return summary_df
 
 # Function to extract all references
 def extract_references(text):
@@ -892,137 +1231,97 @@ def extract_references(text):
     return references
 
 
-def ECVAM_neg_overall(cas_rn):
-  import pandas as pd
-
-  df_dict = {
-      'df_ames': None,
-      'df_mcgm': None,
-      'df_mnvit': None,
-      'df_cavit': None,
-      'df_mnvivo': None,
-      'df_cavivo': None,
-      'df_tgr': None,
-      'df_uds': None,
-      'df_comet': None,
-      'df_carc': None
-  }
+def ecvam_neg_references(subtables):
+  """Builds the references table of one substance: the references of the literature columns of its sub-tables, by assay.
+
+  The assays come in the order of the former groupby('essay').apply(drop_duplicates): alphabetical
+  when an assay cites a reference in two of its columns, in the order of the sheet otherwise.
+  """
+  references = {}
+  repeated = False
+  for df in subtables:
+    if df is not None:
+      for col in df.columns:
+        if ('Literature' in col) or ('reference' in col) or ('other' in col):
+          essay = col.split()[0]
+          cited = references.setdefault(essay, {})
+          for reference in dict.fromkeys(extract_references(df[col].iloc[0])):
+            repeated = repeated or reference in cited
+            cited[reference] = None  # each reference once, in order
+  if not references:
+    return None
+  # the assay name only on its first row
+  formatted_data = [(essay if i == 0 else "", reference)
+                    for essay in (sorted(references) if repeated else references)
+                    for i, reference in enumerate(references[essay])]
+  return pd.DataFrame(formatted_data, columns=['essay', 'unique_references'])
+
+
+def ecvam_neg_tables(dt, cas_rn, schema, counts):
+  """Computes the summary, sub-tables and references of one substance (dt: its rows, counts: the P/N/E of its first row)."""
+  (ames_p, ames_n, ames_e), (vit_p, vit_n, vit_e), (viv_p, viv_n, viv_e) = counts
+  pne=(f" P/N/E= {ames_p}/{ames_n}/{ames_e}")
+  vit_overall= (f" P/N/E = {vit_p}/{vit_n}/{vit_e}")
+  viv_overall=(f" P/N/E = {viv_p}/{viv_n}/{viv_e}")
+  tables = {'summary': pd.DataFrame({ 'Ames_Overall' :(str(dt['AMES Overall'].iloc[0])+ ' '+ str(pne)), 'vitro_overall':vit_overall , 'vivo_overall':viv_overall , 'CARC_overall':dt['Rodent Carcinogenicity Overall'].iloc[0] ,'IARC':dt['IARC Classification'].iloc[0]}, index=[cas_rn])}
+
+  for keyword in ECVAM_NEG_SUBTABLES:
+    df = dt.iloc[:, schema[keyword]].dropna(axis='columns')
+    tables[keyword] = None if df.empty else df
+
+  add_info=pd.DataFrame()
+  add_info['other studies']=dt[['Other Tests & Notes']].copy()
+  tables['add_info'] = None if add_info.empty else add_info
+
+  tables['references'] = ecvam_neg_references([tables[keyword] for keyword in ECVAM_NEG_SUBTABLES])
+  return tables
+
+
+def prepare_ecvam_neg(tables):
+  """Computes the summary, sub-tables and references of every substance of ECVAM negative: {'schema', 'tables': {CAS: tables}}."""
+  df = tables['data'].copy()  # one block per dtype: much faster slicing
+  schema = compile_ecvam_neg_schema(list(df.columns))
+  counts = [ecvam_call_counts(df, [col for col in df.columns if pattern in col]) for pattern in ('AMES', 'in vitro', 'in vivo')]
+  by_cas = {}
+  for cas_rn, positions in build_cas_index(df['CAS_no']).items():
+    first = positions[0]
+    try:
+      by_cas[cas_rn] = ecvam_neg_tables(df.iloc[positions], cas_rn, schema, [group[first] for group in counts])
+    except (ValueError, TypeError, AttributeError) as e:  # e.g. a literature cell that is not text: the query fails for this CAS only
+      by_cas[cas_rn] = {'error': f"{type(e).__name__}: {e}"}
+      print(f"ECVAM negatives: tables of {cas_rn} not computed ({by_cas[cas_rn]['error']})")
+  return {'schema': schema, 'tables': by_cas}
 
-  # read ECVAM neg xlsx data
-  df=pd.read_excel(ECVAM_NEG_FILE,header=0, skiprows=[0])
-  df.dropna(axis='columns',how='all')
-  for col in df.columns:
-    if 'Unnamed' in col:
-      df.drop(columns=col,inplace=True)
-  df.rename(columns={'CAS No.' : 'CAS_no'}, inplace=True)
 
-  #display different subtables with info in it
-  pd.set_option('display.max_colwidth', None)
-  pd.options.mode.chained_assignment = None  # default='warn'
+def clean_ecvam_neg(df):
+  """Cleans and preprocesses the ECVAM negative DataFrame."""
+  df = df[[col for col in df.columns if 'Unnamed' not in str(col)]]
+  df = df.rename(columns={'CAS No.' : 'CAS_no'})
+  return df
 
-  #dt=df.query(f'CAS_no == "{cas_rn}"')
-  dt = df[df['CAS_no'] == cas_rn]
 
-  if dt.empty:
+def ECVAM_neg_overall(cas_rn):
+  """Returns the summary, sub-tables and references of a substance, computed at ingest (see prepare_ecvam_neg)."""
+  entry = registry.entry('ECVAM_NEG')  # all tables of the same version
+  tables = registry.prepared('ECVAM_NEG', entry).get('tables', {}).get(normalize_cas(cas_rn))
+
+  if tables is None:
     print(f"ECVAM negatives: No data found for {cas_rn}")
     return None, None, None, None, None, None, None, None, None, None, None, None, None
-  else:
-    print(f"ECVAM negatives: Data found for {cas_rn}")
-    list_subtables = ['AMES', 'MCGM', 'MNvit', 'CAvit', 'MNvivo', 'CAvivo', 'TGR', 'UDS', 'COMET', 'CARC']
-
-    for keyword, variable_name in zip(list_subtables, df_dict.keys()):
-        result = ECVAM_neg_subtable(dt, keyword)  # Call the function
-        if result is not None:
-            df_dict[variable_name] = result  # Update the dictionary
-        else:
-            df_dict[variable_name] = None  # Set to None in the dictionary
-
-
-    add_info=pd.DataFrame()
-    add_info['other studies']=dt[['Other Tests & Notes']].copy()
-    if add_info.empty:
-      add_info=None
-
+  if 'error' in tables:  # see prepare_ecvam_neg
+    raise RuntimeError(f"ECVAM negatives: tables of {cas_rn} not computed at ingest ({tables['error']})")
 
+  print(f"ECVAM negatives: Data found for {cas_rn}")
+  return (tables['summary'], tables['AMES'], tables['MCGM'], tables['MNvit'], tables['CAvit'], tables['MNvivo'],
+          tables['CAvivo'], tables['TGR'], tables['UDS'], tables['COMET'], tables['CARC'], tables['add_info'], tables['references'])
 
 
-
-    summary=ECVAM_neg_summary_table(dt,cas_rn)
-
-    # Access the DataFrames from the dictionary
-    df_list = [df_dict['df_ames'], df_dict['df_mcgm'], df_dict['df_mnvit'], df_dict['df_cavit'],
-              df_dict['df_mnvivo'], df_dict['df_cavivo'], df_dict['df_tgr'], df_dict['df_uds'],
-              df_dict['df_comet'], df_dict['df_carc']]
-
-    df_ref={}
-    df_ref_list=[]
-    for df in df_list:
-      if df is not None:
-        for col in df.columns:
-          if ('Literature' in col) or ('reference' in col) or ('other' in col):
-            df_ref_list.append( df[col].apply(extract_references))
-
-
-    #create references dataframe
-    processed_data = []
-
-    for series in df_ref_list:
-        # Extract references and essay name
-        references = series.iloc[0]  # First element of the series (list of references)
-        essay_name = series.name.split()[0]  # First word of the series name
-        unique_references = list(set(references))  # Remove duplicates
-        processed_data.append({"essay": essay_name, "references": unique_references})
-
-    # Create a formatted DataFrame
-    formatted_data = []
-    for item in processed_data:
-        essay = item["essay"]
-        references = item["references"]
-        for idx, ref in enumerate(references):
-            formatted_data.append({"essay": essay, "unique_references": ref})
-
-    # Create the final DataFrame
-    final_df = pd.DataFrame(formatted_data)
-
-    # Remove duplicates within each group
-    final_df = final_df.groupby('essay', group_keys=False).apply(
-        lambda group: group.drop_duplicates(subset=["unique_references"])
-    )
-
-    # Mask repeated essay names
-    final_df["essay"] = final_df["essay"].mask(final_df["essay"].duplicated(), "")
-
-    # Reset index for a clean display
-    final_df = final_df.reset_index(drop=True)
-
-
-    for df in df_dict.keys():
-      if df_dict[df] is not None:
-        df_dict[df]=df_dict[df]
-
-    return summary,df_dict['df_ames'], df_dict['df_mcgm'], df_dict['df_mnvit'], df_dict['df_cavit'],df_dict['df_mnvivo'], df_dict['df_cavivo'], df_dict['df_tgr'], df_dict['df_uds'],df_dict['df_comet'], df_dict['df_carc'],add_info,final_df
+SOURCES['ECVAM_NEG']['prepare'] = prepare_ecvam_neg
 
 
 
 # --- ECVAM POSITIVE FUNCTIONS --- #
 
-def subtable_ECVAM(dt,desinenza,new_desinenza,overall):
-  import numpy as np
-  col_list=[]
-  for col in dt.columns:
-    if str(desinenza) in col or col==str(overall):
-      col_list.append(col)
-  new_df=dt[col_list].copy()
-  new_df.dropna(axis='columns',how='all',inplace=True)
-  # print(new_df.empty)
-  if not new_df.empty:
-    for col in new_df.columns:
-      new_df.rename(columns={col:col.replace(str(desinenza),str(new_desinenza))},inplace=True)
-
-    return new_df
-  else:
-    return None
-
 def startcleanECVAM_pos_references():
   df_ref= pd.read_excel(ECVAM_POS_FILE, sheet_name="Database References List")
   df_ref.dropna(axis='columns',how='all', inplace=True)
@@ -1044,25 +1343,8 @@ def startcleanECVAM_pos_references():
 
   return df_ref
 
-def ECVAM_pos_overall(cas_rn,details):
-  import pandas as pd
-  import re
-  import numpy as np
-
-  pd.set_option('display.max_columns', None)
-  pd.set_option('display.max_rows', None)
-  pd.set_option('display.max_colwidth', None)
-
-
-  summary_df,ames_df, vit_MLA, vit_MN, vit_CA, viv_MN, viv_CA, viv_UDS, vivo_TGR, vivo_DNA, CARC, add_info, lit_table = None, None, None, None, None, None, None, None, None, None, None, None, None
-
-
-  # read DeepAmes xlsx data
-  df=pd.read_excel(ECVAM_POS_FILE, header=0, skiprows=[0])
-  df.dropna(axis='columns',how='all')
-
-  # Allow to overwrite dt value
-  pd.options.mode.copy_on_write = True
+def clean_ecvam_pos(df):
+  """Cleans and preprocesses the ECVAM positive DataFrame (header row renaming and useless columns)."""
 
   # Create a dictionary to store new column names
   new_column_names = {}
@@ -1094,147 +1376,159 @@ def ECVAM_pos_overall(cas_rn,details):
   pd.set_option("display.max_columns", None)
   df.rename(columns={'CAS No. cleaned' : 'CAS_no_cleaned'}, inplace=True)
 
-  #call query function
-  # dt=df.query(f'CAS_no_cleaned == "{cas_rn}"')
-  dt = df[df['CAS_no_cleaned'] == cas_rn]
-
-  if not dt.empty:
-    print(f"ECVAM positives: Data found for {cas_rn}")
-    vitro_overall=(f" P\n= {int(dt['vitro_overall_+'].iloc[0])} / {int(dt['vitro_overall_-'].iloc[0])} ")
-    vivo_overall=(f" P\n= {int(dt['vivo_overall_+'].iloc[0])} / {int(dt['vivo_overall_-'].iloc[0])} ")
-
-    list_ames=['CSCL-ISHL_(-S9)', 'CSCL-ISHL_(+S9)', 'CSCL-ISHL_Overall', ' Kirkland et al 2005 & 2011 [1, 2]*', 'US NTP', 'EFSA','SCCS', 'CosE', 'BASF', 'GSK', 'ECHA',	'ISSTox']
-    positive=0
-    negative=0
-    equivocal=0
-    for col in list_ames:
-        if '+' in str(dt[col].iloc[0]):
-          positive+=1
-        elif '-' in str(dt[col].iloc[0]):
-          negative+=1
-        elif 'E' in str(dt[col].iloc[0]):
-          equivocal+=1
-    pne=(f" P/N/E= {positive} / {negative} / {equivocal} ")
-    pd.options.mode.copy_on_write = True
-    a=str(f" {dt['Ames Overall '].iloc[0]}  {str(pne)}")
-    summary_df=pd.DataFrame([{ 'Ames_Overall' :a, 'vitro_overall':vitro_overall , 'vivo_overall':vivo_overall , 'CARC_overall':dt['CARC Overall '].iloc[0] }], index=[cas_rn])
-    summary_df=summary_df
-
-    if details=='on':
-
-      ames_df= dt[['CSCL-ISHL_(-S9)', 'CSCL-ISHL_(+S9)', 'CSCL-ISHL_Overall', ' Kirkland et al 2005 & 2011 [1, 2]*', 'US NTP', 'EFSA','SCCS', 'CosE', 'BASF', 'GSK', 'ECHA',	'ISSTox',	'Literature & Notes',	'Ames Overall ']].copy()
-      print('AMES TABLE')
-      print(ames_df)
-      ames_df.dropna(axis='columns',how='all',inplace=True)
-      if not ames_df.empty:
-        ames_df=ames_df
-        print(ames_df)
-      else:
-        ames_df=None
-
-      # print('VITRO MLA TABLE')
-      vit_MLA=subtable_ECVAM(dt,'.1','_vit_MLA','in vitro MLA Overall ')
-      # print('VITRO MICRONUCLEOUS TABLE')
-      vit_MN=subtable_ECVAM(dt,'.2','_vit_MN','in vitro MN Overall ')
-      # print('VITRO CROMOSOMIAL ABERRATIONS TABLE')
-      vit_CA=subtable_ECVAM(dt,'.3','_vit_CA','in vitro CA Overall ')
-      # print('VIVO MICRONUCLOUS TABLE')
-      viv_MN=subtable_ECVAM(dt,'.4','_viv_MN','in vivo MN Overall ')
-      # print('VIVO CROMOSOMIAL ABERRATIONS TABLE')
-      viv_CA=subtable_ECVAM(dt,'.5','_viv_CA','in vivo CA Overall')
-      # print('VIVO UNSCHEDULED DNA SYNTHESIS TABLE')
-      viv_UDS=subtable_ECVAM(dt,'.6','_viv_UDS','in vivo UDS Overall')
-
-
-      # print('TRANSGENIC RODENT TABLE')
-      vivo_TGR=dt[[' Kirkland et al 2005 & 2011 [1, 2]*.7', 'EFSA.7','SCCS.7', 'ECHA.7',	'ISSTox.7',	'Literature & Notes.7',	'transgenic Overall']].copy()
-      for col in vivo_TGR.columns:
-        vivo_TGR.rename(columns={col:col.replace('.7','_viv_TGR')},inplace=True)
-      vivo_TGR.dropna(axis='columns',how='all',inplace=True)
-      vivo_TGR.dropna(how='all',inplace=True)
-      if not vivo_TGR.empty:
-        vivo_TGR=vivo_TGR
-
-      # print('VIVO DNA DAMAGE TABLE')
-      vivo_DNA_d=dt[[' Kirkland et al 2005 & 2011 [1, 2]*.8', 'EFSA.8','SCCS.8', 'CosE.7', 'GSK.7', 'ECHA.8',	'Literature & Notes.8',	'in vivo DNA damage Overall']].copy()
-      for col in vivo_DNA_d.columns:
-        vivo_DNA_d.rename(columns={col:col.replace('.7','_viv_DNA_d')},inplace=True)
-        vivo_DNA_d.rename(columns={col:col.replace('.8','_viv_DNA_d')},inplace=True)
-      vivo_DNA_d.dropna(axis='columns',how='all',inplace=True)
-      if not vivo_DNA_d.empty:
-        vivo_DNA=vivo_DNA_d
-
-
-      # print('CARCINOGENICITY TABLE')
-      CARC=dt[['CSCL-ISHL_IARC.7','CSCL-ISHL_CPDB.7','CSCL-ISHL_[other].7',' Kirkland et al 2005 & 2011 [1, 2]*.9', 'NTP', 'EFSA.9','SCCS.9', 'CosE.8', 'BASF.7', 'GSK.8', 'ECHA.9',	'ISSTox.8',	'Literature & Notes.9',	'CARC Overall ']].copy()
-      for col in CARC.columns:
-        CARC.rename(columns={col:col.replace('.7','_CARC')},inplace=True)
-        CARC.rename(columns={col:col.replace('.8','_CARC')},inplace=True)
-        CARC.rename(columns={col:col.replace('.9','_CARC')},inplace=True)
-      CARC.dropna(axis='columns',how='all',inplace=True)
-      if not CARC.empty:
-        CARC=CARC
-
-      add_info=pd.DataFrame()
-      # print('OTHER STUDIES')
-      add_info['other studies']=dt[[' (a)']].copy()
-      add_info.dropna(axis='columns',how='all',inplace=True)
-      add_info.dropna(how='all',inplace=True)
-      if not add_info.empty:
-        add_info=add_info
-
-      df_ref=startcleanECVAM_pos_references()
-      lit_array=[]
-      # Iterate over each column in the DataFrame
-      for col in dt.columns:
-          if str(col).startswith('Literature'):  # Check for the specific column
-            for ind in dt.index:
-              col_value = str(dt.loc[ind, col])  # Ensure it's a string
-
-              values_within_brackets = []
-              # Find all ranges or individual numbers within brackets
-              # Regex to match ranges, individual numbers, and lists within brackets
-              matches = re.findall(r'[+-]?\[(\d+(?:-\d+)?(?:,\s*\d+)*)\]', col_value)
-              for match in matches:
-                # Split the match by commas to handle multiple numbers or ranges
-                parts = match.split(',')
-                for part in parts:
-                  part = part.strip()  # Remove extra spaces
-                  if '-' in part:  # It's a range
-                    start, end = map(int, part.split('-'))
-                    values_within_brackets.extend(range(start, end + 1))
-                  else:  # It's a single number
-                    values_within_brackets.append(int(part))
-
-              values_as_integers = [int(value) for value in values_within_brackets]
-              #print(f"Row {ind}: {values_as_integers}")
-              for index in df_ref.index:
-                lit=None
-                if int(df_ref.loc[index,'Numerical Value']) in values_as_integers:
-                  lit=df_ref.loc[index,'List of References']
-                  if lit not in lit_array:
-                    lit_array.append(lit)
-      lit_table={}
-      if lit_array:
-
-        lit_table=pd.DataFrame(data=list(lit_array), columns=['List of References'])
-        lit_table=lit_table.dropna(axis='columns',how='all',inplace=True)
-        if (lit_table is not None):
-          lit_table=lit_table
-        else:
-          lit_table=None
-
-
-      return summary_df,ames_df,vit_MLA,vit_MN,vit_CA,viv_MN,viv_CA,viv_UDS,vivo_TGR,vivo_DNA,CARC,add_info,lit_table
-    else:
-      return summary_df,None,None,None,None,None,None,None,None,None,None,None,None
-
+  return df
+
+# ECVAM positive sub-tables: their columns and how these are renamed. The schema is compiled
+# once from the header of the cleaned table, then the sub-tables of every substance are
+# computed when the source is loaded (prepare_ecvam_pos).
+ECVAM_POS_AMES_CALLS = ['CSCL-ISHL_(-S9)', 'CSCL-ISHL_(+S9)', 'CSCL-ISHL_Overall', ' Kirkland et al 2005 & 2011 [1, 2]*', 'US NTP', 'EFSA', 'SCCS', 'CosE', 'BASF', 'GSK', 'ECHA', 'ISSTox']
+ECVAM_POS_SUBTABLES = {
+  'ames': {'columns': ECVAM_POS_AMES_CALLS + ['Literature & Notes', 'Ames Overall ']},
+  'vit_MLA': {'suffix': '.1', 'overall': 'in vitro MLA Overall ', 'replace': [('.1', '_vit_MLA')]},
+  'vit_MN': {'suffix': '.2', 'overall': 'in vitro MN Overall ', 'replace': [('.2', '_vit_MN')]},
+  'vit_CA': {'suffix': '.3', 'overall': 'in vitro CA Overall ', 'replace': [('.3', '_vit_CA')]},
+  'viv_MN': {'suffix': '.4', 'overall': 'in vivo MN Overall ', 'replace': [('.4', '_viv_MN')]},
+  'viv_CA': {'suffix': '.5', 'overall': 'in vivo CA Overall', 'replace': [('.5', '_viv_CA')]},
+  'viv_UDS': {'suffix': '.6', 'overall': 'in vivo UDS Overall', 'replace': [('.6', '_viv_UDS')]},
+  'vivo_TGR': {'columns': [' Kirkland et al 2005 & 2011 [1, 2]*.7', 'EFSA.7', 'SCCS.7', 'ECHA.7', 'ISSTox.7', 'Literature & Notes.7', 'transgenic Overall'],
+               'replace': [('.7', '_viv_TGR')]},
+  'vivo_DNA': {'columns': [' Kirkland et al 2005 & 2011 [1, 2]*.8', 'EFSA.8', 'SCCS.8', 'CosE.7', 'GSK.7', 'ECHA.8', 'Literature & Notes.8', 'in vivo DNA damage Overall'],
+               'replace': [('.7', '_viv_DNA_d'), ('.8', '_viv_DNA_d')]},
+  'CARC': {'columns': ['CSCL-ISHL_IARC.7', 'CSCL-ISHL_CPDB.7', 'CSCL-ISHL_[other].7', ' Kirkland et al 2005 & 2011 [1, 2]*.9', 'NTP', 'EFSA.9', 'SCCS.9', 'CosE.8', 'BASF.7', 'GSK.8', 'ECHA.9', 'ISSTox.8', 'Literature & Notes.9', 'CARC Overall '],
+           'replace': [('.7', '_CARC'), ('.8', '_CARC'), ('.9', '_CARC')]},
+}
+
+
+def compile_ecvam_pos_schema(columns):
+  """Compiles ECVAM_POS_SUBTABLES for the columns of the cleaned table: {sub-table: (column positions, new names)}."""
+  positions = {col: i for i, col in enumerate(columns)}
+  schema = {}
+  for name, spec in ECVAM_POS_SUBTABLES.items():
+    if 'columns' in spec:
+      cols = spec['columns']
+    else:  # every column containing the suffix, and the overall call
+      cols = [col for col in columns if spec['suffix'] in str(col) or col == spec['overall']]
+    names = list(cols)
+    for col in cols:  # same result as renaming the columns one at a time
+      for old, new in spec.get('replace', []):
+        names = [col.replace(old, new) if n == col else n for n in names]
+    schema[name] = ([positions[col] for col in cols], names)
+  return schema
+
+
+def ecvam_pos_subtable(dt, schema, name):
+  """Returns a sub-table of the rows of one substance, without its empty columns."""
+  positions, names = schema[name]
+  df = dt.iloc[:, positions]
+  df.columns = names
+  return df.dropna(axis='columns', how='all')
+
+
+def ecvam_pos_tables(dt, cas_rn, schema, ames_counts):
+  """Computes the summary and the sub-tables of one substance (dt: its rows, ames_counts: the P/N/E of the Ames calls of its first row)."""
+  vitro_overall=(f" P\n= {int(dt['vitro_overall_+'].iloc[0])} / {int(dt['vitro_overall_-'].iloc[0])} ")
+  vivo_overall=(f" P\n= {int(dt['vivo_overall_+'].iloc[0])} / {int(dt['vivo_overall_-'].iloc[0])} ")
+
+  positive, negative, equivocal = ames_counts
+  pne=(f" P/N/E= {positive} / {negative} / {equivocal} ")
+  a=str(f" {dt['Ames Overall '].iloc[0]}  {str(pne)}")
+  tables = {'summary': pd.DataFrame([{ 'Ames_Overall' :a, 'vitro_overall':vitro_overall , 'vivo_overall':vivo_overall , 'CARC_overall':dt['CARC Overall '].iloc[0] }], index=[cas_rn])}
+
+  # empty sub-tables are None, except the TGR, carcinogenicity and other studies ones (empty frames)
+  for name in ['ames', 'vit_MLA', 'vit_MN', 'vit_CA', 'viv_MN', 'viv_CA', 'viv_UDS', 'vivo_DNA']:
+    df = ecvam_pos_subtable(dt, schema, name)
+    tables[name] = None if df.empty else df
+  tables['vivo_TGR'] = ecvam_pos_subtable(dt, schema, 'vivo_TGR').dropna(how='all')
+  tables['CARC'] = ecvam_pos_subtable(dt, schema, 'CARC')
+
+  add_info=pd.DataFrame()
+  add_info['other studies']=dt[[' (a)']].copy()
+  add_info.dropna(axis='columns',how='all',inplace=True)
+  add_info.dropna(how='all',inplace=True)
+  tables['add_info'] = add_info
+  return tables
+
+
+def prepare_ecvam_pos(tables):
+  """Computes the summary and sub-tables of every substance of ECVAM positive: {'schema', 'tables': {CAS: tables}}."""
+  df = tables['data'].copy()  # one block per dtype: much faster slicing
+  schema = compile_ecvam_pos_schema(list(df.columns))
+  reference_index = build_reference_index(tables['references'])
+  ames_counts = ecvam_call_counts(df, ECVAM_POS_AMES_CALLS)
+  by_cas = {}
+  for cas_rn, positions in build_cas_index(df['CAS_no_cleaned']).items():
+    dt = df.iloc[positions]
+    try:
+      by_cas[cas_rn] = ecvam_pos_tables(dt, cas_rn, schema, ames_counts[positions[0]])
+      by_cas[cas_rn]['literature'] = ecvam_pos_literature(dt, reference_index)
+    except (ValueError, TypeError) as e:  # e.g. no overall counts: the query fails for this CAS only
+      by_cas[cas_rn] = {'error': f"{type(e).__name__}: {e}"}
+      print(f"ECVAM positives: tables of {cas_rn} not computed ({by_cas[cas_rn]['error']})")
+  return {'schema': schema, 'references': reference_index, 'tables': by_cas}
+
+
+SOURCES['ECVAM_POS']['prepare'] = prepare_ecvam_pos
+
+
+def parse_citations(text):
+  """Returns the reference numbers cited in a literature cell: '[3]', '[4-6]' or '[7, 9]' give 3, 4, 5, 6, 7, 9."""
+  numbers = []
+  # Regex to match ranges, individual numbers, and lists within brackets
+  for match in re.findall(r'[+-]?\[(\d+(?:-\d+)?(?:,\s*\d+)*)\]', str(text)):
+    for part in match.split(','):
+      part = part.strip()
+      if '-' in part:  # It's a range
+        start, end = map(int, part.split('-'))
+        numbers.extend(range(start, end + 1))
+      else:  # It's a single number
+        numbers.append(int(part))
+  return numbers
+
+
+def build_reference_index(df_ref):
+  """Maps every reference number of the references sheet to its (row in the sheet, reference) entries."""
+  index = {}
+  numbers = pd.to_numeric(df_ref['Numerical Value'], errors='coerce')
+  for rank, (number, reference) in enumerate(zip(numbers, df_ref['List of References'])):
+    if pd.notna(number):
+      index.setdefault(int(number), []).append((rank, reference))
+  return index
+
+
+def ecvam_pos_literature(dt, reference_index):
+  """Builds the literature table of the rows of one substance: the references its 'Literature' cells cite."""
+  lit_array=[]
+  for col in dt.columns:
+    if str(col).startswith('Literature'):
+      for value in dt[col]:
+        cited = set(parse_citations(value))
+        # in the order of the references sheet, each reference once
+        for _, lit in sorted(entry for number in cited for entry in reference_index.get(number, [])):
+          if lit not in lit_array:
+            lit_array.append(lit)
+  if not lit_array:
+    return None
+  return pd.DataFrame(data=lit_array, columns=['List of References']).dropna(axis='columns', how='all')
 
 
+def ECVAM_pos_overall(cas_rn,details):
+  """Returns the summary, sub-tables and literature of a substance, computed at ingest (see prepare_ecvam_pos)."""
+  entry = registry.entry('ECVAM_POS')  # all tables of the same version
+  tables = registry.prepared('ECVAM_POS', entry).get('tables', {}).get(normalize_cas(cas_rn))
 
-  else:
+  if tables is None:
     print(f" No data found for cas_rn={cas_rn}")
     return None,None,None,None,None,None,None,None,None,None,None,None,None
+  if 'error' in tables:  # see prepare_ecvam_pos
+    raise RuntimeError(f"ECVAM positives: tables of {cas_rn} not computed at ingest ({tables['error']})")
+
+  print(f"ECVAM positives: Data found for {cas_rn}")
+  if details!='on':
+    return tables['summary'],None,None,None,None,None,None,None,None,None,None,None,None
+
+  return (tables['summary'], tables['ames'], tables['vit_MLA'], tables['vit_MN'], tables['vit_CA'], tables['viv_MN'],
+          tables['viv_CA'], tables['viv_UDS'], tables['vivo_TGR'], tables['vivo_DNA'], tables['CARC'], tables['add_info'],
+          tables['literature'])  # None: no literature
 
 
 
@@ -1253,7 +1547,175 @@ def is_empty_table(df):
     # Check if all values are "NR" or NaN
     return df.apply(lambda x: x.isin(["NR", np.nan])).all().all()
 
+def is_empty_value(value):
+    """A cell is_empty_table counts as no data: "NR" or NaN (None is data there)."""
+    return (isinstance(value, str) and value == "NR") or (isinstance(value, float) and value != value)
+
+
+def prepare_table(df):
+    """Cleans a table of the answer: None if it has no data.
+
+    The cells of is_empty_table and clean_dataframe, in one pass over the table as
+    an object array: missing values, empty strings and single spaces become "NR".
+    A table with a MultiIndex has it moved to its columns and comes as
+    {"data": table, "is_multiindex": True}, the layout of its JSON.
+    """
+    values = df.to_numpy(dtype=object, copy=True)
+    if all(map(is_empty_value, values.flat)):
+        return None
+    values[pd.isna(values)] = "NR"
+    values[(values == "") | (values == " ")] = "NR"
+    df = pd.DataFrame(values, index=df.index, columns=df.columns)
+    if isinstance(df.index, pd.MultiIndex):  # Check if MultiIndex
+        return {"data": df.reset_index(), "is_multiindex": True}  # Store flag for MultiIndex restoration
+    return df
+
+
+def prepare_tables(results):
+    """The tables of the answer cleaned by prepare_table, the ones with no data left out; the other values as they are."""
+    tables = {}
+    for key, value in results.items():
+        if isinstance(value, pd.DataFrame):
+            value = prepare_table(value)
+            if value is not None:
+                tables[key] = value
+        elif isinstance(value, list) and all(isinstance(df, pd.DataFrame) for df in value):
+            prepared = [table for table in map(prepare_table, value) if table is not None]
+            if prepared:
+                tables[key] = prepared
+        else:
+            tables[key] = value
+    return tables
+
+
+# The tables of an answer are sent in the orient='split' layout of pandas (see split_tables), or,
+# asked with ?layout=columnar (not ?format=, the format suffix of DRF), column by column with
+# the strings repeated in the answer sent once:
+#     "strings": [the strings found more than once in the tables of the answer]
+#     a table: {"index": <array>, "columns": <array>, "data": [an <array> per column]}
+#     <array>: a list of strings, those of "strings" given by their position, if it only has
+#              strings (most of them: labels, db_name, db_version, cas_rn, "NR"...), else
+#              {"cells": [...]}
+# A table whose MultiIndex was moved to its columns comes as {"data": <table>, "is_multiindex": True}.
+LAYOUTS = ('split', 'columnar')
+
+
+def answer_layout(query):
+    """The layout of the tables asked in the query string (see LAYOUTS): 'split' by default, None if unknown."""
+    layout = query.get('layout', 'split')
+    return layout if layout in LAYOUTS else None
+
+
+def is_table(value):
+    """A table of prepare_tables."""
+    return isinstance(value, pd.DataFrame) or (isinstance(value, dict) and bool(value.get("is_multiindex")))
+
+
+def table_arrays(table):
+    """The labels and the columns of a table of prepare_tables, as lists: [index, columns, column 0, column 1...]."""
+    if isinstance(table, dict):
+        table = table["data"]
+    return [table.index.tolist(), table.columns.tolist(), *(column.tolist() for column in table.to_numpy(dtype=object).T)]
+
+
+def is_text(array):
+    return all(isinstance(cell, str) for cell in array)
+
+
+def encode_array(array, codes):
+    if is_text(array):
+        return [codes.get(cell, cell) for cell in array]
+    return {"cells": [cell.item() if isinstance(cell, np.generic) else cell for cell in array]}
+
+
+def decode_array(array, strings):
+    if isinstance(array, dict):
+        return array["cells"]
+    return [strings[cell] if isinstance(cell, int) else cell for cell in array]
+
+
+def split_table(table):
+    if isinstance(table, dict):
+        return {"data": table["data"].to_dict(orient="split"), "is_multiindex": True}
+    return table.to_dict(orient="split")
+
+
+def split_tables(tables):
+    """The JSON of the tables of prepare_tables in the orient='split' layout, the default one of the API."""
+    processed_data = {}
+    for key, value in tables.items():
+        if is_table(value):
+            processed_data[key] = split_table(value)
+        elif isinstance(value, list) and value and all(map(is_table, value)):
+            processed_data[key] = [split_table(table) for table in value]
+        else:
+            processed_data[key] = value
+    return processed_data
+
+
+def encode_tables(tables):
+    """The JSON of the tables of prepare_tables (see above): (data, strings)."""
+    arrays = {}  # key -> the arrays of its table, or of every table of its list
+    for key, value in tables.items():
+        if is_table(value):
+            arrays[key] = [table_arrays(value)]
+        elif isinstance(value, list) and value and all(map(is_table, value)):
+            arrays[key] = [table_arrays(table) for table in value]
+
+    counts = Counter(cell for table in chain.from_iterable(arrays.values()) for array in table if is_text(array) for cell in array)
+    codes = {}  # string -> its position in strings
+    for string, count in counts.items():
+        if count > 1:
+            codes[string] = len(codes)
+
+    def encode(table, lists):
+        index, columns, *data = (encode_array(array, codes) for array in lists)
+        encoded = {"index": index, "columns": columns, "data": data}
+        return {"data": encoded, "is_multiindex": True} if isinstance(table, dict) else encoded
+
+    processed_data = {}
+    for key, value in tables.items():
+        if key not in arrays:
+            processed_data[key] = value
+        elif is_table(value):
+            processed_data[key] = encode(value, arrays[key][0])
+        else:
+            processed_data[key] = [encode(table, lists) for table, lists in zip(value, arrays[key])]
+    return processed_data, list(codes)
+
+
+def is_encoded_table(value):
+    return isinstance(value, dict) and ("index" in value or bool(value.get("is_multiindex")))
+
+
+def decode_table(encoded, strings=None):
+    """The table of prepare_table back from its JSON; strings None: the former orient='split' layout."""
+    if encoded.get("is_multiindex"):
+        return {"data": decode_table(encoded["data"], strings), "is_multiindex": True}
+    if strings is None:
+        return pd.DataFrame(encoded["data"], index=encoded["index"], columns=encoded["columns"])
+    columns = [decode_array(column, strings) for column in encoded["data"]]
+    return pd.DataFrame(dict(enumerate(columns)), index=decode_array(encoded["index"], strings)) \
+        .set_axis(decode_array(encoded["columns"], strings), axis=1)
+
+
+def decode_tables(data, strings=None):
+    """The tables of an answer back from its "data" and "strings" (see encode_tables); the other values are left out."""
+    tables = {}
+    for key, value in data.items():
+        if is_encoded_table(value):
+            tables[key] = decode_table(value, strings)
+        elif isinstance(value, list) and value and all(map(is_encoded_table, value)):
+            tables[key] = [decode_table(table, strings) for table in value]
+    return tables
+
+
 def process_results(results):
+    """The former JSON of the tables: is_empty_table, clean_dataframe and to_dict(orient='split') of every table.
+
+    The API answers with prepare_tables and split_tables (encode_tables with
+    ?layout=columnar); this is the reference of "python manage.py benchmark payload".
+    """
     processed_data = {}
 
     for key, value in results.items():
@@ -1284,7 +1746,6 @@ def process_results(results):
                 processed_data[key] = processed_list
         else:
             processed_data[key] = value
-
     return processed_data
 
 
@@ -1321,48 +1782,883 @@ def is_valid_cas(cas_number: str) -> bool:
     
     
 # --- CAS TO INCHI-KEY ---
+# The Cactus answers are kept in the Django cache settings.INCHIKEY_CACHE (a DatabaseCache
+# table of db.sqlite3 of their own): InChIKeys for INCHIKEY_CACHE_TTL seconds, CAS numbers Cactus
+# does not know for INCHIKEY_NEGATIVE_TTL seconds. Network errors are never cached.
+INCHIKEY_RE = re.compile(r'^[A-Z]{14}-[A-Z]{10}-[A-Z]$')
+INCHIKEY_NOT_FOUND = ''  # cached value of a CAS number Cactus does not know
+CACTUS_TIMEOUT = 12
+
+cactus_session = requests.Session()  # keeps the connection to Cactus open between requests
+cactus_async_clients = weakref.WeakKeyDictionary()  # one httpx client per event loop
+
+
 def generate_url(cas_number):
     """Generates the URL for the NCI Cactus API."""
-    base_url = "https://cactus.nci.nih.gov/chemical/structure/{}/stdinchikey"
+    base_url = getattr(settings, 'CACTUS_URL', "https://cactus.nci.nih.gov/chemical/structure/{}/stdinchikey")
     return base_url.format(cas_number)
 
-def fetch_url_content(cas_number):
-    """Fetches content from the specified URL."""
-    url = generate_url(cas_number)
+
+def parse_inchikey(text):
+    """Returns the InChIKey of a Cactus answer ("InChIKey=..."), None if it is not one."""
+    text = text.strip()
+    if not text.startswith('InChIKey='):
+        return None
+    inchi_key = text[len('InChIKey='):].strip()
+    return inchi_key if INCHIKEY_RE.match(inchi_key) else None
+
+
+def inchikey_cache():
+    return caches[getattr(settings, 'INCHIKEY_CACHE', 'default')]
+
+
+def inchikey_cache_key(cas_rn):
+    return f"inchikey:{cas_rn.strip()}"
+
+
+def inchikey_cache_timeout(inchi_key):
+    if inchi_key:
+        return getattr(settings, 'INCHIKEY_CACHE_TTL', 30 * 24 * 3600)
+    return getattr(settings, 'INCHIKEY_NEGATIVE_TTL', 24 * 3600)
+
+
+def cactus_lookup(cas_rn):
+    """Asks Cactus the InChIKey of a CAS number: (InChIKey or None, True if the answer can be cached)."""
     try:
-        response = requests.get(url, timeout=12)  # Add a timeout to prevent indefinite hanging
-        response.raise_for_status()  # Raise an exception for bad status codes (4xx or 5xx)
-        return response.text
+        response = cactus_session.get(generate_url(cas_rn), timeout=CACTUS_TIMEOUT)
+        if response.status_code == 404:
+            return None, True  # Cactus does not know this CAS number
+        response.raise_for_status()
     except requests.exceptions.RequestException as e:
-        return f"Error retrieving data for CAS {cas_number}: {e}"  # More informative error message    
+        print(f"Error retrieving the InChIKey of CAS {cas_rn}: {e}")
+        return None, False
+    return parse_inchikey(response.text), True
 
 
-# --- Django View ---
-def progress_view(request):
-    if 'progress' in request.session:
-        return JsonResponse(request.session['progress'])
+async def acactus_lookup(cas_rn):
+    """Async version of cactus_lookup."""
+    loop = asyncio.get_running_loop()
+    client = cactus_async_clients.get(loop)
+    if client is None:
+        client = cactus_async_clients[loop] = httpx.AsyncClient(timeout=CACTUS_TIMEOUT)
+    try:
+        response = await client.get(generate_url(cas_rn))
+        if response.status_code == 404:
+            return None, True
+        response.raise_for_status()
+    except httpx.HTTPError as e:
+        print(f"Error retrieving the InChIKey of CAS {cas_rn}: {e}")
+        return None, False
+    return parse_inchikey(response.text), True
+
+
+def local_inchikey(cas_rn):
+    """Returns the InChIKey of a CAS number from the identity table of the bundled sources, None on a miss."""
+    rows = registry.lookup('IDENTITY', cas_rn)
+    if 'InChIKey' not in rows.columns:
+        return None
+    keys = rows['InChIKey'].dropna()
+    return keys.iloc[0] if len(keys) else None
+
+
+def resolve_inchikey(cas_rn):
+    """Returns the InChIKey of a CAS number (identity table, cache, then Cactus), None if unknown or unreachable."""
+    inchi_key = local_inchikey(cas_rn)
+    if inchi_key:
+        return inchi_key
+
+    key = inchikey_cache_key(cas_rn)
+    try:
+        cached = inchikey_cache().get(key)
+    except DatabaseError as e:
+        print(f"InChIKey cache not available: {e}")
+        cached = None
+    if cached is not None:
+        return cached or None
+
+    return cactus_inchikey(cas_rn)
+
+
+def cactus_inchikey(cas_rn):
+    """Asks Cactus the InChIKey of a CAS number and caches the answer, None if unknown or unreachable."""
+    inchi_key, cacheable = cactus_lookup(cas_rn)
+    if cacheable:
+        try:
+            inchikey_cache().set(inchikey_cache_key(cas_rn), inchi_key or INCHIKEY_NOT_FOUND, inchikey_cache_timeout(inchi_key))
+        except DatabaseError as e:
+            print(f"InChIKey cache not available: {e}")
+    return inchi_key
+
+
+def cached_inchikeys(cas_rns):
+    """{CAS: InChIKey} of the CAS numbers in the InChIKey cache, INCHIKEY_NOT_FOUND for the ones Cactus does not know."""
+    found = {}
+    keys = {inchikey_cache_key(cas_rn): cas_rn for cas_rn in cas_rns}
+    names = list(keys)
+    try:
+        for start in range(0, len(names), 500):  # a bounded number of SQL parameters per query
+            for key, value in inchikey_cache().get_many(names[start:start + 500]).items():
+                found[keys[key]] = value
+    except DatabaseError as e:
+        print(f"InChIKey cache not available: {e}")
+    return found
+
+
+async def aresolve_inchikey(cas_rn):
+    """Async version of resolve_inchikey."""
+    inchi_key = await asyncio.get_running_loop().run_in_executor(query_executor, local_inchikey, cas_rn)
+    if inchi_key:
+        return inchi_key
+
+    key = inchikey_cache_key(cas_rn)
+    try:
+        cached = await inchikey_cache().aget(key)
+    except DatabaseError as e:
+        print(f"InChIKey cache not available: {e}")
+        cached = None
+    if cached is not None:
+        return cached or None
+
+    inchi_key, cacheable = await acactus_lookup(cas_rn)
+    if cacheable:
+        try:
+            await inchikey_cache().aset(key, inchi_key or INCHIKEY_NOT_FOUND, inchikey_cache_timeout(inchi_key))
+        except DatabaseError as e:
+            print(f"InChIKey cache not available: {e}")
+    return inchi_key
+
+
+# --- CONCURRENT SOURCE QUERIES ---
+
+# shared by all requests, so the number of lookups running at the same time stays bounded
+query_executor = ThreadPoolExecutor(max_workers=getattr(settings, 'SOURCE_QUERY_WORKERS', 8), thread_name_prefix='source_query')
+
+
+def query_ccris_by_cas(cas_rn, details):
+    """Resolves the InChIKey of the CAS number (Cactus) and queries CCRIS with it."""
+    inchi_key = resolve_inchikey(cas_rn)
+    if not inchi_key:
+        return None, None
+    return query_ccris(inchi_key, details)
+
+
+def source_queries(cas_rn, details):
+    """Returns {source: function} with the independent lookups run for a substance."""
+    return {
+        'DeepAmes': lambda: query_deepames(cas_rn),
+        'Hansen': lambda: query_hansen(cas_rn),
+        'OECD_vivo': lambda: query_oecd_vivo(cas_rn),
+        'OECD_Chromosome_vitro': lambda: query_oecd_chromosome(cas_rn),
+        'IARC': lambda: query_iarc(cas_rn),
+        'PPRTV&IRIS': lambda: query_IRIS_PPRTV(cas_rn),
+        'HOMNA': lambda: query_homna(cas_rn),
+        'AMESCEBS': lambda: query_amescebs(cas_rn, details),
+        'OpenFoodTox': lambda: query_openfoodtox(cas_rn),
+        'ECVAM_Neg': lambda: query_ecvam_neg(cas_rn),
+        'ECVAM_Pos': lambda: query_ecvam_pos(cas_rn, details),
+        'CCRIS': lambda: query_ccris_by_cas(cas_rn, details),
+    }
+
+
+def source_timeout(name):
+    """Seconds a source may take before its result is given up."""
+    return getattr(settings, 'SOURCE_QUERY_TIMEOUTS', {}).get(name, getattr(settings, 'SOURCE_QUERY_TIMEOUT', 15))
+
+
+def run_source_queries(queries):
+    """Runs the lookups in parallel on the shared executor, each one with its own timeout.
+
+    Returns (outputs, timed_out, failed): {source: result} for the sources that
+    answered in time, the list of sources that timed out and {source: error}
+    for the sources that raised an exception.
+    """
+    start = time.monotonic()
+    futures = {name: query_executor.submit(fn) for name, fn in queries.items()}
+
+    outputs, timed_out, failed = {}, [], {}
+    for name, future in futures.items():
+        remaining = start + source_timeout(name) - time.monotonic()
+        try:
+            outputs[name] = future.result(timeout=max(remaining, 0))
+        except FuturesTimeoutError:
+            future.cancel()  # a lookup already running cannot be stopped, its result is just ignored
+            timed_out.append(name)
+            print(f"{name}: no answer after {source_timeout(name)}s")
+        except Exception as e:
+            failed[name] = f"{type(e).__name__}: {e}"
+            print(f"{name}: query failed: {e}")
+    return outputs, timed_out, failed
+
+
+def collect_results(cas_rn, details, outputs):
+    """Lays the outputs of run_source_queries out as the {table name: table} dict returned to the client."""
+    results = {}
+    for name in ['DeepAmes', 'Hansen', 'OECD_vivo', 'OECD_Chromosome_vitro', 'IARC', 'PPRTV&IRIS', 'HOMNA']:
+        if name in outputs:
+            results[name] = outputs[name]
+
+    if 'AMESCEBS' in outputs:
+        amescebs_summary, amescebs_supersummary = outputs['AMESCEBS']
+        results['AMESCEBS_supersummary'] = amescebs_supersummary
+        results['AMESCEBS_summary'] = amescebs_summary
+
+    if 'OpenFoodTox' in outputs:
+        opf_genotox_summary, opf_genotox_ref, opf_refpoint_ref, opf_refvalue_ref = outputs['OpenFoodTox']
+        results['OpenFoodTox_genotox_summary'] = opf_genotox_summary
+        results['OpenFoodTox_genotox_ref'] = opf_genotox_ref
+        results['OpenFoodTox_refpoint_ref'] = opf_refpoint_ref
+        results['OpenFoodTox_refvalue_ref'] = opf_refvalue_ref
+
+    ecvam_neg_results = outputs.get('ECVAM_Neg')
+    if ecvam_neg_results:
+        results.update(ecvam_neg_results)
+
+    ecvam_pos_results = outputs.get('ECVAM_Pos')
+    if ecvam_pos_results:
+        results.update(ecvam_pos_results)
+
+    if 'CCRIS' in outputs:
+        ccris_dg, ccris_summary = outputs['CCRIS']
+        if details == 'on' and ccris_dg:
+            for i, df in enumerate(ccris_dg):
+                if isinstance(df, pd.DataFrame):
+                    df = add_cas_db_version_identificative(df, cas_rn, CCRIS_FILE)
+                    df = df.transpose()
+                    df.replace({np.nan: None}, inplace=True)  # Fix NaN issue
+                    ccris_dg[i] = df
+
+        if isinstance(ccris_summary, pd.DataFrame):
+            ccris_summary = add_cas_db_version_identificative(ccris_summary, cas_rn, CCRIS_FILE)
+            ccris_summary = ccris_summary.transpose()
+            ccris_summary.replace({np.nan: None}, inplace=True)  # Fix NaN issue
+
+        results['CCRIS_Summary'] = ccris_summary
+        results['CCRIS_Data'] = ccris_dg
+
+    return results
+
+
+def all_results_empty(results):
+    """True if no source returned any data."""
+    return all(result is None or
+               (isinstance(result, tuple) and all(r is None or (hasattr(r, 'empty') and r.empty) for r in result)) or
+               (hasattr(result, 'empty') and result.empty)
+               for result in results.values())
+
+
+def process_payload(cas_rn, details, outputs, timed_out, failed, keep=False, layout='split'):
+    """Builds the answer of the process API from the source outputs: (payload, HTTP status).
+
+    keep: the tables are also kept server-side (see store_result), the payload
+    gives their result_id and the URL of their workbook.
+    layout: of the tables, see LAYOUTS.
+    """
+    results = collect_results(cas_rn, details, outputs)
+
+    # Ensure there is at least some data
+    if all_results_empty(results):
+        return {
+            "error": "No data for the CAS submitted",
+            "sources_timed_out": timed_out,
+            "sources_failed": failed,
+        }, status.HTTP_404_NOT_FOUND
+
+    # Process and clean the results
+    tables = prepare_tables(results)
+    payload = {"cas_rn": cas_rn}
+    if layout == 'columnar':
+        payload["data"], payload["strings"] = encode_tables(tables)
     else:
-        return JsonResponse({'message': 'No progress information available'})
+        payload["data"] = split_tables(tables)
+    payload.update({
+        "sources_timed_out": timed_out,
+        "sources_failed": failed,
+        "download_ready": True
+    })
+    result_id = store_result(cas_rn, tables) if keep else None
+    if result_id:
+        payload["result_id"] = result_id
+        payload["download_url"] = reverse('download_result', args=[result_id])
+    return payload, status.HTTP_200_OK
+
+
+# --- RESULT HANDLES ---
+# The tables of a process API answer are kept server-side (in the shared tier of the result
+# cache, for RESULT_HANDLE_TTL seconds): the workbook is then downloaded with a GET of its
+# result_id, instead of posting the whole answer back to the download API.
+
+def store_result(cas_rn, tables):
+    """Keeps the tables of an answer (see prepare_tables); returns their result_id, None if they could not be stored."""
+    result_id = uuid.uuid4().hex
+    if not resultcache.set_tables(result_id, {'cas_rn': cas_rn, 'tables': tables}):
+        return None
+    return result_id
+
+
+# --- WORKBOOKS ---
+# The workbooks are written with openpyxl in write-only mode: every row goes to a temporary
+# file as soon as it is appended, so the memory used does not grow with the size of the
+# workbook. The cells are the ones of pandas' to_excel(index=True): missing values are
+# empty, the header and the index in bold with borders (MultiIndex labels written once
+# per group, where to_excel merges them).
+
+HEADER_FONT = Font(bold=True)
+HEADER_BORDER = Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin'))
+HEADER_ALIGNMENT = Alignment(horizontal='center', vertical='top')
+
+
+def excel_cell(ws, value, header=False):
+    """A cell of a write-only sheet with value converted like to_excel does."""
+    if is_scalar(value) and pd.isna(value):
+        value = ''
+    elif isinstance(value, (float, np.floating)) and np.isinf(value):
+        value = 'inf' if value > 0 else '-inf'
+
+    number_format = None
+    if isinstance(value, (bool, np.bool_)):
+        value = bool(value)
+    elif isinstance(value, (int, np.integer)):
+        value = int(value)
+    elif isinstance(value, (float, np.floating)):
+        value = float(value)
+    elif isinstance(value, datetime.datetime):
+        number_format = 'YYYY-MM-DD HH:MM:SS'
+    elif isinstance(value, datetime.date):
+        number_format = 'YYYY-MM-DD'
+    elif isinstance(value, datetime.timedelta):
+        value, number_format = value.total_seconds() / 86400, '0'
+    elif not isinstance(value, str):
+        value = str(value)
+
+    if not header and number_format is None:
+        return value  # a plain value is written as a plain cell
+    cell = WriteOnlyCell(ws, value)
+    if number_format is not None:
+        cell.number_format = number_format
+    if header:
+        cell.font, cell.border, cell.alignment = HEADER_FONT, HEADER_BORDER, HEADER_ALIGNMENT
+    return cell
+
+
+def append_table(ws, table, label=None):
+    """Appends a DataFrame to a write-only sheet: a header row, then a row per index entry.
+
+    label: text of the top-left cell (by default the name of the index, if it has one).
+    """
+    levels = table.index.nlevels
+    names = [label] if label is not None else list(table.index.names)
+    names += [None] * (levels - len(names))
+    named = any(name is not None for name in names)
+    ws.append([excel_cell(ws, name, header=True) if named else None for name in names]
+              + [excel_cell(ws, column, header=True) for column in table.columns])
+
+    previous = None
+    for index, *values in table.itertuples(name=None):
+        if levels == 1:
+            labels = [excel_cell(ws, index, header=True)]
+        else:
+            # a label repeating the one above (same group) is left out, like to_excel's merged cells
+            same = 0
+            while previous is not None and same < levels - 1 and index[same] == previous[same]:
+                same += 1
+            labels = [None] * same + [excel_cell(ws, value, header=True) for value in index[same:]]
+            previous = index
+        ws.append(labels + [excel_cell(ws, value) for value in values])
+
+
+def excel_table(table):
+    """The DataFrame written in the workbook for a table of prepare_tables."""
+    if isinstance(table, dict):  # MultiIndex moved to the columns
+        table = table["data"]
+    table = table.set_axis([str(c) for c in table.columns], axis=1)
+    # cells as in the JSON answer, the tables of a POST: tuples (e.g. CCRIS group names) are lists
+    for i in np.flatnonzero((table.dtypes == object).to_numpy()):
+        column = table.iloc[:, i]
+        if column.map(type).eq(tuple).any():
+            table.isetitem(i, column.map(lambda value: list(value) if isinstance(value, tuple) else value))
+    return table
+
+
+def write_workbook(tables, output):
+    """Writes the tables of an answer as the sheets of an Excel workbook, the lists of tables as numbered sheets.
+
+    output: a path or a binary file. The values that are not tables (see is_table) are skipped.
+    """
+    wb = Workbook(write_only=True)
+    for sheet_name, result in tables.items():
+        if is_table(result):
+            append_table(wb.create_sheet(sheet_name[:31]), excel_table(result))
+        elif isinstance(result, list):
+            for idx, df in enumerate(result):
+                if is_table(df):
+                    append_table(wb.create_sheet(f"{sheet_name[:28]}_{idx}"), excel_table(df))
+    wb.save(output)
+
+
+def write_batch_workbook(answers, output):
+    """Writes the tables of many CAS numbers in one workbook: a sheet per table, a block per CAS number.
+
+    answers: iterable of (CAS, tables of prepare_tables), consumed one CAS number at a
+    time. Every block is the table as write_workbook writes it, with the CAS number in
+    its top-left cell, followed by an empty row.
+    """
+    wb = Workbook(write_only=True)
+    sheets = {}
+
+    def sheet(name):
+        if name not in sheets:
+            sheets[name] = wb.create_sheet(name)
+        return sheets[name]
+
+    for cas_rn, tables in answers:
+        for sheet_name, result in tables.items():
+            if is_table(result):
+                blocks = [(sheet_name[:31], result)]
+            elif isinstance(result, list):
+                blocks = [(f"{sheet_name[:28]}_{idx}", df) for idx, df in enumerate(result) if is_table(df)]
+            else:
+                continue
+            for name, table in blocks:
+                ws = sheet(name)
+                append_table(ws, excel_table(table), label=cas_rn)
+                ws.append([])
+    if not sheets:
+        wb.create_sheet('no hits')  # a workbook needs a sheet
+    wb.save(output)
+
+
+def workbook_file(write, *args):
+    """Runs write(*args, file) on a temporary file, deleted once closed; returns the file, rewound."""
+    output = tempfile.TemporaryFile()
+    try:
+        write(*args, output)
+    except BaseException:
+        output.close()
+        raise
+    output.seek(0)
+    return output
 
-# --- Django View ---
-def progress_view(request):
-    if 'progress' in request.session:
-        return JsonResponse(request.session['progress'])
+
+# --- RESULT CACHE ---
+# The answers of the process API are cached (see resultcache.py) under the CAS number, the
+# details flag and the fingerprint of the loaded source files. Answers with sources that
+# timed out or failed are not cached. Increase RESULT_CACHE_VERSION when the answer changes.
+RESULT_CACHE_VERSION = 3  # 2: columnar tables (see encode_tables), 3: split tables unless ?layout=columnar
+
+
+def result_cache_key(cas_rn, details, layout='split'):
+    details = 'on' if details == 'on' else 'off'  # any other value is no details
+    return f"result:v{RESULT_CACHE_VERSION}:{registry.fingerprint()}:{layout}:{details}:{normalize_cas(cas_rn)}"
+
+
+def cached_answer(key):
+    """The cached (payload, HTTP status) of key, None on a miss or if the tables of its result_id are gone."""
+    cached = resultcache.get(key)
+    if cached is None:
+        return None
+    result_id = cached[0].get("result_id")
+    if result_id and not resultcache.has_tables(result_id):
+        return None  # its download_url would answer 404: compute it again
+    return cached
+
+
+def cached_process_payload(cas_rn, details, compute, layout='split'):
+    """process_payload through the result cache: compute() gives (outputs, timed_out, failed) on a miss.
+
+    Concurrent misses of the same answer, in this process or in others, wait for
+    the first one to compute it (see singleflight.py).
+    """
+    key = result_cache_key(cas_rn, details, layout)
+    cached = cached_answer(key)
+    if cached is not None:
+        return cached
+
+    def compute_and_store():
+        outputs, timed_out, failed = compute()
+        payload, code = process_payload(cas_rn, details, outputs, timed_out, failed, keep=True, layout=layout)
+        if not timed_out and not failed:
+            resultcache.set(key, payload, code)
+        return payload, code
+
+    return singleflight.do(key, compute_and_store, lookup=lambda: cached_answer(key), cache=singleflight.lock_cache())
+
+
+# --- BATCH PROCESS API ---
+# A list of CAS numbers is answered source by source rather than CAS by CAS: each source
+# is joined once with the whole list (one pass over its CAS index, one slice of its table
+# or of the tables it computed at ingest), then the answers are laid out per CAS number
+# exactly as the process API does.
+
+# sources answering with their rows: process API name -> (source, file of the db_name/db_version rows)
+BATCH_TABLE_SOURCES = {
+    'DeepAmes': ('DeepAmes', DEEPAMES_FILE),
+    'Hansen': ('Hansen', HANSEN_FILE),
+    'OECD_vivo': ('OECD_VIVO', OECD_VIVO_FILE),
+    'OECD_Chromosome_vitro': ('OECD_CHROMOSOME', OECD_CHROMOSOME_FILE),
+    'IARC': ('IARC', IARC_FILE),
+    'HOMNA': ('HOMNA', HOMNA_183),
+}
+
+# sources answering from tables computed at ingest: process API name -> (source, the CAS numbers
+# it has data for from its entry, query of one CAS number, answer of the query for a CAS it does not know)
+BATCH_KEYED_SOURCES = {
+    'PPRTV&IRIS': ('PPRTV_IRIS', lambda entry: entry[3].get('tables', {}), lambda cas_rn, details: query_IRIS_PPRTV(cas_rn), None),
+    'AMESCEBS': ('AMESCEBS', lambda entry: entry[1].get('supersummary', {}), query_amescebs, (None, None)),
+    'OpenFoodTox': ('OPENFOODTOX', lambda entry: entry[3].get('substances', {}), lambda cas_rn, details: query_openfoodtox(cas_rn),
+                    (None, None, None, None)),
+    'ECVAM_Neg': ('ECVAM_NEG', lambda entry: entry[3].get('tables', {}), lambda cas_rn, details: query_ecvam_neg(cas_rn), None),
+    'ECVAM_Pos': ('ECVAM_POS', lambda entry: entry[3].get('tables', {}), query_ecvam_pos, None),
+}
+
+BATCH_SOURCE_NAMES = [*BATCH_TABLE_SOURCES, *BATCH_KEYED_SOURCES, 'CCRIS']  # in the order run_batch_queries joins them
+
+
+def validate_cas_list(values):
+    """Splits a list of CAS numbers into the valid ones (normalized, each once, in input order) and the invalid entries."""
+    valid, invalid = {}, []
+    for value in values:
+        cas_rn = normalize_cas(value)
+        if cas_rn and is_valid_cas(cas_rn):
+            valid[cas_rn] = None
+        else:
+            invalid.append(value)
+    return list(valid), invalid
+
+
+# Cactus lookups of the batches: a pool of their own, shared by all the batches of the process,
+# so that Cactus gets a bounded number of requests at a time and the process API queries
+# never wait behind a batch
+cactus_executor = ThreadPoolExecutor(max_workers=getattr(settings, 'BATCH_CACTUS_WORKERS', 4), thread_name_prefix='batch_cactus')
+
+
+def batch_inchikeys(cas_rns):
+    """Resolves the InChIKeys of a list of CAS numbers: ({CAS: InChIKey}, CAS numbers not resolved in time, CAS numbers not asked).
+
+    The identity table, then the InChIKey cache, are read for the whole list at once.
+    Only the CAS numbers neither knows are asked to Cactus, at most BATCH_CACTUS_MAX
+    of them, on cactus_executor and within the CCRIS timeout.
+    """
+    inchikeys = {}
+    rows, identifiers = registry.lookup_many('IDENTITY', cas_rns)
+    if 'InChIKey' in rows.columns:
+        keys = pd.Series(rows['InChIKey'].to_numpy(), index=identifiers).dropna()
+        inchikeys = keys[~keys.index.duplicated()].to_dict()  # the first key of every CAS, as local_inchikey
+
+    cached = cached_inchikeys([cas_rn for cas_rn in cas_rns if cas_rn not in inchikeys])
+    inchikeys.update((cas_rn, inchi_key) for cas_rn, inchi_key in cached.items() if inchi_key)
+    unknown = [cas_rn for cas_rn in cas_rns if cas_rn not in inchikeys and cas_rn not in cached]
+    limit = getattr(settings, 'BATCH_CACTUS_MAX', 200)
+
+    deadline = time.monotonic() + source_timeout('CCRIS')
+    futures = {cas_rn: cactus_executor.submit(cactus_inchikey, cas_rn) for cas_rn in unknown[:limit]}
+    timed_out = []
+    for cas_rn, future in futures.items():
+        try:
+            inchi_key = future.result(timeout=max(deadline - time.monotonic(), 0))
+        except FuturesTimeoutError:
+            future.cancel()
+            timed_out.append(cas_rn)
+            continue
+        if inchi_key:
+            inchikeys[cas_rn] = inchi_key
+    return inchikeys, timed_out, unknown[limit:]
+
+
+def run_batch_queries(cas_rns, details, progress=None):
+    """Joins a list of CAS numbers (normalized, each once) with every source.
+
+    Returns {CAS: (outputs, timed_out, failed)}, what run_source_queries returns for
+    each of them. progress, if given, is called with the name of every source of
+    BATCH_SOURCE_NAMES before it is joined.
+    """
+    answers = {cas_rn: ({}, [], {}) for cas_rn in cas_rns}
+
+    def run(name, cas_rn, query, *args):
+        outputs, _, failed = answers[cas_rn]
+        try:
+            outputs[name] = query(*args)
+        except Exception as e:
+            failed[name] = f"{type(e).__name__}: {e}"
+            print(f"{name}: query failed for {cas_rn}: {e}")
+
+    for name, (source, db_file) in BATCH_TABLE_SOURCES.items():
+        if progress:
+            progress(name)
+        for cas_rn in cas_rns:
+            answers[cas_rn][0][name] = None
+        rows, identifiers = registry.lookup_many(source, cas_rns)
+        rows = add_cas_db_version_identificative(rows, identifiers, db_file)  # for all the CAS numbers at once
+        for cas_rn, dt in rows.groupby(identifiers, sort=False):
+            run(name, cas_rn, dt.transpose)
+
+    for name, (source, known, query, missing) in BATCH_KEYED_SOURCES.items():
+        if progress:
+            progress(name)
+        known_cas = known(registry.entry(source))
+        for cas_rn in cas_rns:
+            if cas_rn in known_cas:
+                run(name, cas_rn, query, cas_rn, details)
+            else:
+                answers[cas_rn][0][name] = missing
+
+    if progress:
+        progress('CCRIS')
+    inchikeys, timed_out, not_asked = batch_inchikeys(cas_rns)
+    timed_out, not_asked = set(timed_out), set(not_asked)
+    known_keys = registry.entry('CCRIS')[1].get('summary', {})
+    for cas_rn in cas_rns:
+        if cas_rn in timed_out:
+            answers[cas_rn][1].append('CCRIS')
+        elif cas_rn in not_asked:
+            answers[cas_rn][2]['CCRIS'] = "InChIKey not resolved: more CAS numbers to ask Cactus than BATCH_CACTUS_MAX"
+        elif inchikeys.get(cas_rn) in known_keys:
+            run('CCRIS', cas_rn, query_ccris, inchikeys[cas_rn], details)
+        else:
+            answers[cas_rn][0]['CCRIS'] = (None, None)
+    return answers
+
+
+def process_batch(cas_rns, details, progress=None, layout='split'):
+    """Screens a list of CAS numbers (normalized, each once): (results, no_hits, incomplete).
+
+    results: {CAS: process API payload} of the CAS numbers found in some source.
+    no_hits: the other CAS numbers, in input order.
+    incomplete: {CAS: {'sources_timed_out', 'sources_failed'}} of the CAS numbers of
+    no_hits some source could not answer for.
+    progress: see run_batch_queries.
+    layout: of the tables of the payloads, see LAYOUTS.
+    """
+    results, no_hits, incomplete = {}, [], {}
+    for cas_rn, (outputs, timed_out, failed) in run_batch_queries(cas_rns, details, progress).items():
+        payload, code = process_payload(cas_rn, details, outputs, timed_out, failed, layout=layout)
+        if code == status.HTTP_200_OK:
+            results[cas_rn] = payload
+            continue
+        no_hits.append(cas_rn)
+        if timed_out or failed:
+            incomplete[cas_rn] = {"sources_timed_out": timed_out, "sources_failed": failed}
+    return results, no_hits, incomplete
+
+
+# --- BULK SCREENING JOBS ---
+# An uploaded CSV of CAS numbers is queued in the SQLite job queue (see jobs.py) and
+# screened by the worker processes of "python manage.py screening_worker", with
+# process_batch, JOBS_CHUNK_SIZE CAS numbers at a time. The results of every chunk are
+# checkpointed in the queue; the output files are written from them at the end.
+
+JOB_SUMMARY_FILE = 'summary.csv'  # one row per CAS number: found or not, the tables with data
+JOB_RESULTS_FILE = 'results.jsonl'  # one line per CAS number found: its process API payload
+JOB_WORKBOOK_FILE = 'results.xlsx'  # a sheet per table, a block per CAS number found (see write_batch_workbook)
+
+
+def read_cas_csv(file):
+    """Returns the CAS numbers of an uploaded CSV: the column whose header contains 'CAS', else the first one."""
+    text = file.read().decode('utf-8-sig')
+    first_line = text.lstrip().split('\n', 1)[0]
+    sep = max(',;\t', key=first_line.count)  # Excel writes ';' with some locales
+    df = pd.read_csv(StringIO(text), sep=sep, header=None, dtype=str, keep_default_na=False, skip_blank_lines=True)
+    header = [value.strip().lower() for value in df.iloc[0]]
+    cas_columns = [i for i, name in enumerate(header) if 'cas' in name]
+    if cas_columns:
+        values = df.iloc[1:, cas_columns[0]]
     else:
-        return JsonResponse({'message': 'No progress information available'})
-        
-        
-        
-        
+        values = df.iloc[:, 0]
+        if not is_valid_cas(normalize_cas(values.iloc[0]) or ''):  # a header without 'CAS' in it
+            values = values.iloc[1:]
+    return [value for value in values if value.strip()]
+
+
+def job_progress(job):
+    """What progress_view reports of a job."""
+    done, total = job['done'], job['total']
+    return {
+        "job_id": job['id'],
+        "status": job['status'],
+        "filename": job['filename'],
+        "total": total,
+        "done": done,
+        "hits": job['hits'],
+        "no_hits": done - job['hits'],
+        "invalid": job['invalid'],
+        "percent": round(100 * done / total, 1) if total else 100.0,
+        "current": job['progress'] or None,  # the CAS numbers being screened and the source being joined
+        "files": {name: reverse('screening_job_file', args=[job['id'], name]) for name in job['files']},
+        "error": job['error'],
+    }
+
+
+def screen_job(job, worker):
+    """Screens the CAS numbers of a claimed job not screened yet, then writes its output files.
+
+    Returns False if the job was taken over by another worker meanwhile (this
+    worker was thought dead): its results are then left to the other one.
+    """
+    job_id, details = job['id'], job['details']
+    chunk_size = getattr(settings, 'JOBS_CHUNK_SIZE', 100)
+    try:
+        while True:
+            items = jobs.pending_items(job_id, chunk_size)
+            if not items:
+                break
+            positions = {cas_rn: position for position, cas_rn in items}
+            current = {"cas_rns": [items[0][1], items[-1][1]], "count": len(items),
+                       "source": None, "sources_done": 0, "sources_total": len(BATCH_SOURCE_NAMES)}
+
+            def progress(name):
+                current.update(source=name, sources_done=BATCH_SOURCE_NAMES.index(name))
+                if not jobs.set_progress(job_id, worker, current):
+                    raise jobs.JobLost(job_id)
+
+            results, no_hits, incomplete = process_batch(list(positions), details, progress)
+            checkpoint = [(positions[cas_rn], True, JSONRenderer().render(payload)) for cas_rn, payload in results.items()]
+            checkpoint += [(positions[cas_rn], False, json.dumps(incomplete[cas_rn]).encode() if cas_rn in incomplete else None)
+                           for cas_rn in no_hits]
+            if not jobs.save_results(job_id, worker, checkpoint):
+                raise jobs.JobLost(job_id)
+
+        def heartbeat(written):  # writing the files of a big job takes a while: keep it this worker's
+            if not jobs.set_progress(job_id, worker, {"source": None, "writing": "output files", "written": written}):
+                raise jobs.JobLost(job_id)
+
+        heartbeat(0)
+        files = write_job_outputs(job, heartbeat)
+        jobs.finish_job(job_id, worker, jobs.DONE, files)
+        print(f"Screening job {job_id}: done")
+        return True
+    except jobs.JobLost:
+        print(f"Screening job {job_id}: taken over by another worker")
+        return False
+    except Exception as e:
+        print(f"Screening job {job_id} failed: {e}")
+        jobs.finish_job(job_id, worker, jobs.FAILED, error=f"{type(e).__name__}: {e}")
+        return False
+
+
+def write_job_outputs(job, heartbeat=None):
+    """Writes the consolidated output files of a job from its checkpointed results; returns their names.
+
+    heartbeat: called with the number of CAS numbers written every JOBS_CHUNK_SIZE of
+    them and before the files are renamed; it raises jobs.JobLost to give up.
+    """
+    folder = jobs.job_dir(job['id'])
+    os.makedirs(folder, exist_ok=True)
+    names = [JOB_SUMMARY_FILE, JOB_RESULTS_FILE, JOB_WORKBOOK_FILE]
+    # written aside under names of this process (a worker taking the job over writes its own), then renamed:
+    # a file that exists is complete
+    summary_tmp, results_tmp, workbook_tmp = tmps = [os.path.join(folder, f".{name}.{os.getpid()}.tmp") for name in names]
+    every = getattr(settings, 'JOBS_CHUNK_SIZE', 100)
+
+    def beat(written):
+        if heartbeat is not None and written % every == 0:
+            heartbeat(written)
+
+    def answers():  # read from the checkpoints one CAS number at a time, however many the job has
+        for written, (cas_rn, _, hit, content) in enumerate(jobs.iter_items(job['id']), 1):
+            beat(written)
+            if hit:
+                answer = json.loads(content)
+                yield cas_rn, decode_tables(answer['data'], answer.get('strings'))
+
+    try:
+        with open(summary_tmp, 'w', newline='', encoding='utf-8') as summary, open(results_tmp, 'wb') as results:
+            writer = csv.writer(summary)
+            writer.writerow(['cas_rn', 'status', 'tables', 'sources_timed_out', 'sources_failed'])
+            for written, (cas_rn, done, hit, content) in enumerate(jobs.iter_items(job['id']), 1):
+                beat(written)
+                answer = json.loads(content) if content else {}
+                tables = [name for name, value in answer.get('data', {}).items() if value is not None]
+                status_text = 'found' if hit else ('no hits' if done else 'not screened')
+                writer.writerow([cas_rn, status_text, '; '.join(tables), '; '.join(answer.get('sources_timed_out', [])),
+                                 '; '.join(answer.get('sources_failed', {}))])
+                if hit:
+                    results.write(content + b'\n')
+            for value in job['invalid']:
+                writer.writerow([value, 'invalid CAS number', '', '', ''])
+        write_batch_workbook(answers(), workbook_tmp)
+        if heartbeat is not None:
+            heartbeat(job['total'])
+    except BaseException:
+        for tmp in tmps:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        raise
+    for tmp, name in zip(tmps, names):
+        os.replace(tmp, os.path.join(folder, name))
+    return names
+
+
+def run_screening_worker(once=False, poll=2.0):
+    """Worker loop: claims the queued screening jobs (and the ones left by dead workers) and screens them.
+
+    once: return when the queue is empty instead of waiting poll seconds for new jobs.
+    """
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+    while True:
+        job = jobs.claim_job(worker)
+        if job is None:
+            if once:
+                return
+            time.sleep(poll)
+            continue
+        print(f"Screening job {job['id']}: {job['total'] - job['done']} CAS numbers to screen")
+        screen_job(job, worker)
+
+
+# --- ASYNC PROCESS API ---
+
+async def aquery_ccris_by_cas(cas_rn, details):
+    """Async version of query_ccris_by_cas: awaits the InChIKey, then queries CCRIS on the executor."""
+    inchi_key = await aresolve_inchikey(cas_rn)
+    if not inchi_key:
+        return None, None
+    return await asyncio.get_running_loop().run_in_executor(query_executor, query_ccris, inchi_key, details)
+
+
+async def arun_source_queries(queries):
+    """Async version of run_source_queries.
+
+    Coroutine functions are awaited on the event loop, plain functions run on the
+    shared query executor. Returns (outputs, timed_out, failed) like run_source_queries.
+    """
+    loop = asyncio.get_running_loop()
+
+    async def run(name, fn):
+        if asyncio.iscoroutinefunction(fn):
+            return await asyncio.wait_for(fn(), timeout=source_timeout(name))
+        return await asyncio.wait_for(loop.run_in_executor(query_executor, fn), timeout=source_timeout(name))
+
+    answers = await asyncio.gather(*(run(name, fn) for name, fn in queries.items()), return_exceptions=True)
+
+    outputs, timed_out, failed = {}, [], {}
+    for name, answer in zip(queries, answers):
+        if isinstance(answer, asyncio.TimeoutError):
+            timed_out.append(name)
+            print(f"{name}: no answer after {source_timeout(name)}s")
+        elif isinstance(answer, Exception):
+            failed[name] = f"{type(answer).__name__}: {answer}"
+            print(f"{name}: query failed: {answer}")
+        else:
+            outputs[name] = answer
+    return outputs, timed_out, failed
+
+
+# --- Django View ---
+def progress_view(request, job_id=None):
+    """Progress of a screening job, by default of the last one submitted in this session."""
+    job_id = job_id or request.session.get('screening_job')
+    job = jobs.get_job(job_id) if job_id else None
+    if job is None:
+        return JsonResponse({'message': 'No progress information available'}, status=status.HTTP_404_NOT_FOUND)
+    return JsonResponse(job_progress(job))
+
+
+def job_file_view(request, job_id, name):
+    """Downloads an output file of a finished screening job."""
+    job = jobs.get_job(job_id)
+    if job is None or name not in job['files']:  # only the names the worker wrote: no path from the URL
+        raise Http404("No such file")
+    return FileResponse(open(os.path.join(jobs.job_dir(job_id), name), 'rb'), as_attachment=True, filename=f"{job_id}_{name}")
 
-import json
-import numpy as np
-import pandas as pd
-from io import BytesIO
-from rest_framework.response import Response
-from rest_framework import status
-from rest_framework.views import APIView
-from django.http import HttpResponse
 
 class ProcessAPIView(APIView):
     def post(self, request, format=None):
@@ -1372,85 +2668,175 @@ class ProcessAPIView(APIView):
         if not cas_rn or not is_valid_cas(cas_rn):
             return Response({"error": "invalid CAS number"}, status=status.HTTP_400_BAD_REQUEST)
 
-        inchi_key = str(fetch_url_content(cas_rn)).replace('InChIKey=', '')
-        results = {}
-
-        if cas_rn:
-            results.update({
-                'DeepAmes': query_deepames(cas_rn),
-                'Hansen': query_hansen(cas_rn),
-                'OECD_vivo': query_oecd_vivo(cas_rn),
-                'OECD_Chromosome_vitro': query_oecd_chromosome(cas_rn),
-                'IARC': query_iarc(cas_rn),
-                'PPRTV&IRIS': query_IRIS_PPRTV(cas_rn),
-                'HOMNA': query_homna(cas_rn),
-            })
-
-        amescebs_summary, amescebs_supersummary = query_amescebs(cas_rn, details)
-        results['AMESCEBS_supersummary'] = amescebs_supersummary
-        results['AMESCEBS_summary'] = amescebs_summary
+        layout = answer_layout(request.query_params)
+        if layout is None:
+            return Response({"error": f"layout must be one of {', '.join(LAYOUTS)}"}, status=status.HTTP_400_BAD_REQUEST)
 
-        opf_genotox_summary, opf_genotox_ref, opf_refpoint_ref, opf_refvalue_ref = query_openfoodtox(cas_rn)
-        results['OpenFoodTox_genotox_summary'] = opf_genotox_summary
-        results['OpenFoodTox_genotox_ref'] = opf_genotox_ref
-        results['OpenFoodTox_refpoint_ref'] = opf_refpoint_ref
-        results['OpenFoodTox_refvalue_ref'] = opf_refvalue_ref
+        # every source is queried in parallel (CCRIS after the Cactus InChIKey resolution), unless the answer is cached
+        payload, code = cached_process_payload(cas_rn, details, lambda: run_source_queries(source_queries(cas_rn, details)), layout)
+        return Response(payload, status=code)
 
-        ecvam_neg_results = query_ecvam_neg(cas_rn)
-        if ecvam_neg_results:
-            results.update(ecvam_neg_results)
 
-        ecvam_pos_results = query_ecvam_pos(cas_rn, details)
-        if ecvam_pos_results:
-            results.update(ecvam_pos_results)
+class BatchProcessAPIView(APIView):
+    """Screens a list of CAS numbers (e.g. a supplier inventory) in one request.
 
-        if inchi_key:
-            ccris_dg, ccris_summary = query_ccris(inchi_key, details)
-            if details == 'on' and ccris_dg:
-                for i, df in enumerate(ccris_dg):
-                    if isinstance(df, pd.DataFrame):
-                        df = add_cas_db_version_identificative(df, cas_rn, CCRIS_FILE)
-                        df = df.transpose()
-                        df.replace({np.nan: None}, inplace=True)  # Fix NaN issue
-                        ccris_dg[i] = df  
-
-            if isinstance(ccris_summary, pd.DataFrame):
-                ccris_summary = add_cas_db_version_identificative(ccris_summary, cas_rn, CCRIS_FILE)
-                ccris_summary = ccris_summary.transpose()
-                ccris_summary.replace({np.nan: None}, inplace=True)  # Fix NaN issue
-
-            results['CCRIS_Summary'] = ccris_summary
-            results['CCRIS_Data'] = ccris_dg
-
-        # Ensure there is at least some data
-        all_empty = all(result is None or 
-                        (isinstance(result, tuple) and all(r is None or (hasattr(r, 'empty') and r.empty) for r in result)) or 
-                        (hasattr(result, 'empty') and result.empty)
-                        for result in results.values())
-
-        if all_empty:
-            return Response({"error": "No data for the CAS submitted"}, status=status.HTTP_404_NOT_FOUND)
-
-        # Process and clean the results
-        processed_data = process_results(results)
-    
+    Body: {"cas_rns": [...], "details": ...}, cas_rns being a list or a string of CAS
+    numbers separated by spaces, commas or semicolons. The answer has the process API
+    payload of every CAS number found in some source ("results"), the CAS numbers found
+    nowhere ("no_hits") and the entries that are not valid CAS numbers ("invalid").
+    The tables come in the layout of ?layout= (see LAYOUTS), as in the process API.
+    """
+    def post(self, request, format=None):
+        values = request.data.get('cas_rns')
+        details = request.data.get('details')
+        layout = answer_layout(request.query_params)
+        if layout is None:
+            return Response({"error": f"layout must be one of {', '.join(LAYOUTS)}"}, status=status.HTTP_400_BAD_REQUEST)
+        if isinstance(values, str):
+            values = [value for value in re.split(r'[\s,;]+', values) if value]
+        if not isinstance(values, list) or not values:
+            return Response({"error": "cas_rns must be a list of CAS numbers"}, status=status.HTTP_400_BAD_REQUEST)
+        max_cas = getattr(settings, 'BATCH_MAX_CAS', 10000)
+        if len(values) > max_cas:
+            return Response({"error": f"at most {max_cas} CAS numbers per request"}, status=status.HTTP_400_BAD_REQUEST)
+
+        cas_rns, invalid = validate_cas_list(values)
+        if not cas_rns:
+            return Response({"error": "no valid CAS number", "invalid": invalid}, status=status.HTTP_400_BAD_REQUEST)
+
+        results, no_hits, incomplete = process_batch(cas_rns, details, layout=layout)
         return Response({
-            "cas_rn": cas_rn,
-            "data": processed_data,
-            "download_ready": True
+            "results": results,
+            "no_hits": no_hits,
+            "invalid": invalid,
+            "incomplete": incomplete,
         }, status=status.HTTP_200_OK)
 
 
+class ScreeningJobsAPIView(APIView):
+    """Queues the screening of an uploaded CSV of CAS numbers (multipart: "file" and "details").
+
+    The CAS numbers are screened in the background by the screening_worker processes;
+    the answer gives the id of the job and the URL of its progress.
+    """
+    def post(self, request, format=None):
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({"error": "no CSV file uploaded"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            values = read_cas_csv(upload)
+        except (ValueError, UnicodeDecodeError) as e:  # pandas parser errors are ValueErrors
+            return Response({"error": f"unreadable CSV file: {e}"}, status=status.HTTP_400_BAD_REQUEST)
+        max_cas = getattr(settings, 'JOBS_MAX_CAS', 100000)
+        if len(values) > max_cas:
+            return Response({"error": f"at most {max_cas} CAS numbers per job"}, status=status.HTTP_400_BAD_REQUEST)
+
+        cas_rns, invalid = validate_cas_list(values)
+        if not cas_rns:
+            return Response({"error": "no valid CAS number", "invalid": invalid}, status=status.HTTP_400_BAD_REQUEST)
+
+        job_id = jobs.create_job(cas_rns, invalid, request.data.get('details'), upload.name)
+        request.session['screening_job'] = job_id  # progress_view without a job id reports this one
+        return Response({
+            "job_id": job_id,
+            "total": len(cas_rns),
+            "invalid": invalid,
+            "progress_url": reverse('screening_job_progress', args=[job_id]),
+        }, status=status.HTTP_202_ACCEPTED)
+
+
+@csrf_exempt
+@require_POST
+async def process_api_async(request):
+    """Async variant of ProcessAPIView, to be served by an ASGI server (e.g. uvicorn myproject.asgi:application).
+
+    The Cactus InChIKey resolution is awaited on the event loop and the local
+    lookups run on the shared query executor, so one worker serves many
+    requests at the same time. Same input and output as ProcessAPIView, through
+    the same result cache and single flight (cached_process_payload).
+    """
+    try:
+        if request.content_type == 'application/json':
+            data = json.loads(request.body or b'{}')
+        else:
+            data = request.POST
+    except ValueError:
+        return JsonResponse({"error": "invalid JSON body"}, status=status.HTTP_400_BAD_REQUEST)
+    cas_rn = data.get('cas_rn')
+    details = data.get('details')
+
+    if not cas_rn or not is_valid_cas(cas_rn):
+        return JsonResponse({"error": "invalid CAS number"}, status=status.HTTP_400_BAD_REQUEST)
+    layout = answer_layout(request.GET)
+    if layout is None:
+        return JsonResponse({"error": f"layout must be one of {', '.join(LAYOUTS)}"}, status=status.HTTP_400_BAD_REQUEST)
+
+    loop = asyncio.get_running_loop()
+
+    def compute():  # on a miss, from the thread below: the queries are awaited on the event loop
+        queries = source_queries(cas_rn, details)
+        queries['CCRIS'] = partial(aquery_ccris_by_cas, cas_rn, details)
+        return asyncio.run_coroutine_threadsafe(arun_source_queries(queries), loop).result()
+
+    # the result cache, the single flight and the building of the tables are blocking work: they run in a thread
+    # of the default executor, not of the query executor, whose threads answer the queries this one waits for
+    payload, code = await loop.run_in_executor(None, cached_process_payload, cas_rn, details, compute, layout)
+    content = await loop.run_in_executor(query_executor, JSONRenderer().render, payload)  # same encoding as DRF
+    return HttpResponse(content, content_type='application/json', status=code)
+
+
+class ReloadSourcesAPIView(APIView):
+    """Re-ingests the sources whose files changed (POST) and reports the last reload (GET). Admin users only."""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response({"last_reload": registry.last_reload}, status=status.HTTP_200_OK)
+
+    def post(self, request):
+        started = registry.reload_in_background()
+        return Response({"reload_started": started, "last_reload": registry.last_reload},
+                        status=status.HTTP_202_ACCEPTED if started else status.HTTP_409_CONFLICT)
+
+
+def workbook_response(tables, cas_rn):
+    """Streams the workbook of the tables from a temporary file (see write_workbook), closed and deleted once sent."""
+    return FileResponse(
+        workbook_file(write_workbook, tables),
+        as_attachment=True,
+        filename=f"{cas_rn}_results.xlsx",
+        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    )
+
+
 class DownloadAPIView(APIView):
+    def get(self, request, result_id=None, format=None):
+        """Workbook of an answer of the process API, from the result_id it gave."""
+        if not result_id:
+            return Response({"error": "result_id missing"}, status=status.HTTP_400_BAD_REQUEST)
+        stored = resultcache.get_tables(result_id)
+        if stored is None:
+            return Response({"error": "unknown or expired result_id: process the CAS number again"},
+                            status=status.HTTP_404_NOT_FOUND)
+        try:
+            return workbook_response(stored['tables'], stored['cas_rn'])
+        except Exception as e:
+            return Response(
+                {"error": f"Error generating Excel file: {str(e)}"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
     def post(self, request, format=None):
         try:
             data = request.data.get('data', {})
             cas_rn = request.data.get('cas_rn', 'unknown')
+            if 'strings' in request.data:  # an answer of the process API with ?layout=columnar as it is (see encode_tables)
+                return workbook_response(decode_tables(data, request.data['strings']), cas_rn)
 
             results = {}
 
             for sheet_name, sheet_data in data.items():
                 print(f"Processing sheet: {sheet_name}, Type: {type(sheet_data)}")  # Debugging
+
                 
                 # Handling PPRTV&IRIS Multi-Index case
                 if isinstance(sheet_data, dict) and "is_multiindex" in sheet_data and sheet_data["is_multiindex"]:
@@ -1502,23 +2888,7 @@ class DownloadAPIView(APIView):
                     results[sheet_name] = sheet_data
 
             # Generate Excel file
-            output = BytesIO()
-            with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                for sheet_name, result in results.items():
-                    if isinstance(result, pd.DataFrame):
-                        result.to_excel(writer, sheet_name=sheet_name[:31], index=True)
-                    elif isinstance(result, list):
-                        for idx, df in enumerate(result):
-                            df.to_excel(writer, sheet_name=f"{sheet_name[:28]}_{idx}", index=True)
-
-            output.seek(0)
-
-            response = HttpResponse(
-                output.getvalue(),
-                content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-            )
-            response['Content-Disposition'] = f'attachment; filename="{cas_rn}_results.xlsx"'
-            return response
+            return workbook_response(results, cas_rn)
 
         except KeyError as e:
             return Response(
@@ -14,3 +14,11 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "myproject.settings")
 
 application = get_asgi_application()
+
+# Read and clean every source database once, before the first request is served,
+# then reload the ones whose files change
+from django.conf import settings  # noqa: E402
+from myapp.views import registry  # noqa: E402
+
+registry.load_all()
+registry.watch(getattr(settings, 'SOURCE_WATCH_INTERVAL', 0))
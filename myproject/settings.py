@@ -83,11 +83,39 @@ DATABASES = {
     }
 }
 
+# A DatabaseCache culls a third of its entries, in key order, once it holds MAX_ENTRIES:
+# the answers of the process API, the single-flight locks and the Cactus InChIKeys have
+# a table each, so that the many answers never evict the locks or the InChIKeys.
+# Create the tables with "python manage.py createcachetable".
 CACHES = {
     "default": {
         "BACKEND": "django.core.cache.backends.db.DatabaseCache",
         "LOCATION": "my_cache_table",
-    }
+    },
+    "results": {  # RESULT_CACHE
+        "BACKEND": "django.core.cache.backends.db.DatabaseCache",
+        "LOCATION": "result_cache_table",
+        "TIMEOUT": 24 * 3600,
+        "OPTIONS": {"MAX_ENTRIES": 20000},
+    },
+    "result_tables": {  # RESULT_HANDLE_CACHE: more entries than "results", every cached answer has its tables
+        "BACKEND": "django.core.cache.backends.db.DatabaseCache",
+        "LOCATION": "result_tables_cache_table",
+        "TIMEOUT": 2 * 24 * 3600,
+        "OPTIONS": {"MAX_ENTRIES": 30000},
+    },
+    "locks": {  # SINGLE_FLIGHT_CACHE
+        "BACKEND": "django.core.cache.backends.db.DatabaseCache",
+        "LOCATION": "lock_cache_table",
+        "TIMEOUT": 60,
+        "OPTIONS": {"MAX_ENTRIES": 10000},
+    },
+    "inchikeys": {  # INCHIKEY_CACHE
+        "BACKEND": "django.core.cache.backends.db.DatabaseCache",
+        "LOCATION": "inchikey_cache_table",
+        "TIMEOUT": 30 * 24 * 3600,
+        "OPTIONS": {"MAX_ENTRIES": 200000},
+    },
 }
 
 
@@ -133,6 +161,65 @@ STATIC_URL = '/static/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 MEDIA_URL = '/media/'
 
+# Parquet snapshot of the cleaned source tables (python manage.py build_snapshot)
+SNAPSHOT_DIR = os.path.join(BASE_DIR, 'myproject', 'snapshot')
+
+# The process API queries the sources in parallel: size of the shared thread pool
+# and seconds each source may take (CCRIS includes the Cactus InChIKey resolution)
+SOURCE_QUERY_WORKERS = 8
+SOURCE_QUERY_TIMEOUT = 15
+SOURCE_QUERY_TIMEOUTS = {'CCRIS': 15}
+
+# Seconds between two checks of the source files: changed sources are re-ingested
+# in the background without restarting the server (0 disables the watcher)
+SOURCE_WATCH_INTERVAL = 60
+
+# CAS -> InChIKey resolution (NCI Cactus), cached in the "inchikeys" cache (inchikey_cache_table, see CACHES):
+# InChIKeys for 30 days, CAS numbers Cactus does not know for 1 day
+CACTUS_URL = "https://cactus.nci.nih.gov/chemical/structure/{}/stdinchikey"
+INCHIKEY_CACHE = 'inchikeys'
+INCHIKEY_CACHE_TTL = 30 * 24 * 3600
+INCHIKEY_NEGATIVE_TTL = 24 * 3600
+
+# Answers of the process API: an LRU in the memory of every process (bounded by the
+# size of the answers) in front of the RESULT_CACHE cache, shared by all processes.
+# A day at most, so that a Cactus lookup that failed is retried (CCRIS)
+RESULT_CACHE = 'results'
+RESULT_CACHE_LOCAL_BYTES = 64 * 1024 * 1024
+RESULT_CACHE_TTL = 24 * 3600
+# tables of the answers, for the download API (GET myapp/api/download/<result_id>/), in
+# their own cache: a result_id stays valid RESULT_HANDLE_TTL seconds after the answer was
+# computed, longer than the cached answers giving it (an answer whose tables were culled
+# is computed again rather than served with a dead download_url)
+RESULT_HANDLE_CACHE = 'result_tables'
+RESULT_HANDLE_TTL = 2 * 24 * 3600
+
+# Concurrent requests for the same answer wait for the one computing it (in this process,
+# or in another one through a lock in SINGLE_FLIGHT_CACHE): at most SINGLE_FLIGHT_WAIT seconds,
+# looking for the answer every SINGLE_FLIGHT_POLL seconds
+SINGLE_FLIGHT_CACHE = 'locks'
+SINGLE_FLIGHT_WAIT = 60
+SINGLE_FLIGHT_POLL = 0.1
+
+# Most CAS numbers the batch process API accepts in one request
+BATCH_MAX_CAS = 10000
+
+# The batches ask Cactus the InChIKeys that are neither in the identity table nor cached:
+# threads doing so at a time (for all the batches of a process), most CAS numbers asked per
+# batch (the others get CCRIS in their sources_failed)
+BATCH_CACTUS_WORKERS = 4
+BATCH_CACTUS_MAX = 200
+
+# Bulk screening jobs (python manage.py screening_worker): SQLite queue, folder of the
+# output files, worker processes, CAS numbers screened (and checkpointed) at a time,
+# seconds without heartbeat after which a job is resumed by another worker
+JOBS_DB = os.path.join(BASE_DIR, 'jobs.sqlite3')
+JOBS_DIR = os.path.join(BASE_DIR, 'myproject', 'jobs')
+JOBS_WORKERS = 2
+JOBS_CHUNK_SIZE = 100
+JOBS_STALE_AFTER = 300
+JOBS_MAX_CAS = 100000
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
\ No newline at end of file